@@ -0,0 +1,366 @@
+"""Ressources statiques empreintées et précompressées.
+
+``construire`` copie chaque fichier de ``static/jeux`` (et ``static/style.css``)
+dans ``static/build`` sous un nom qui contient l'empreinte de son contenu
+(``horizon.3f2a1b9c.css``), écrit à côté ses variantes ``.gz`` et ``.br`` pour
+les formats textuels, et consigne la correspondance dans ``manifest.json``.
+Les gabarits obtiennent l'URL empreintée avec ``asset('jeux/horizon/horizon.css')``.
+Les images des jeux sont en outre déclinées en AVIF et WebP à plusieurs
+largeurs (``ds9_images``) ; ``fond('jeux/horizon/images/rdc.png')`` produit le
+CSS d'un fond d'écran qui choisit la déclinaison adaptée, et
+``image('jeux/horizon/images/Chloe.png', alt='Chloé')`` la balise ``<picture>``
+d'une image du contenu. Le filtre ``images_adaptees`` applique ce dernier aux
+``<img>`` du HTML saisi dans l'éditeur.
+
+Une URL empreintée ne désigne jamais qu'un seul contenu : ``StaticEmpreintes``
+la sert avec ``Cache-Control: immutable`` pour un an, en choisissant la
+variante précompressée d'après ``Accept-Encoding``. Le navigateur ne la
+redemande plus ; une ressource modifiée change d'URL à la construction
+suivante.
+
+    python ds9_assets.py
+"""
+
+import functools
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+import time
+import uuid
+
+import re
+
+import anyio
+from markupsafe import Markup, escape
+from starlette.responses import FileResponse
+from starlette.staticfiles import StaticFiles
+
+from ds9_images import css_fond, decliner, est_declinable, html_picture
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+RACINE = "static"
+SOURCES = ("jeux", "style.css")
+BUILD = "build"
+MANIFESTE = os.path.join(RACINE, BUILD, "manifest.json")
+# Les médias (images, sons) sont déjà compressés
+A_COMPRESSER = {".css", ".js", ".html", ".svg", ".json", ".txt", ".xml"}
+IGNORES = {"__pycache__", ".py", ".pyc", ".php"}
+# Le cache TTS est adressé par contenu : ses URL sont immuables elles aussi
+IMMUABLES = (f"{BUILD}/", "cache/tts/")
+CACHE_IMMUABLE = "public, max-age=31536000, immutable"
+MOTIF_IMG = re.compile(r"<img\b[^>]*>", re.IGNORECASE)
+MOTIF_SRC = re.compile(r"""(\bsrc\s*=\s*)(["'])(.*?)\2""", re.IGNORECASE | re.DOTALL)
+MOTIF_LARGEUR = re.compile(r"""\bwidth\s*=\s*["']?(\d+)""", re.IGNORECASE)
+# Une version périmée reste servie ce délai (secondes) : les pages déjà
+# affichées ou en cours de rendu peuvent encore la demander
+DELAI_PURGE = int(os.getenv("ASSETS_DELAI_PURGE", "3600"))
+
+_verrou = threading.Lock()
+
+
+def _ignore(chemin: str) -> bool:
+    nom = os.path.basename(chemin)
+    return nom in IGNORES or os.path.splitext(nom)[1] in IGNORES or nom.startswith(".")
+
+
+def _sources(racine: str):
+    for source in SOURCES:
+        chemin = os.path.join(racine, source)
+        if os.path.isfile(chemin):
+            yield chemin
+            continue
+        for dossier, sous_dossiers, fichiers in os.walk(chemin):
+            sous_dossiers[:] = [d for d in sous_dossiers if not _ignore(d)]
+            for fichier in sorted(fichiers):
+                if not _ignore(fichier):
+                    yield os.path.join(dossier, fichier)
+
+
+def _ecrire_si_absent(chemin: str, produire) -> bool:
+    """Écrit ``produire()`` dans ``chemin`` s'il n'existe pas ; vrai si écrit."""
+    if os.path.exists(chemin):
+        return False
+    tmp = f"{chemin}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(produire())
+    os.replace(tmp, chemin)
+    return True
+
+
+def _lire(chemin: str) -> bytes:
+    with open(chemin, "rb") as f:
+        return f.read()
+
+
+def _lire_manifeste(chemin: str) -> dict:
+    try:
+        with open(chemin, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def construire(racine: str = RACINE) -> dict:
+    """Empreinte et précompresse les ressources ; renvoie le manifeste écrit.
+
+    Le manifeste associe à chaque ressource son chemin empreinté
+    (``fichiers``) et, pour les images des jeux, ses déclinaisons
+    (``images``). Un fichier dont la taille et la date n'ont pas changé depuis
+    la construction précédente (``sources``) n'est ni relu ni réempreinté ;
+    les fichiers déjà construits ne sont pas réécrits, et le manifeste n'est
+    réécrit que s'il change. Les versions périmées sont supprimées
+    ``DELAI_PURGE`` secondes après avoir été remplacées (``perimes`` date ce
+    remplacement).
+
+    L'éditeur construit au démarrage puis après chaque enregistrement d'un jeu
+    ou d'une page, pour prendre en compte les fichiers déposés dans
+    ``static/jeux`` entre-temps ; le jeu se contente de relire le manifeste.
+    """
+    with _verrou:
+        return _construire(racine)
+
+
+def construire_si_absent(racine: str = RACINE) -> None:
+    """Construit les ressources si aucun manifeste n'existe encore."""
+    if not os.path.exists(os.path.join(racine, BUILD, "manifest.json")):
+        construire(racine)
+
+
+def _construire(racine: str) -> dict:
+    sortie = os.path.join(racine, BUILD)
+    chemin_manifeste = os.path.join(sortie, "manifest.json")
+    precedent = _lire_manifeste(chemin_manifeste)
+    connues: dict[str, list] = precedent.get("sources", {})
+    manifeste: dict[str, str] = {}
+    images: dict[str, list[dict]] = {}
+    sources: dict[str, list] = {}
+    produits: set[str] = set()
+    for chemin in _sources(racine):
+        relatif = os.path.relpath(chemin, racine).replace(os.sep, "/")
+        st = os.stat(chemin)
+        connue = connues.get(relatif)
+        if connue and connue[:2] == [st.st_size, st.st_mtime_ns]:
+            # Inchangé : le fichier n'est relu que si un produit manque
+            empreinte = connue[2]
+            contenu = functools.cache(functools.partial(_lire, chemin))
+        else:
+            octets = _lire(chemin)
+            empreinte = hashlib.sha256(octets).hexdigest()[:12]
+            contenu = lambda octets=octets: octets
+        sources[relatif] = [st.st_size, st.st_mtime_ns, empreinte]
+        base, extension = os.path.splitext(relatif)
+        construit = f"{BUILD}/{base}.{empreinte}{extension}"
+        cible = os.path.join(racine, construit)
+        os.makedirs(os.path.dirname(cible), exist_ok=True)
+        variantes = [(cible, contenu)]
+        if extension.lower() in A_COMPRESSER:
+            variantes.append((f"{cible}.gz", lambda c=contenu: gzip.compress(c(), 9, mtime=0)))
+            if brotli is not None:
+                variantes.append((f"{cible}.br", lambda c=contenu: brotli.compress(c(), quality=11)))
+        for fichier, produire in variantes:
+            _ecrire_si_absent(fichier, produire)
+            produits.add(os.path.abspath(fichier))
+        if est_declinable(relatif):
+            anciennes = precedent.get("images", {}).get(relatif)
+            if connue == sources[relatif] and anciennes and all(
+                os.path.exists(os.path.join(racine, v["url"])) for v in anciennes
+            ):
+                images[relatif] = anciennes
+            else:
+                images[relatif] = []
+                for variante, mime, largeur in decliner(chemin, os.path.splitext(cible)[0]):
+                    url = os.path.relpath(variante, racine).replace(os.sep, "/")
+                    images[relatif].append({"url": url, "type": mime, "largeur": largeur})
+            produits.update(os.path.abspath(os.path.join(racine, v["url"])) for v in images[relatif])
+        manifeste[relatif] = construit
+
+    os.makedirs(sortie, exist_ok=True)
+    produits.add(os.path.abspath(chemin_manifeste))
+    anciens = precedent.get("perimes", {})
+    maintenant = time.time()
+    perimes: dict[str, float] = {}
+    for dossier, _, fichiers in os.walk(sortie):
+        for fichier in fichiers:
+            chemin = os.path.abspath(os.path.join(dossier, fichier))
+            # Les « .tmp » sont peut-être en cours d'écriture par un autre processus
+            if chemin in produits or fichier.endswith(".tmp"):
+                continue
+            relatif = os.path.relpath(chemin, sortie).replace(os.sep, "/")
+            depuis = anciens.get(relatif, maintenant)
+            if maintenant - depuis >= DELAI_PURGE:
+                os.remove(chemin)
+            else:
+                perimes[relatif] = depuis
+    document = {"fichiers": manifeste, "images": images, "perimes": perimes, "sources": sources}
+    # Un manifeste inchangé garde sa date : les pages en cache restent valides
+    if document != precedent:
+        tmp = f"{chemin_manifeste}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(document, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp, chemin_manifeste)
+    print(
+        f"[DEBUG] Ressources statiques construites : {len(manifeste)} fichiers, "
+        f"{len(images)} images déclinées"
+    )
+    return document
+
+
+class Manifeste:
+    """URL empreintées, relues quand ``manifest.json`` change."""
+
+    def __init__(self, chemin: str = MANIFESTE, prefixe: str = "/static/"):
+        self.chemin = chemin
+        self.prefixe = prefixe
+        self._entrees: dict[str, str] = {}
+        self._images: dict[str, list[dict]] = {}
+        self._date = None
+
+    def _recharger(self) -> None:
+        try:
+            date = os.stat(self.chemin).st_mtime_ns
+        except FileNotFoundError:
+            self._entrees, self._images, self._date = {}, {}, None
+            return
+        if date != self._date:
+            with open(self.chemin, encoding="utf-8") as f:
+                document = json.load(f)
+            self._entrees = document.get("fichiers", {})
+            self._images = document.get("images", {})
+            self._date = date
+
+    def revision(self) -> int:
+        """Identifie le manifeste en vigueur ; change à chaque construction."""
+        self._recharger()
+        return self._date or 0
+
+    def url(self, chemin: str) -> str:
+        """URL empreintée de ``chemin`` (relatif à ``static``), sinon l'URL simple."""
+        self._recharger()
+        chemin = chemin.lstrip("/")
+        return self.prefixe + self._entrees.get(chemin, chemin)
+
+    def fond(self, chemin: str, selecteur: str = "body"):
+        """CSS du fond ``selecteur`` : déclinaisons de l'image ``chemin``, avec repli."""
+        repli = self.url(chemin)
+        return css_fond(repli, self._variantes(chemin.lstrip("/")), selecteur)
+
+    def _variantes(self, chemin: str) -> list[dict]:
+        return [{**v, "url": self.prefixe + v["url"]} for v in self._images.get(chemin, [])]
+
+    def image(self, chemin: str, alt: str = "", **attributs) -> Markup:
+        """``<picture>`` de l'image ``chemin`` : déclinaisons AVIF/WebP, puis l'original.
+
+        Les ``attributs`` vont sur la balise ``<img>`` (``class_`` pour
+        ``class``) ; ``width`` en pixels sert aussi de ``sizes``.
+        """
+        html = f'<img src="{escape(self.url(chemin))}" alt="{escape(alt)}"'
+        for nom, valeur in attributs.items():
+            html += f' {nom.rstrip("_").replace("_", "-")}="{escape(valeur)}"'
+        largeur = attributs.get("width")
+        sizes = f"{largeur}px" if str(largeur).isdigit() else "100vw"
+        return html_picture(html + ">", self._variantes(chemin.lstrip("/")), sizes)
+
+    def images_contenu(self, html: str | None) -> Markup:
+        """Remplace dans ``html`` les ``<img>`` des ressources par leur ``<picture>``.
+
+        Seules les images servies sous ``prefixe`` et connues du manifeste sont
+        touchées : leur ``src`` devient l'URL empreintée et leurs déclinaisons
+        sont proposées. Les autres balises restent telles quelles.
+        """
+        self._recharger()
+
+        def remplacer(correspondance: re.Match) -> str:
+            img = correspondance.group(0)
+            src = MOTIF_SRC.search(img)
+            if not src or not src.group(3).startswith(self.prefixe):
+                return img
+            chemin = src.group(3)[len(self.prefixe):]
+            if chemin not in self._entrees:
+                return img
+            img = img[: src.start(3)] + self.url(chemin) + img[src.end(3) :]
+            largeur = MOTIF_LARGEUR.search(img)
+            sizes = f"{largeur.group(1)}px" if largeur else "100vw"
+            return html_picture(img, self._variantes(chemin), sizes)
+
+        return Markup(MOTIF_IMG.sub(remplacer, html or ""))
+
+
+manifeste = Manifeste()
+
+
+def activer_assets(templates) -> None:
+    """Expose ``asset``, ``fond`` et ``image`` aux gabarits, et le filtre ``images_adaptees``."""
+    templates.env.globals["asset"] = manifeste.url
+    templates.env.globals["fond"] = manifeste.fond
+    templates.env.globals["image"] = manifeste.image
+    templates.env.filters["images_adaptees"] = manifeste.images_contenu
+
+
+def encodages_acceptes(entete: str) -> list[str]:
+    """Variantes précompressées (``br``, ``gzip``) acceptées par ``Accept-Encoding``.
+
+    Les codages sont lus avec leur facteur ``q`` : ``q=0`` refuse un codage,
+    ``*`` vaut pour ceux qui ne sont pas nommés. Renvoie les codages acceptés,
+    du préféré au moins préféré (``br`` d'abord à facteur égal).
+    """
+    facteurs: dict[str, float] = {}
+    for element in entete.split(","):
+        codage, *parametres = (p.strip() for p in element.split(";"))
+        if not codage:
+            continue
+        q = 1.0
+        for parametre in parametres:
+            nom, _, valeur = parametre.partition("=")
+            if nom.strip().lower() == "q":
+                try:
+                    q = float(valeur)
+                except ValueError:
+                    q = 0.0
+        facteurs[codage.lower()] = q
+    joker = facteurs.get("*", 0.0)
+    acceptes = [(facteurs.get(c, joker), -i, c) for i, c in enumerate(("br", "gzip"))]
+    return [c for q, _, c in sorted(acceptes, reverse=True) if q > 0]
+
+
+class StaticEmpreintes(StaticFiles):
+    """``StaticFiles`` servant les ressources empreintées comme immuables.
+
+    Pour une URL empreintée, la variante ``.br`` ou ``.gz`` est servie si le
+    navigateur l'accepte. Les autres fichiers doivent être revalidés
+    (``no-cache``) : leur ETag évite de les retélécharger s'ils n'ont pas
+    changé.
+    """
+
+    async def get_response(self, path: str, scope):
+        chemin = path.replace(os.sep, "/")
+        if not chemin.startswith(IMMUABLES):
+            response = await super().get_response(path, scope)
+            response.headers.setdefault("Cache-Control", "no-cache")
+            return response
+
+        entetes = dict(scope["headers"])
+        acceptes = encodages_acceptes(entetes.get(b"accept-encoding", b"").decode("latin-1"))
+        for encodage in acceptes:
+            suffixe = ".br" if encodage == "br" else ".gz"
+            complet, stat = await anyio.to_thread.run_sync(self.lookup_path, path + suffixe)
+            if stat is not None:
+                media = mimetypes.guess_type(path)[0] or "application/octet-stream"
+                response = FileResponse(complet, stat_result=stat, media_type=media)
+                response.headers["Content-Encoding"] = encodage
+                break
+        else:
+            response = await super().get_response(path, scope)
+        response.headers["Cache-Control"] = CACHE_IMMUABLE
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+if __name__ == "__main__":
+    construire()
@@ -0,0 +1,93 @@
+"""Cache des pages de jeu déjà rendues.
+
+Une page sans PNJ produit le même HTML pour tous les joueurs tant que le jeu
+ne change pas. Son rendu est conservé sous la clé ``(jeu, page, version du
+jeu, révision des ressources)`` avec une ETag forte (empreinte du corps) : les affichages suivants ne
+relancent ni Jinja ni la synthèse vocale, et un navigateur qui présente la
+même ETag (``If-None-Match``) reçoit un simple 304. La révision du manifeste
+des ressources (``ds9_assets.manifeste.revision``) fait partie de la clé : une
+page rendue avec d'anciennes URL empreintées n'est plus servie après une
+reconstruction. La page retient aussi les audios du cache TTS qu'elle cite :
+``jouer`` les rafraîchit à chaque service, et rend de nouveau la page si l'un
+d'eux a été purgé.
+
+Les gabarits Jinja compilés sont en outre conservés sur disque
+(``activer_cache_jinja``) : un processus qui démarre ne les recompile pas.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from jinja2 import FileSystemBytecodeCache
+
+# Nombre maximal de pages rendues conservées
+MAX_PAGES = int(os.getenv("PAGES_CACHE_MAX", "1000"))
+DOSSIER_JINJA = os.getenv("JINJA_CACHE_DOSSIER", os.path.join("cache", "jinja"))
+
+
+def activer_cache_jinja(templates, dossier: str = DOSSIER_JINJA) -> None:
+    """Conserve sur disque le bytecode des gabarits de ``templates``."""
+    os.makedirs(dossier, exist_ok=True)
+    templates.env.bytecode_cache = FileSystemBytecodeCache(dossier)
+
+
+class PageRendue:
+    __slots__ = ("corps", "etag", "entetes", "audios")
+
+    def __init__(self, corps: bytes, entetes: dict[str, str], audios: tuple[str, ...] = ()):
+        self.corps = corps
+        self.etag = '"' + hashlib.sha256(corps).hexdigest()[:32] + '"'
+        self.entetes = entetes
+        self.audios = audios
+
+
+def etag_correspond(if_none_match: str | None, etag: str) -> bool:
+    """Vrai si l'en-tête ``If-None-Match`` désigne ``etag`` (ou ``*``)."""
+    if not if_none_match:
+        return False
+    valeurs = [v.strip() for v in if_none_match.split(",")]
+    return "*" in valeurs or etag in valeurs
+
+
+class CachePages:
+    """Pages rendues, les moins récemment servies étant oubliées en premier."""
+
+    def __init__(self, max_pages: int = MAX_PAGES):
+        self.max_pages = max_pages
+        self._pages: OrderedDict[tuple[int, int, int, int], PageRendue] = OrderedDict()
+        self._verrou = threading.Lock()
+
+    def lire(
+        self, jeu_id: int, page_id: int, version: int, assets: int = 0
+    ) -> PageRendue | None:
+        cle = (jeu_id, page_id, version, assets)
+        with self._verrou:
+            rendue = self._pages.get(cle)
+            if rendue is not None:
+                self._pages.move_to_end(cle)
+            return rendue
+
+    def mettre(
+        self,
+        jeu_id: int,
+        page_id: int,
+        version: int,
+        corps: bytes,
+        entetes: dict[str, str],
+        assets: int = 0,
+        audios: tuple[str, ...] = (),
+    ) -> PageRendue:
+        rendue = PageRendue(corps, entetes, audios)
+        with self._verrou:
+            self._pages[(jeu_id, page_id, version, assets)] = rendue
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+        return rendue
+
+    def oublier_jeu(self, jeu_id: int) -> None:
+        """Retire les pages du jeu (toutes versions confondues)."""
+        with self._verrou:
+            for cle in [c for c in self._pages if c[0] == jeu_id]:
+                del self._pages[cle]
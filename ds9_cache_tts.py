@@ -0,0 +1,447 @@
+"""Cache disque des fichiers audio générés par XTTS.
+
+Chaque fichier est adressé par son contenu : la clé est un hash de
+(voix, texte normalisé, langue). Une même phrase dite par la même voix n'est
+donc synthétisée qu'une seule fois, quel que soit le joueur ou le jeu.
+Le cache est borné en taille ; les fichiers les moins récemment servis sont
+supprimés en premier.
+
+Chaque WAV est transcodé par ffmpeg en Opus et en MP3, dix fois plus légers
+pour la voix, dans un pool de processus (``transcoder``). Les gabarits
+proposent au navigateur ces variantes avant le WAV (``sources_audio``).
+"""
+
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+import unicodedata
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+
+from ds9_tts import entete_wav, flux_audio, synthetise_vers, synthetise_vers_async
+
+DOSSIER_CACHE = os.getenv("TTS_CACHE_DOSSIER", os.path.join("static", "cache", "tts"))
+TAILLE_MAX = int(os.getenv("TTS_CACHE_TAILLE_MAX_MO", "500")) * 1024 * 1024
+# Le dossier est reparcouru au moins à cet intervalle (secondes) : d'autres
+# processus écrivent aussi dans le cache
+INTERVALLE_PARCOURS = float(os.getenv("TTS_CACHE_INTERVALLE_PARCOURS", "300"))
+VOIX_DEFAUT = "Henriette Usha"
+
+# Variantes compressées : extension -> (type MIME pour <source>, options ffmpeg)
+FORMATS = {
+    "opus": (
+        "audio/ogg; codecs=opus",
+        ["-c:a", "libopus", "-b:a", os.getenv("TTS_DEBIT_OPUS", "32k"), "-application", "voip", "-f", "ogg"],
+    ),
+    "mp3": (
+        "audio/mpeg",
+        ["-c:a", "libmp3lame", "-b:a", os.getenv("TTS_DEBIT_MP3", "64k"), "-f", "mp3"],
+    ),
+}
+FORMATS_ACTIFS = [
+    f.strip() for f in os.getenv("TTS_FORMATS", "opus,mp3").split(",") if f.strip() in FORMATS
+]
+PROCESSUS_TRANSCODAGE = int(os.getenv("TTS_TRANSCODAGE_PROCESSUS", "2"))
+# Une variante en échec est retentée après ce délai (secondes) ; au-delà de
+# MAX_ECHECS échecs retenus, les plus anciens sont oubliés
+REESSAI_ECHEC = float(os.getenv("TTS_TRANSCODAGE_REESSAI", "600"))
+MAX_ECHECS = 1000
+FFMPEG = shutil.which("ffmpeg")
+
+_verrous: dict[str, threading.Lock] = {}
+_verrou_verrous = threading.Lock()
+_verrou_purge = threading.Lock()
+# Taille du cache suivie par ce processus (None : pas encore mesurée)
+_verrou_taille = threading.Lock()
+_taille: int | None = None
+_dernier_parcours = 0.0
+_verrous_async: dict[str, asyncio.Lock] = {}
+_verrou_transcodage = threading.RLock()
+_executeur: ProcessPoolExecutor | None = None
+# Variante en cours d'encodage -> tâche du pool ; variante en échec -> date
+_en_cours: dict[str, Future] = {}
+_echecs: dict[str, float] = {}
+
+
+def normaliser_texte(texte: str) -> str:
+    """Normalise Unicode et espaces pour que deux saisies équivalentes partagent la clé."""
+    texte = unicodedata.normalize("NFC", texte)
+    return re.sub(r"\s+", " ", texte).strip()
+
+
+def cle_audio(voix: str, texte: str, langue: str = "fr") -> str:
+    """Calcule la clé de cache d'un triplet (voix, texte, langue)."""
+    brut = "\x1f".join((voix.strip(), normaliser_texte(texte), langue))
+    return hashlib.sha256(brut.encode("utf-8")).hexdigest()
+
+
+def chemin_audio(cle: str) -> str:
+    """Chemin local du fichier associé à ``cle`` (réparti en sous-dossiers)."""
+    return os.path.join(DOSSIER_CACHE, cle[:2], f"{cle}.wav")
+
+
+def url_audio(chemin: str) -> str:
+    """Convertit un chemin local sous ``static`` en URL servie par l'application."""
+    return "/" + chemin.replace(os.sep, "/")
+
+
+def est_dans_cache(chemin: str) -> bool:
+    """Indique si ``chemin`` désigne un fichier géré par le cache."""
+    racine = os.path.abspath(DOSSIER_CACHE)
+    return os.path.abspath(chemin).startswith(racine + os.sep)
+
+
+def chercher_audio(voix: str, texte: str, langue: str = "fr") -> str | None:
+    """Retourne le chemin du fichier en cache ou ``None`` sans rien synthétiser."""
+    chemin = chemin_audio(cle_audio(voix, texte, langue))
+    try:
+        # La date de modification sert d'horodatage LRU
+        os.utime(chemin)
+    except FileNotFoundError:
+        return None
+    return chemin
+
+
+def toucher_audio(url: str) -> bool:
+    """Marque l'audio ``url`` du cache comme servi ; faux s'il a été purgé.
+
+    Une page gardée en cache (``ds9_cache_pages``) référence ses audios sans
+    repasser par ``chercher_audio`` : elle les touche ainsi à chaque service.
+    """
+    chemin = url.lstrip("/")
+    if not est_dans_cache(chemin):
+        return True
+    try:
+        os.utime(chemin)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def _verrou_pour(cle: str) -> threading.Lock:
+    with _verrou_verrous:
+        return _verrous.setdefault(cle, threading.Lock())
+
+
+def audio_en_cache(voix: str, texte: str, langue: str = "fr") -> str | None:
+    """Retourne le chemin du fichier audio, en le synthétisant s'il est absent.
+
+    Deux requêtes simultanées sur la même clé ne déclenchent qu'une synthèse :
+    la seconde attend la première puis réutilise son fichier.
+    """
+    texte = normaliser_texte(texte)
+    if not texte:
+        return None
+    cle = cle_audio(voix, texte, langue)
+    chemin = chercher_audio(voix, texte, langue)
+    if chemin:
+        return chemin
+
+    verrou = _verrou_pour(cle)
+    try:
+        with verrou:
+            chemin = chercher_audio(voix, texte, langue)
+            if chemin:
+                return chemin
+            chemin = chemin_audio(cle)
+            # Écriture atomique : un lecteur ne voit jamais de fichier partiel
+            if not synthetise_vers(chemin, texte, voix, langue):
+                return None
+    finally:
+        with _verrou_verrous:
+            if _verrous.get(cle) is verrou:
+                del _verrous[cle]
+    _compter(chemin)
+    # Le WAV est proposé tout de suite ; les variantes suivront
+    transcoder(chemin)
+    purger_cache()
+    return chemin
+
+
+async def audio_en_cache_async(voix: str, texte: str, langue: str = "fr") -> str | None:
+    """Version asynchrone de ``audio_en_cache``."""
+    texte = normaliser_texte(texte)
+    if not texte:
+        return None
+    cle = cle_audio(voix, texte, langue)
+    chemin = chercher_audio(voix, texte, langue)
+    if chemin:
+        return chemin
+
+    verrou = _verrous_async.setdefault(cle, asyncio.Lock())
+    try:
+        async with verrou:
+            chemin = chercher_audio(voix, texte, langue)
+            if chemin:
+                return chemin
+            chemin = chemin_audio(cle)
+            if not await synthetise_vers_async(chemin, texte, voix, langue):
+                return None
+    finally:
+        if _verrous_async.get(cle) is verrou:
+            del _verrous_async[cle]
+    _compter(chemin)
+    transcoder(chemin)
+    await asyncio.to_thread(purger_cache)
+    return chemin
+
+
+def enregistrer_audio(voix: str, texte: str, octets: bytes, langue: str = "fr") -> str:
+    """Place ``octets`` dans le cache sous la clé de (voix, texte, langue)."""
+    cle = cle_audio(voix, texte, langue)
+    chemin = chemin_audio(cle)
+    os.makedirs(os.path.dirname(chemin), exist_ok=True)
+    tmp = f"{chemin}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(octets)
+    os.replace(tmp, chemin)
+    _compter(chemin)
+    transcoder(chemin)
+    purger_cache()
+    return chemin
+
+
+def flux_en_cache(voix: str, texte: str, langue: str = "fr"):
+    """Diffuse l'audio de ``texte`` au fil de la synthèse puis l'ajoute au cache.
+
+    Le fichier complet n'est enregistré que si toutes les phrases ont été
+    synthétisées ; un flux interrompu, ou dont une phrase a été sautée, ne
+    laisse rien dans le cache.
+    """
+    texte = normaliser_texte(texte)
+    en_tete = None
+    morceaux: list[bytes] = []
+    echecs: list[str] = []
+    for bloc in flux_audio(texte, voix, langue, echecs):
+        if en_tete is None:
+            en_tete = bloc
+        else:
+            morceaux.append(bloc)
+        yield bloc
+
+    if en_tete is None or echecs:
+        return
+    # En-tête du flux : canaux, fréquence et largeur d'échantillon
+    nb_canaux = int.from_bytes(en_tete[22:24], "little")
+    frequence = int.from_bytes(en_tete[24:28], "little")
+    largeur = int.from_bytes(en_tete[34:36], "little") // 8
+    donnees = b"".join(morceaux)
+    enregistrer_audio(
+        voix,
+        texte,
+        entete_wav(nb_canaux, largeur, frequence, len(donnees)) + donnees,
+        langue,
+    )
+
+
+def chemin_variante(chemin: str, extension: str) -> str:
+    return f"{os.path.splitext(chemin)[0]}.{extension}"
+
+
+def formats_actifs() -> list[str]:
+    """Extensions des variantes produites ; aucune si ffmpeg est absent."""
+    return FORMATS_ACTIFS if FFMPEG else []
+
+
+def _encoder(source: str, cible: str, options: list[str]) -> bool:
+    """Exécuté dans un processus du pool : encode ``source`` vers ``cible``."""
+    tmp = f"{cible}.{os.getpid()}.tmp"
+    try:
+        subprocess.run(
+            [FFMPEG or "ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-i", source, *options, tmp],
+            check=True,
+            capture_output=True,
+            timeout=120,
+        )
+        os.replace(tmp, cible)
+        return True
+    except (OSError, subprocess.SubprocessError) as exc:
+        print(f"[DEBUG] Transcodage impossible vers {cible} : {exc}")
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        return False
+
+
+def _pool() -> ProcessPoolExecutor:
+    global _executeur
+    if _executeur is None:
+        # « spawn » : un fork hériterait des verrous tenus par les autres fils
+        _executeur = ProcessPoolExecutor(
+            PROCESSUS_TRANSCODAGE, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executeur
+
+
+def _termine(cible: str, tache: Future) -> None:
+    with _verrou_transcodage:
+        _en_cours.pop(cible, None)
+        if tache.cancelled() or tache.exception() is not None or not tache.result():
+            _echecs.pop(cible, None)
+            _echecs[cible] = time.monotonic()
+            while len(_echecs) > MAX_ECHECS:
+                # Ordre d'insertion : le premier est le plus ancien échec
+                del _echecs[next(iter(_echecs))]
+        else:
+            _compter(cible)
+
+
+def _en_echec(cible: str) -> bool:
+    """Vrai si l'encodage de ``cible`` a échoué il y a moins de ``REESSAI_ECHEC``."""
+    with _verrou_transcodage:
+        date = _echecs.get(cible)
+        if date is None:
+            return False
+        if time.monotonic() - date >= REESSAI_ECHEC:
+            del _echecs[cible]
+            return False
+        return True
+
+
+def transcoder(chemin: str) -> list[Future]:
+    """Lance l'encodage des variantes manquantes du WAV ``chemin``.
+
+    Renvoie les tâches en cours pour ce fichier (éventuellement lancées par un
+    autre appel) ; une variante déjà présente ou en échec récent n'est pas
+    relancée.
+    """
+    taches = []
+    with _verrou_transcodage:
+        for extension in formats_actifs():
+            cible = chemin_variante(chemin, extension)
+            if cible in _en_cours:
+                taches.append(_en_cours[cible])
+                continue
+            if _en_echec(cible) or os.path.exists(cible):
+                continue
+            tache = _pool().submit(_encoder, chemin, cible, FORMATS[extension][1])
+            _en_cours[cible] = tache
+            tache.add_done_callback(partial(_termine, cible))
+            taches.append(tache)
+    return taches
+
+
+def fermer_transcodage() -> None:
+    """Arrête le pool de transcodage en abandonnant les encodages en attente."""
+    global _executeur
+    with _verrou_transcodage:
+        if _executeur is not None:
+            _executeur.shutdown(wait=False, cancel_futures=True)
+            _executeur = None
+
+
+def sources_audio(url: str | None) -> list[dict[str, str]]:
+    """Sources ``<source>`` de l'audio ``url`` : variantes compressées prêtes, puis le WAV.
+
+    Un WAV du cache dont des variantes manquent (cache antérieur, encodage en
+    cours) est proposé tel quel et ses variantes sont lancées.
+    """
+    if not url:
+        return []
+    sources = []
+    chemin = url.lstrip("/")
+    if chemin.endswith(".wav") and est_dans_cache(chemin):
+        manquantes = False
+        for extension in formats_actifs():
+            variante = chemin_variante(chemin, extension)
+            if os.path.exists(variante):
+                sources.append({"src": url_audio(variante), "type": FORMATS[extension][0]})
+            else:
+                manquantes = True
+        if manquantes:
+            transcoder(chemin)
+    sources.append({"src": url, "type": "audio/wav"})
+    return sources
+
+
+def transcodage_termine(url: str) -> bool:
+    """Vrai si plus aucune variante de ``url`` n'est à attendre."""
+    chemin = url.lstrip("/")
+    if not chemin.endswith(".wav") or not est_dans_cache(chemin):
+        return True
+    return all(
+        os.path.exists(cible) or _en_echec(cible)
+        for cible in (chemin_variante(chemin, e) for e in formats_actifs())
+    )
+
+
+def _compter(chemin: str) -> None:
+    """Ajoute la taille du fichier ``chemin`` à la taille suivie du cache."""
+    global _taille
+    try:
+        octets = os.path.getsize(chemin)
+    except FileNotFoundError:
+        return
+    with _verrou_taille:
+        if _taille is not None:
+            _taille += octets
+
+
+def purger_cache(taille_max: int = TAILLE_MAX) -> int:
+    """Supprime les fichiers les plus anciens tant que le cache dépasse ``taille_max``.
+
+    Le dossier n'est parcouru que si la taille suivie dépasse ``taille_max``
+    ou si le dernier parcours date de plus de ``INTERVALLE_PARCOURS``.
+    Retourne le nombre d'octets libérés.
+    """
+    global _taille, _dernier_parcours
+    if (
+        _taille is not None
+        and _taille <= taille_max
+        and time.monotonic() - _dernier_parcours < INTERVALLE_PARCOURS
+    ):
+        return 0
+    if not _verrou_purge.acquire(blocking=False):
+        return 0
+    try:
+        # Un WAV et ses variantes forment une entrée, datée par le WAV
+        entrees: dict[str, list] = {}
+        extensions = {".wav", *(f".{e}" for e in FORMATS)}
+        total = 0
+        for dossier, _, noms in os.walk(DOSSIER_CACHE):
+            for nom in noms:
+                base, extension = os.path.splitext(nom)
+                if extension not in extensions:
+                    continue
+                chemin = os.path.join(dossier, nom)
+                try:
+                    st = os.stat(chemin)
+                except FileNotFoundError:
+                    continue
+                entree = entrees.setdefault(os.path.join(dossier, base), [0.0, 0, []])
+                if extension == ".wav":
+                    entree[0] = st.st_mtime
+                entree[1] += st.st_size
+                entree[2].append(chemin)
+                total += st.st_size
+
+        libere = 0
+        _dernier_parcours = time.monotonic()
+        if total <= taille_max:
+            with _verrou_taille:
+                _taille = total
+            return 0
+        # On redescend à 90 % pour ne pas purger à chaque nouvelle synthèse
+        cible = int(taille_max * 0.9)
+        for _, taille, chemins in sorted(entrees.values()):
+            if total - libere <= cible:
+                break
+            for chemin in chemins:
+                try:
+                    os.remove(chemin)
+                except FileNotFoundError:
+                    pass
+            libere += taille
+        with _verrou_taille:
+            _taille = total - libere
+        print(f"[DEBUG] Cache TTS purgé : {libere} octets libérés")
+        return libere
+    finally:
+        _verrou_purge.release()
@@ -0,0 +1,53 @@
+"""Contenu des pages : marqueur TTS et précompilation.
+
+Partagé par les routes de jeu (``jouer.py``), l'éditeur (``main.py``) et la
+pré-génération audio (``ds9_prechauffage``).
+"""
+
+import re
+
+MOTIF_TTS = re.compile(r"<!--\s*tts:(.*?)-->", re.DOTALL)
+
+
+def extraire_tts(contenu: str) -> tuple[str, str | None, str | None]:
+    """Extrait un marqueur ``<!--tts:...-->`` et renvoie texte et voix.
+
+    Exemple : ``<!--tts:<voice>Damien</voice><texte>Bonjour</texte>-->``
+    """
+
+    match = MOTIF_TTS.search(contenu)
+    if not match:
+        return contenu, None, None
+
+    bloc = match.group(1).strip()
+    voix = None
+    texte = None
+
+    voix_match = re.search(r"<voice>(.*?)</voice>", bloc, re.DOTALL)
+    if voix_match:
+        voix = voix_match.group(1).strip()
+
+    texte_match = re.search(r"<texte>(.*?)</texte>", bloc, re.DOTALL)
+    if texte_match:
+        texte = texte_match.group(1).strip()
+    else:
+        texte = bloc
+
+    contenu = MOTIF_TTS.sub("", contenu, count=1)
+    return contenu, texte, voix
+
+
+def compiler_page(contenu: str | None) -> tuple[str, str | None, str | None]:
+    """Artefacts d'une page calculés à l'enregistrement.
+
+    Renvoie ``(contenu_compile, tts_texte, tts_voix)`` : le contenu sans
+    marqueur TTS, puis le texte et la voix du marqueur.
+    """
+    return extraire_tts(contenu or "")
+
+
+def contenu_page(page: dict) -> tuple[str, str | None, str | None]:
+    """Contenu affichable, texte et voix TTS, précompilés si possible."""
+    if page.get("contenu_compile") is not None:
+        return page["contenu_compile"], page.get("tts_texte"), page.get("tts_voix")
+    return extraire_tts(page.get("contenu") or "")
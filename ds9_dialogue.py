@@ -0,0 +1,136 @@
+"""Contexte borné des dialogues avec un PNJ.
+
+Le prompt envoyé à l'IA contient le prompt de base du PNJ, un résumé glissant
+des échanges anciens et les derniers tours mot pour mot. Sa taille, estimée en
+tokens, reste sous le budget du jeu (``jeux.budget_dialogue``, sinon
+``DIALOGUE_BUDGET``) quelle que soit la longueur de la conversation.
+
+Le résumé est produit par l'IA entre deux tours (``compacter``), en tâche de
+fond : le joueur n'attend jamais la compaction.
+"""
+
+import math
+import os
+import uuid
+from typing import Awaitable, Callable
+
+# Budget par défaut d'un prompt de dialogue, en tokens
+BUDGET = int(os.getenv("DIALOGUE_BUDGET", "3000"))
+# Nombre de derniers tours conservés mot pour mot
+TOURS_VERBATIM = int(os.getenv("DIALOGUE_TOURS", "6"))
+# Taille visée du résumé, en mots
+MOTS_RESUME = int(os.getenv("DIALOGUE_MOTS_RESUME", "150"))
+
+
+def estimer_tokens(texte: str) -> int:
+    """Estimation du nombre de tokens : environ quatre caractères par token."""
+    return math.ceil(len(texte) / 4)
+
+
+def nouveau_dialogue(jeu_id: int, page_id: int, base_prompt: str, ouverture: str) -> dict:
+    """Dialogue ouvert par la réplique ``ouverture`` du PNJ."""
+    return {
+        # Distingue deux conversations successives sur la même page
+        "id": uuid.uuid4().hex,
+        "jeu": jeu_id,
+        "page": page_id,
+        "base_prompt": base_prompt,
+        "resume": "",
+        # Nombre de tours déjà fondus dans le résumé
+        "resumes": 0,
+        "tours": [{"joueur": "", "pnj": ouverture}] if ouverture else [],
+    }
+
+
+def formater_tour(tour: dict) -> str:
+    if not tour["joueur"]:
+        return f"PNJ: {tour['pnj']}\n"
+    return f"Joueur: {tour['joueur']}\nPNJ: {tour['pnj']}\n"
+
+
+def budget_jeu(jeu: dict) -> int:
+    return jeu.get("budget_dialogue") or BUDGET
+
+
+def construire_prompt(dialogue: dict, saisie: str, budget: int = BUDGET) -> str:
+    """Prompt du prochain tour, tenant dans ``budget`` tokens si possible.
+
+    Les tours sont ajoutés du plus récent au plus ancien tant que le budget le
+    permet ; le prompt de base, le résumé et la saisie sont toujours présents.
+    Les tours sortis de la fenêtre ``TOURS_VERBATIM`` restent dans le prompt
+    tant que ``appliquer_resume`` ne les a pas fondus dans le résumé.
+    """
+    entete = dialogue["base_prompt"]
+    if dialogue["resume"]:
+        entete += f"\nRésumé de la conversation jusqu'ici : {dialogue['resume']}"
+    fin = f"Joueur: {saisie}\nPNJ:"
+    reste = budget - estimer_tokens(entete) - estimer_tokens(fin)
+    recents: list[str] = []
+    for tour in reversed(dialogue["tours"]):
+        texte = formater_tour(tour)
+        cout = estimer_tokens(texte)
+        if cout > reste:
+            break
+        recents.append(texte)
+        reste -= cout
+    return f"{entete}\n{''.join(reversed(recents))}{fin}"
+
+
+def ajouter_tour(dialogue: dict, saisie: str, reponse: str) -> dict:
+    """Nouveau dialogue avec le tour ``saisie`` / ``reponse`` en plus."""
+    return {**dialogue, "tours": [*dialogue["tours"], {"joueur": saisie, "pnj": reponse}]}
+
+
+def a_compacter(dialogue: dict) -> bool:
+    """Vrai si des tours sont sortis de la fenêtre mot pour mot."""
+    return len(dialogue["tours"]) > TOURS_VERBATIM
+
+
+def construire_prompt_resume(resume: str, tours: list[dict]) -> str:
+    echanges = "".join(formater_tour(t) for t in tours)
+    precedent = f"Résumé précédent : {resume}\n\n" if resume else ""
+    return (
+        "Tu tiens le fil d'un dialogue entre un joueur et un personnage (PNJ) d'un "
+        f"jeu d'aventure.\n{precedent}Nouveaux échanges :\n{echanges}\n"
+        f"Rédige un résumé unique, en {MOTS_RESUME} mots au plus, qui fusionne le "
+        "résumé précédent et ces échanges. Conserve les faits établis, les "
+        "énigmes posées, les réponses déjà tentées et les indices donnés. "
+        "Réponds uniquement par le résumé."
+    )
+
+
+async def compacter(
+    dialogue: dict, repondre: Callable[[str, str], Awaitable[str]]
+) -> tuple[int, str] | None:
+    """Fond dans le résumé les tours sortis de la fenêtre.
+
+    Renvoie ``(nombre de tours fondus, nouveau résumé)`` ou ``None`` si rien
+    n'est à faire ou si l'IA a échoué. Le résultat s'applique avec
+    ``appliquer_resume``.
+    """
+    if not a_compacter(dialogue):
+        return None
+    anciens = dialogue["tours"][:-TOURS_VERBATIM]
+    resume = (await repondre("", construire_prompt_resume(dialogue["resume"], anciens))).strip()
+    if not resume or resume.startswith("Erreur "):
+        print(f"[DEBUG] Résumé du dialogue impossible : {resume}")
+        return None
+    return len(anciens), resume
+
+
+def appliquer_resume(dialogue: dict, origine: dict, fondus: int, resume: str) -> dict | None:
+    """Dialogue compacté, ou ``None`` si le résumé ne s'y applique plus.
+
+    ``origine`` est le dialogue au début de la compaction. Le résumé est
+    écarté si le dialogue a été recommencé depuis (autre ``id``) ou si une
+    autre compaction l'a déjà modifié ; les tours ajoutés pendant la
+    compaction sont conservés.
+    """
+    if dialogue.get("id") != origine.get("id") or dialogue["resumes"] != origine["resumes"]:
+        return None
+    return {
+        **dialogue,
+        "resume": resume,
+        "resumes": origine["resumes"] + fondus,
+        "tours": dialogue["tours"][fondus:],
+    }
@@ -1,9 +1,11 @@
 from __future__ import annotations
 
+import asyncio
+import json
 import time
-import socket
 import os
-from typing import Any
+import threading
+from typing import Any, AsyncIterator
 import httpx
 import requests
 from qdrant_client import QdrantClient
@@ -12,6 +14,7 @@ from dotenv import load_dotenv
 import psycopg2
 import re
 import ds9_fonctions_externes
+from ds9_repartiteur import Repartiteur
 
 # Liste des serveurs Ollama à tester
 SERVEURS_OLLAMA = (
@@ -37,6 +40,114 @@ COLLECTION = "assistance"
 # Client Qdrant global
 qdrant_client = QdrantClient(url=QDRANT_URL)
 
+MISTRAL_URL = "https://api.mistral.ai/v1"
+
+# Limites des connexions HTTP conservées vers chaque fournisseur d'IA
+IA_MAX_CONNEXIONS = int(os.getenv("IA_MAX_CONNEXIONS", "20"))
+IA_MAX_KEEPALIVE = int(os.getenv("IA_MAX_KEEPALIVE", "10"))
+IA_KEEPALIVE_EXPIRY = float(os.getenv("IA_KEEPALIVE_EXPIRY", "60"))
+IA_TIMEOUT = float(os.getenv("IA_TIMEOUT", "60"))
+
+try:
+    import h2  # noqa: F401 - active HTTP/2 dans httpx si présent
+
+    HTTP2_DISPONIBLE = True
+except ImportError:
+    HTTP2_DISPONIBLE = False
+
+
+class RegistreClients:
+    """Clients HTTP persistants partagés par toutes les instances de ``DS9_IA``.
+
+    Un client synchrone et un client asynchrone par fournisseur gardent leurs
+    connexions ouvertes (keep-alive) : la poignée de main TLS n'est payée
+    qu'une fois. Les clients asynchrones sont propres à chaque boucle
+    d'événements.
+    """
+
+    def __init__(self):
+        self._verrou = threading.Lock()
+        self._clients: dict[str, httpx.Client] = {}
+        self._clients_async: dict[tuple[str, int], httpx.AsyncClient] = {}
+        self._cle_mistral: str | None = None
+
+    def _options(self, fournisseur: str) -> dict[str, Any]:
+        options: dict[str, Any] = {
+            "timeout": IA_TIMEOUT,
+            "limits": httpx.Limits(
+                max_connections=IA_MAX_CONNEXIONS,
+                max_keepalive_connections=IA_MAX_KEEPALIVE,
+                keepalive_expiry=IA_KEEPALIVE_EXPIRY,
+            ),
+        }
+        if fournisseur == "MISTRAL":
+            # La clé n'est lue qu'à la création du client
+            if self._cle_mistral is None:
+                load_dotenv()
+                self._cle_mistral = os.getenv("MISTRAL_API_KEY", "")
+            options["base_url"] = MISTRAL_URL
+            options["headers"] = {
+                "Authorization": f"Bearer {self._cle_mistral}",
+                "Content-Type": "application/json",
+            }
+            # Ollama ne parle que HTTP/1.1 ; l'API Mistral accepte HTTP/2
+            options["http2"] = HTTP2_DISPONIBLE
+        return options
+
+    def client(self, fournisseur: str) -> httpx.Client:
+        with self._verrou:
+            client = self._clients.get(fournisseur)
+            if client is None or client.is_closed:
+                client = httpx.Client(**self._options(fournisseur))
+                self._clients[fournisseur] = client
+            return client
+
+    def client_async(self, fournisseur: str) -> httpx.AsyncClient:
+        cle = (fournisseur, id(asyncio.get_running_loop()))
+        with self._verrou:
+            client = self._clients_async.get(cle)
+            if client is None or client.is_closed:
+                client = httpx.AsyncClient(**self._options(fournisseur))
+                self._clients_async[cle] = client
+            return client
+
+    def fermer(self) -> None:
+        """Ferme les clients synchrones."""
+        with self._verrou:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            client.close()
+
+    async def fermer_async(self) -> None:
+        """Ferme les clients asynchrones de la boucle courante."""
+        boucle = id(asyncio.get_running_loop())
+        with self._verrou:
+            cles = [cle for cle in self._clients_async if cle[1] == boucle]
+            clients = [self._clients_async.pop(cle) for cle in cles]
+        for client in clients:
+            await client.aclose()
+
+
+registre_clients = RegistreClients()
+
+
+def _sonde_ollama(ip: str) -> bool:
+    """Vérifie qu'un serveur Ollama répond sur son API."""
+    response = httpx.get(f"http://{ip}:{PORT_OLLAMA}/api/version", timeout=2)
+    return response.status_code == 200
+
+
+# Répartition des requêtes entre les serveurs Ollama, sondés en tâche de fond
+repartiteur_ollama = Repartiteur(
+    "Ollama",
+    SERVEURS_OLLAMA,
+    _sonde_ollama,
+    intervalle=float(os.getenv("OLLAMA_INTERVALLE_SONDE", "10")),
+    seuil_echecs=int(os.getenv("OLLAMA_SEUIL_ECHECS", "3")),
+    duree_coupure=float(os.getenv("OLLAMA_DUREE_COUPURE", "30")),
+)
+
 def LireParametre(code_parametre: str) -> str:
     """Retourne le texte du paramètre correspondant au code donné."""
     try:
@@ -70,6 +181,23 @@ def embed(text: str) -> list[float]:
     except Exception as exc:
         raise RuntimeError(f"Erreur de vectorisation : {exc}")
 
+async def embed_async(text: str) -> list[float]:
+    """Version asynchrone de ``embed``, sur le client Ollama persistant."""
+    try:
+        response = await registre_clients.client_async("OLLAMA").post(
+            f"{OLLAMA_URL}/api/embeddings",
+            json={"model": "nomic-embed-text:v1.5", "prompt": text},
+        )
+        response.raise_for_status()
+        data = response.json()
+        if "embedding" not in data:
+            raise ValueError("Réponse invalide d'Ollama")
+        return data["embedding"]
+    except httpx.HTTPError as exc:
+        raise RuntimeError(f"Erreur réseau lors de la vectorisation : {exc}")
+    except Exception as exc:
+        raise RuntimeError(f"Erreur de vectorisation : {exc}")
+
 def search_similar(vector: list[float]) -> list[str]:
     """Recherche les documents les plus proches dans Qdrant."""
     try:
@@ -122,13 +250,12 @@ class DS9_IA:
         self.modele = modele
 
     def serveur_ollama_disponible(self) -> str:
-        for ip in SERVEURS_OLLAMA:
-            try:
-                with socket.create_connection((ip, PORT_OLLAMA), timeout=1):
-                    return ip
-            except (socket.timeout, ConnectionRefusedError, OSError):
-                continue
-        raise RuntimeError("Aucun serveur Ollama disponible.")
+        """Serveur Ollama que choisirait le répartiteur à cet instant.
+
+        Les requêtes passent directement par ``repartiteur_ollama.utiliser`` pour
+        que la charge et la latence de chaque serveur soient suivies.
+        """
+        return repartiteur_ollama.choisir(reserver=False).adresse
 
     def repond(self, prompt: str, question: str) -> str:
         debut = time.time()
@@ -146,12 +273,52 @@ class DS9_IA:
         print(f"⏱️ Temps de traitement global : {round(time.time() - debut, 2)} secondes")
         return reponse
 
+    async def repond_async(self, prompt: str, question: str) -> str:
+        """Version non bloquante de ``repond`` utilisant ``httpx.AsyncClient``."""
+        debut = time.time()
+
+        match self.fournisseur:
+            case "OLLAMA":
+                reponse = await self._ollama_repond_async(prompt, question)
+            case "MISTRAL":
+                reponse = await self._mistral_repond_async(prompt, question)
+            case "CHATGPT":
+                reponse = "Fournisseur CHATGPT pas encore implémenté."
+            case _:
+                reponse = "Fournisseur inconnu."
+
+        print(f"⏱️ Temps de traitement global : {round(time.time() - debut, 2)} secondes")
+        return reponse
+
+    async def repond_flux(self, prompt: str, question: str) -> AsyncIterator[str]:
+        """Version en flux de ``repond_async`` : produit la réponse morceau par morceau.
+
+        Les morceaux arrivent dès que le modèle les génère (``"stream": True``).
+        Une erreur est produite comme un dernier morceau, sous la même forme
+        que dans ``repond``.
+        """
+        debut = time.time()
+
+        match self.fournisseur:
+            case "OLLAMA":
+                flux = self._ollama_repond_flux(prompt, question)
+            case "MISTRAL":
+                flux = self._mistral_repond_flux(prompt, question)
+            case "CHATGPT":
+                flux = _morceau_unique("Fournisseur CHATGPT pas encore implémenté.")
+            case _:
+                flux = _morceau_unique("Fournisseur inconnu.")
+
+        premier = True
+        async for morceau in flux:
+            if premier:
+                print(f"⏱️ Premier morceau reçu : {round(time.time() - debut, 2)} secondes")
+                premier = False
+            yield morceau
+        print(f"⏱️ Temps de traitement global : {round(time.time() - debut, 2)} secondes")
+
     def _ollama_repond(self, prompt: str, question: str) -> str:
         try:
-            ip = self.serveur_ollama_disponible()
-            print(f"\n✅ Serveur Ollama choisi : {ip}")
-
-            url = f"http://{ip}:{PORT_OLLAMA}/api/chat"
             payload = {
                 "model": self.modele,
                 "messages": [{"role": "user", "content": f"{prompt} {question}"}],
@@ -159,7 +326,13 @@ class DS9_IA:
             }
 
             debut = time.time()
-            response = httpx.post(url, json=payload, timeout=60)
+            with repartiteur_ollama.utiliser() as ip:
+                print(f"\n✅ Serveur Ollama choisi : {ip}")
+                url = f"http://{ip}:{PORT_OLLAMA}/api/chat"
+                response = registre_clients.client("OLLAMA").post(url, json=payload)
+                # Seules les erreurs serveur comptent comme un échec de l'hôte
+                if response.status_code >= 500:
+                    response.raise_for_status()
             response.raise_for_status()
             data = response.json()
             print(f"⏱️ Temps de traitement Ollama : {round(time.time() - debut, 2)} secondes")
@@ -169,13 +342,52 @@ class DS9_IA:
             return f"Erreur Ollama : {exc}"
 
     def _mistral_repond(self, prompt: str, question: str) -> str:
-        load_dotenv()
-        api_key_mistral = os.getenv("MISTRAL_API_KEY", "")
-        url = "https://api.mistral.ai/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {api_key_mistral}",
-            "Content-Type": "application/json",
+        payload = {
+            "model": self.modele,
+            "messages": [
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": question},
+            ],
+            "stream": False,
         }
+
+        try:
+            debut = time.time()
+            client = registre_clients.client("MISTRAL")
+            response = client.post("/chat/completions", json=payload)
+            response.raise_for_status()
+            data = response.json()
+            print(f"⏱️ Temps de traitement Mistral : {round(time.time() - debut, 2)} secondes")
+
+            return data.get("choices", [{}])[0].get("message", {}).get("content", "Aucune réponse reçue.")
+        except Exception as exc:
+            return f"Erreur Mistral : {exc}"
+
+    async def _ollama_repond_async(self, prompt: str, question: str) -> str:
+        try:
+            payload = {
+                "model": self.modele,
+                "messages": [{"role": "user", "content": f"{prompt} {question}"}],
+                "stream": False,
+            }
+
+            debut = time.time()
+            async with repartiteur_ollama.utiliser_async() as ip:
+                print(f"\n✅ Serveur Ollama choisi : {ip}")
+                url = f"http://{ip}:{PORT_OLLAMA}/api/chat"
+                client = registre_clients.client_async("OLLAMA")
+                response = await client.post(url, json=payload)
+                if response.status_code >= 500:
+                    response.raise_for_status()
+            response.raise_for_status()
+            data = response.json()
+            print(f"⏱️ Temps de traitement Ollama : {round(time.time() - debut, 2)} secondes")
+
+            return data.get("message", {}).get("content", "Aucune réponse reçue.")
+        except Exception as exc:
+            return f"Erreur Ollama : {exc}"
+
+    async def _mistral_repond_async(self, prompt: str, question: str) -> str:
         payload = {
             "model": self.modele,
             "messages": [
@@ -187,7 +399,8 @@ class DS9_IA:
 
         try:
             debut = time.time()
-            response = httpx.post(url, headers=headers, json=payload, timeout=60)
+            client = registre_clients.client_async("MISTRAL")
+            response = await client.post("/chat/completions", json=payload)
             response.raise_for_status()
             data = response.json()
             print(f"⏱️ Temps de traitement Mistral : {round(time.time() - debut, 2)} secondes")
@@ -196,6 +409,66 @@ class DS9_IA:
         except Exception as exc:
             return f"Erreur Mistral : {exc}"
 
+    async def _ollama_repond_flux(self, prompt: str, question: str) -> AsyncIterator[str]:
+        payload = {
+            "model": self.modele,
+            "messages": [{"role": "user", "content": f"{prompt} {question}"}],
+            "stream": True,
+        }
+
+        try:
+            async with repartiteur_ollama.utiliser_async() as ip:
+                print(f"\n✅ Serveur Ollama choisi : {ip}")
+                url = f"http://{ip}:{PORT_OLLAMA}/api/chat"
+                client = registre_clients.client_async("OLLAMA")
+                # Une ligne JSON par morceau, la dernière porte « done »
+                async with client.stream("POST", url, json=payload) as response:
+                    response.raise_for_status()
+                    async for ligne in response.aiter_lines():
+                        if not ligne:
+                            continue
+                        data = json.loads(ligne)
+                        morceau = data.get("message", {}).get("content")
+                        if morceau:
+                            yield morceau
+                        if data.get("done"):
+                            break
+        except Exception as exc:
+            yield f"Erreur Ollama : {exc}"
+
+    async def _mistral_repond_flux(self, prompt: str, question: str) -> AsyncIterator[str]:
+        payload = {
+            "model": self.modele,
+            "messages": [
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": question},
+            ],
+            "stream": True,
+        }
+
+        try:
+            client = registre_clients.client_async("MISTRAL")
+            # Server-Sent Events : « data: {...} » puis « data: [DONE] »
+            async with client.stream("POST", "/chat/completions", json=payload) as response:
+                response.raise_for_status()
+                async for ligne in response.aiter_lines():
+                    if not ligne.startswith("data:"):
+                        continue
+                    donnees = ligne[5:].strip()
+                    if donnees == "[DONE]":
+                        break
+                    choix = json.loads(donnees).get("choices") or [{}]
+                    morceau = choix[0].get("delta", {}).get("content")
+                    if morceau:
+                        yield morceau
+        except Exception as exc:
+            yield f"Erreur Mistral : {exc}"
+
+
+async def _morceau_unique(texte: str) -> AsyncIterator[str]:
+    yield texte
+
+
 def rag_repond(question: str, HLimit: int=20) -> str:
     """Réponse avec RAG Qdrant"""
     vector = embed(question)
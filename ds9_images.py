@@ -0,0 +1,161 @@
+"""Déclinaisons des images de jeu (fonds, portraits) pour les tablettes.
+
+Chaque image de ``static/jeux/<slug>/images`` est réencodée en AVIF et en WebP
+à plusieurs largeurs (``IMAGES_LARGEURS``) lors de la construction des
+ressources (``ds9_assets.construire``). Les fichiers portent l'empreinte de
+l'image source : une image inchangée n'est jamais réencodée.
+
+``css_fond`` produit les règles CSS d'un fond d'écran : des requêtes média
+choisissent la largeur selon la fenêtre, ``image-set`` le format selon le
+navigateur et la densité de l'écran, et l'image d'origine reste en repli.
+``html_picture`` fait de même pour une image du contenu (portrait…) avec un
+``<picture>`` : une ``<source>`` par format, ses largeurs en ``srcset``.
+"""
+
+import os
+import uuid
+
+from markupsafe import Markup, escape
+
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+# Largeurs produites, en pixels ; l'image n'est jamais agrandie et la plus
+# grande largeur sert aussi de plafond aux images plus larges
+LARGEURS = tuple(
+    sorted(int(l) for l in os.getenv("IMAGES_LARGEURS", "480,960,1600").split(",") if l.strip())
+)
+QUALITE_WEBP = int(os.getenv("IMAGES_QUALITE_WEBP", "80"))
+QUALITE_AVIF = int(os.getenv("IMAGES_QUALITE_AVIF", "60"))
+SOURCES = {".png", ".jpg", ".jpeg", ".webp"}
+
+
+def formats() -> list[tuple[str, str]]:
+    """``(extension, type MIME)`` des formats produits, du plus compact au moins compact."""
+    if Image is None:
+        return []
+    resultat = []
+    if features.check("avif"):
+        resultat.append(("avif", "image/avif"))
+    if features.check("webp"):
+        resultat.append(("webp", "image/webp"))
+    return resultat
+
+
+def est_declinable(relatif: str) -> bool:
+    """Vrai pour une image placée dans un dossier ``images`` d'un jeu."""
+    dossier, nom = os.path.split(relatif)
+    return (
+        relatif.startswith("jeux/")
+        and os.path.basename(dossier) == "images"
+        and os.path.splitext(nom)[1].lower() in SOURCES
+    )
+
+
+def _encoder(image, chemin: str, extension: str) -> None:
+    tmp = f"{chemin}.{uuid.uuid4().hex}.tmp"
+    if extension == "avif":
+        image.save(tmp, "AVIF", quality=QUALITE_AVIF)
+    else:
+        # « method=6 » multiplie le temps d'encodage par cent pour 5 % gagnés
+        image.save(tmp, "WEBP", quality=QUALITE_WEBP, method=4)
+    os.replace(tmp, chemin)
+
+
+def decliner(source: str, base: str) -> list[tuple[str, str, int]]:
+    """Écrit les déclinaisons de ``source`` sous ``base.w<largeur>.<format>``.
+
+    ``base`` est le chemin empreinté sans extension. Renvoie
+    ``(chemin, type MIME, largeur)`` par déclinaison, les fichiers déjà
+    présents n'étant pas réencodés. Quand toutes les déclinaisons existent,
+    seul l'en-tête de l'image est lu (pour sa taille) : elle n'est pas décodée.
+    """
+    produits = formats()
+    if not produits:
+        return []
+    with Image.open(source) as image:
+        largeur, hauteur = image.size
+        # Une largeur à moins de 20 % de l'originale n'allégerait presque rien
+        largeurs = sorted(
+            {l for l in LARGEURS if l <= largeur * 0.8} | {min(largeur, LARGEURS[-1])}
+        )
+        resultat = [
+            (f"{base}.w{cible}.{extension}", mime, cible)
+            for cible in largeurs
+            for extension, mime in produits
+        ]
+        manquants = {chemin for chemin, _, _ in resultat if not os.path.exists(chemin)}
+        if not manquants:
+            return resultat
+        image = image.convert("RGBA")
+        if image.getchannel("A").getextrema() == (255, 255):
+            # Canal alpha entièrement opaque : inutile de l'encoder
+            image = image.convert("RGB")
+        reduite, largeur_reduite = None, None
+        for chemin, _, cible in resultat:
+            if chemin not in manquants:
+                continue
+            if largeur_reduite != cible:
+                taille = (cible, max(1, round(hauteur * cible / largeur)))
+                reduite = image if cible == largeur else image.resize(taille, Image.LANCZOS)
+                largeur_reduite = cible
+            _encoder(reduite, chemin, chemin.rsplit(".", 1)[1])
+    return resultat
+
+
+def html_picture(img: str, variantes: list[dict], sizes: str = "100vw") -> Markup:
+    """Entoure la balise ``img`` (l'image d'origine, en repli) d'un ``<picture>``.
+
+    ``variantes`` : dictionnaires ``url``, ``type`` et ``largeur``. Les formats
+    gardent leur ordre (le plus compact d'abord) : le navigateur prend le
+    premier qu'il sait décoder, puis la largeur adaptée à ``sizes``.
+    """
+    if not variantes:
+        return Markup(img)
+    sources = []
+    for mime in dict.fromkeys(v["type"] for v in variantes):
+        srcset = ", ".join(
+            f"{v['url']} {v['largeur']}w"
+            for v in sorted(variantes, key=lambda v: v["largeur"])
+            if v["type"] == mime
+        )
+        sources.append(
+            f'<source type="{escape(mime)}" srcset="{escape(srcset)}" sizes="{escape(sizes)}">'
+        )
+    return Markup("<picture>" + "".join(sources) + img + "</picture>")
+
+
+def _image_set(variantes: list[dict], largeurs: list[tuple[int, str]]) -> str:
+    entrees = []
+    for largeur, densite in largeurs:
+        for v in variantes:
+            if v["largeur"] == largeur:
+                entrees.append(f'url("{v["url"]}") type("{v["type"]}") {densite}')
+    return "image-set(" + ", ".join(entrees) + ")"
+
+
+def css_fond(repli: str, variantes: list[dict], selecteur: str = "body") -> Markup:
+    """Règles CSS du fond ``selecteur`` : ``repli`` puis les déclinaisons.
+
+    ``variantes`` : dictionnaires ``url``, ``type`` et ``largeur``. Sous
+    chaque largeur de fenêtre, l'écran 1x reçoit la déclinaison de cette
+    largeur et l'écran 2x la suivante. Les requêtes média vont de la plus
+    large à la plus étroite : la dernière qui s'applique l'emporte.
+    """
+    regles = [f"{selecteur} {{ background-image: url(\"{repli}\"); }}"]
+    largeurs = sorted({v["largeur"] for v in variantes})
+    if not largeurs:
+        return Markup("\n".join(regles))
+    plus_grande = largeurs[-1]
+    regles.append(
+        f"{selecteur} {{ background-image: "
+        f"{_image_set(variantes, [(plus_grande, '1x')])}; }}"
+    )
+    for largeur, double in reversed(list(zip(largeurs, largeurs[1:]))):
+        regles.append(
+            f"@media (max-width: {largeur}px) {{ {selecteur} {{ background-image: "
+            f"{_image_set(variantes, [(largeur, '1x'), (double, '2x')])}; }} }}"
+        )
+    return Markup("\n".join(regles))
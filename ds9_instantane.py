@@ -0,0 +1,322 @@
+"""Instantanés en mémoire des jeux, pour les routes de jeu.
+
+Un jeu ne change que lorsqu'un auteur l'édite ; les routes de jeu lisent donc
+un instantané complet (jeu, pages, transitions, PNJ, énigmes) chargé une fois,
+au lieu d'interroger la base à chaque requête.
+
+Chaque modification faite dans l'éditeur incrémente ``jeux.version`` et publie
+l'identifiant du jeu sur le canal Postgres ``CANAL`` (``signaler_modification``).
+Les processus qui écoutent ce canal (``Ecouteur``) oublient l'instantané
+concerné ; le suivant est construit à part puis remplace l'ancien d'un coup.
+Sans notification (écouteur coupé), la version est revérifiée toutes les
+``TTL`` secondes.
+"""
+
+import os
+import select
+import threading
+import time
+from types import MappingProxyType
+from typing import Callable
+
+from ds9_pool import executer_preparee
+
+CANAL = "station72_jeux"
+TTL = float(os.getenv("INSTANTANE_TTL", "300"))
+
+
+def signaler_modification(
+    cur, jeu_id: int | None = None, *, page_id: int | None = None, pnj_id: int | None = None
+) -> None:
+    """Incrémente la version du jeu concerné et prévient les autres processus.
+
+    Le jeu est désigné directement ou par l'une de ses pages ou l'un de ses
+    PNJ. À appeler dans la transaction de la modification : la notification
+    n'est délivrée qu'au ``commit``.
+    """
+    if jeu_id is not None:
+        condition, valeur = "id_jeu = %s", jeu_id
+    elif page_id is not None:
+        condition, valeur = "id_jeu = (SELECT id_jeu FROM pages WHERE id_page = %s)", page_id
+    else:
+        condition, valeur = "id_jeu = (SELECT id_jeu FROM pnj WHERE id = %s)", pnj_id
+    cur.execute(
+        f"""
+        WITH modifie AS (
+            UPDATE jeux SET version = version + 1
+            WHERE {condition}
+            RETURNING id_jeu
+        )
+        SELECT pg_notify(%s, id_jeu::text) FROM modifie
+        """,
+        (valeur, CANAL),
+    )
+
+
+class Instantane:
+    """Contenu d'un jeu à une version donnée. Ne jamais le modifier.
+
+    Les accesseurs renvoient des copies des lignes : les routes peuvent les
+    retoucher (contenu sans marqueur TTS, etc.) sans altérer l'instantané.
+    """
+
+    def __init__(
+        self,
+        jeu: dict,
+        pages: list[dict],
+        transitions: list[dict],
+        pnjs: list[dict],
+        enigmes: list[dict],
+    ):
+        self.jeu_id = jeu["id_jeu"]
+        self.version = jeu.get("version", 0)
+        self.charge_a = time.time()
+        self._jeu = MappingProxyType(dict(jeu))
+        self._pages_par_ordre = tuple(MappingProxyType(dict(p)) for p in pages)
+        self.pages = MappingProxyType({p["id_page"]: p for p in self._pages_par_ordre})
+        par_source: dict[int, list[dict]] = {}
+        for t in transitions:
+            par_source.setdefault(t["id_page_source"], []).append(MappingProxyType(dict(t)))
+        self._transitions = MappingProxyType(
+            {page_id: tuple(liste) for page_id, liste in par_source.items()}
+        )
+        self._pnjs = MappingProxyType({p["id"]: MappingProxyType(dict(p)) for p in pnjs})
+        par_pnj: dict[int, list[dict]] = {}
+        for e in enigmes:
+            par_pnj.setdefault(e["id_pnj"], []).append(MappingProxyType(dict(e)))
+        self._enigmes = MappingProxyType({k: tuple(v) for k, v in par_pnj.items()})
+        self._prompts: dict[int, str] = {}
+
+    @property
+    def jeu(self) -> dict:
+        return dict(self._jeu)
+
+    def page(self, page_id: int) -> dict | None:
+        page = self.pages.get(page_id)
+        return dict(page) if page else None
+
+    def premiere_page(self) -> dict | None:
+        return dict(self._pages_par_ordre[0]) if self._pages_par_ordre else None
+
+    def transitions(self, page_id: int) -> list[dict]:
+        """Transitions partant de ``page_id``, par ordre de priorité."""
+        return list(self._transitions.get(page_id, ()))
+
+    def pnj(self, pnj_id: int) -> dict | None:
+        pnj = self._pnjs.get(pnj_id)
+        return dict(pnj) if pnj else None
+
+    def enigmes(self, pnj_id: int) -> list[dict]:
+        return [dict(e) for e in self._enigmes.get(pnj_id, ())]
+
+    def prompt_pnj(self, pnj_id: int, construire: Callable[[dict, list[dict]], str]) -> str:
+        """Prompt de base du PNJ, construit une seule fois par instantané."""
+        prompt = self._prompts.get(pnj_id)
+        if prompt is None:
+            pnj = self.pnj(pnj_id)
+            prompt = construire(pnj, self.enigmes(pnj_id)) if pnj else ""
+            self._prompts[pnj_id] = prompt
+        return prompt
+
+
+# Colonnes utiles aux routes de jeu, aux prompts PNJ et à la pré-génération
+COLONNES_JEU = "id_jeu, titre, slug, version, nom_de_la_voie, voie_actif, budget_dialogue"
+# Le contenu brut n'est lu que pour une page pas encore compilée
+COLONNES_PAGE = (
+    "id_page, id_jeu, titre, ordre, contenu_compile, tts_texte, tts_voix, "
+    "CASE WHEN contenu_compile IS NULL THEN contenu END AS contenu, "
+    "id_pnj, page_suivante, delai_fermeture, bouton_texte, enigme_texte, est_aide, "
+    "image_fond, musique"
+)
+COLONNES_TRANSITION = (
+    "t.id_transition, t.id_page_source, t.id_page_cible, t.intention, t.priorite, "
+    "t.reponse_systeme"
+)
+
+# Tout le contenu jouable d'un jeu en un seul document JSON
+REQUETE_INSTANTANE = f"""
+SELECT json_build_object(
+    'jeu', (SELECT row_to_json(j) FROM (
+        SELECT {COLONNES_JEU} FROM jeux WHERE id_jeu = $1
+    ) j),
+    'pages', (SELECT coalesce(json_agg(p ORDER BY p.ordre), '[]') FROM (
+        SELECT {COLONNES_PAGE} FROM pages WHERE id_jeu = $1
+    ) p),
+    'transitions', (SELECT coalesce(json_agg(t ORDER BY t.priorite, t.id_transition), '[]') FROM (
+        SELECT {COLONNES_TRANSITION} FROM transitions t
+        JOIN pages p ON p.id_page = t.id_page_source
+        WHERE p.id_jeu = $1
+    ) t),
+    'pnjs', (SELECT coalesce(json_agg(n ORDER BY n.id), '[]') FROM (
+        SELECT id, id_jeu, nom, personae, prompt FROM pnj WHERE id_jeu = $1
+    ) n),
+    'enigmes', (SELECT coalesce(json_agg(e ORDER BY e.id), '[]') FROM (
+        SELECT e.id, e.id_pnj, e.texte_enigme, e.texte_reponse, e.textes_indices
+        FROM enigmes e JOIN pnj ON pnj.id = e.id_pnj
+        WHERE pnj.id_jeu = $1
+    ) e)
+)
+"""
+
+
+def charger_instantane(conn, jeu_id: int) -> Instantane | None:
+    """Lit en base tout le contenu jouable d'un jeu, en un aller-retour."""
+    with conn.cursor() as cur:
+        executer_preparee(cur, "station72_instantane", "integer", REQUETE_INSTANTANE, (jeu_id,))
+        contenu = cur.fetchone()[0]
+    if not contenu["jeu"]:
+        return None
+    return Instantane(
+        contenu["jeu"],
+        contenu["pages"],
+        contenu["transitions"],
+        contenu["pnjs"],
+        contenu["enigmes"],
+    )
+
+
+def lire_version(conn, jeu_id: int) -> int | None:
+    with conn.cursor() as cur:
+        executer_preparee(
+            cur,
+            "station72_version",
+            "integer",
+            "SELECT version FROM jeux WHERE id_jeu = $1",
+            (jeu_id,),
+        )
+        ligne = cur.fetchone()
+        return ligne[0] if ligne else None
+
+
+class RegistreInstantanes:
+    """Instantanés par jeu, remplacés d'un bloc quand leur version change.
+
+    ``connexion`` est un gestionnaire de contexte fournissant une connexion
+    (``get_conn`` des applications). Les fonctions passées à ``abonner`` sont
+    appelées avec ``(jeu_id, ancien_instantane)`` à chaque invalidation.
+    """
+
+    def __init__(self, connexion, ttl: float = TTL):
+        self.connexion = connexion
+        self.ttl = ttl
+        self._instantanes: dict[int, Instantane] = {}
+        self._perimes: set[int] = set()
+        self._abonnes: list[Callable[[int, Instantane | None], None]] = []
+        self._verrous: dict[int, threading.Lock] = {}
+        self._verrou = threading.Lock()
+
+    def abonner(self, fonction: Callable[[int, Instantane | None], None]) -> None:
+        self._abonnes.append(fonction)
+
+    def en_cache(self, jeu_id: int) -> Instantane | None:
+        """Instantané utilisable sans accès à la base, sinon ``None``."""
+        instantane = self._instantanes.get(jeu_id)
+        if (
+            instantane
+            and jeu_id not in self._perimes
+            and time.time() - instantane.charge_a < self.ttl
+        ):
+            return instantane
+        return None
+
+    def _verrou_pour(self, jeu_id: int) -> threading.Lock:
+        with self._verrou:
+            return self._verrous.setdefault(jeu_id, threading.Lock())
+
+    def obtenir(self, jeu_id: int) -> Instantane | None:
+        """Instantané à jour du jeu, chargé ou revérifié si besoin."""
+        instantane = self.en_cache(jeu_id)
+        if instantane:
+            return instantane
+        with self._verrou_pour(jeu_id):
+            instantane = self.en_cache(jeu_id)
+            if instantane:
+                return instantane
+            ancien = self._instantanes.get(jeu_id)
+            with self.connexion() as conn:
+                if ancien and jeu_id not in self._perimes:
+                    # TTL écoulé sans notification : la version suffit à trancher
+                    if lire_version(conn, jeu_id) == ancien.version:
+                        ancien.charge_a = time.time()
+                        return ancien
+                self._perimes.discard(jeu_id)
+                instantane = charger_instantane(conn, jeu_id)
+            with self._verrou:
+                if instantane:
+                    self._instantanes[jeu_id] = instantane
+                else:
+                    self._instantanes.pop(jeu_id, None)
+            if ancien and (not instantane or instantane.version != ancien.version):
+                self._prevenir(jeu_id, ancien)
+            return instantane
+
+    def invalider(self, jeu_id: int | None = None) -> None:
+        """Marque l'instantané du jeu (ou de tous les jeux) comme périmé."""
+        with self._verrou:
+            cibles = list(self._instantanes) if jeu_id is None else [jeu_id]
+            self._perimes.update(cibles)
+        for cible in cibles:
+            self._prevenir(cible, self._instantanes.get(cible))
+
+    def _prevenir(self, jeu_id: int, ancien: Instantane | None) -> None:
+        for fonction in self._abonnes:
+            try:
+                fonction(jeu_id, ancien)
+            except Exception as exc:
+                print(f"[DEBUG] Abonné aux instantanés en échec : {exc}")
+
+
+class Ecouteur:
+    """Fil de fond à l'écoute de ``CANAL`` ; invalide les jeux notifiés.
+
+    ``connecter`` ouvre une connexion dédiée (hors pool, en autocommit). Après
+    une coupure, tous les instantanés sont invalidés : des notifications ont
+    pu être perdues.
+    """
+
+    def __init__(self, registre: RegistreInstantanes, connecter: Callable, attente: float = 5.0):
+        self.registre = registre
+        self.connecter = connecter
+        self.attente = attente
+        self._arret = threading.Event()
+        self._fil: threading.Thread | None = None
+
+    def demarrer(self) -> None:
+        if self._fil and self._fil.is_alive():
+            return
+        self._arret.clear()
+        self._fil = threading.Thread(target=self._boucle, name="ecoute-jeux", daemon=True)
+        self._fil.start()
+
+    def arreter(self) -> None:
+        self._arret.set()
+
+    def _boucle(self) -> None:
+        while not self._arret.is_set():
+            try:
+                self._ecouter()
+            except Exception as exc:
+                print(f"[DEBUG] Écoute de {CANAL} interrompue : {exc}")
+            self.registre.invalider()
+            self._arret.wait(self.attente)
+
+    def _ecouter(self) -> None:
+        conn = self.connecter()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {CANAL}")
+            while not self._arret.is_set():
+                if select.select([conn], [], [], self.attente) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notification = conn.notifies.pop(0)
+                    try:
+                        jeu_id = int(notification.payload)
+                    except ValueError:
+                        continue
+                    print(f"[DEBUG] Jeu {jeu_id} modifié : instantané invalidé")
+                    self.registre.invalider(jeu_id)
+        finally:
+            conn.close()
@@ -0,0 +1,468 @@
+"""Reconnaissance locale des intentions du joueur.
+
+Pour chaque page source, les intentions de ses transitions sont compilées une
+fois (texte normalisé sans accents ni casse, mots, trigrammes). Une saisie est
+ensuite comparée en mémoire : correspondance exacte d'une expression, puis
+score approché par mots (distance d'édition) et par trigrammes. Une saisie
+d'un seul mot est aussi reconnue quand ce mot n'appartient qu'à une transition
+de la page (« gauche » pour « porte de gauche » face à « porte de droite »).
+Seules les saisies sans gagnant net sont confiées à l'IA.
+
+En mode ``vecteurs`` (``INTENTIONS_MODE``), les intentions sont aussi
+vectorisées à la compilation ; une saisie non reconnue localement est alors
+classée par similarité cosinus avec une seule multiplication matrice-vecteur,
+et l'IA ne tranche que si les deux meilleures intentions sont trop proches.
+
+``RegistreMatcheurs.decider`` enchaîne ces étapes (matcheur local, décision
+mémorisée, embeddings, IA) sans faire lui-même d'appel réseau : il demande
+l'embedding de la saisie ou la réponse de l'IA, et ``resoudre`` (ou
+``resoudre_async``) les obtient avec les fonctions synchrones ou asynchrones
+de l'appelant.
+"""
+
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Awaitable, Callable, Generator
+
+import numpy as np
+
+# Score minimal d'une correspondance approchée
+SEUIL = float(os.getenv("INTENTION_SEUIL", "0.75"))
+# Écart minimal entre la meilleure intention et la suivante
+MARGE = float(os.getenv("INTENTION_MARGE", "0.1"))
+# Durée de vie d'un matcheur compilé, en secondes
+TTL = float(os.getenv("INTENTIONS_TTL", "60"))
+# Durée de vie et nombre maximal par page des décisions mémorisées
+DECISIONS_TTL = float(os.getenv("INTENTIONS_DECISIONS_TTL", "3600"))
+DECISIONS_MAX = int(os.getenv("INTENTIONS_DECISIONS_MAX", "500"))
+# « texte » : comparaison approchée seule ; « vecteurs » : ajoute les embeddings
+MODE = os.getenv("INTENTIONS_MODE", "texte")
+# Similarité cosinus minimale et écart minimal entre les deux meilleures
+SEUIL_VECTEUR = float(os.getenv("INTENTION_SEUIL_VECTEUR", "0.6"))
+MARGE_VECTEUR = float(os.getenv("INTENTION_MARGE_VECTEUR", "0.05"))
+
+# Appels réseau demandés par ``RegistreMatcheurs.decider``
+EMBEDDING = "embedding"
+IA = "ia"
+
+MOTS_VIDES = {
+    "a", "au", "aux", "d", "de", "des", "du", "en", "et", "j", "je", "l", "la",
+    "le", "les", "sur", "un", "une", "vers",
+}
+
+
+def normaliser(texte: str) -> str:
+    """Minuscules, sans accents ni ponctuation, espaces réduits."""
+    texte = unicodedata.normalize("NFKD", texte.lower())
+    texte = "".join(c for c in texte if not unicodedata.combining(c))
+    return " ".join(re.findall(r"[a-z0-9]+", texte))
+
+
+def mots(texte_normalise: str) -> list[str]:
+    """Mots significatifs d'un texte déjà normalisé."""
+    return [m for m in texte_normalise.split() if m not in MOTS_VIDES]
+
+
+def trigrammes(liste_mots: list[str]) -> set[str]:
+    """Trigrammes de caractères de chaque mot, bordés d'espaces."""
+    resultat: set[str] = set()
+    for mot in liste_mots:
+        borde = f" {mot} "
+        resultat.update(borde[i : i + 3] for i in range(len(borde) - 2))
+    return resultat
+
+
+def _distance(a: str, b: str, limite: int) -> int:
+    """Distance de Levenshtein, interrompue dès qu'elle dépasse ``limite``."""
+    if abs(len(a) - len(b)) > limite:
+        return limite + 1
+    precedente = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        courante = [i]
+        for j, cb in enumerate(b, 1):
+            courante.append(
+                min(precedente[j] + 1, courante[j - 1] + 1, precedente[j - 1] + (ca != cb))
+            )
+        if min(courante) > limite:
+            return limite + 1
+        precedente = courante
+    return precedente[-1]
+
+
+def similarite_mot(attendu: str, saisi: str) -> float:
+    """Similarité de deux mots ; les mots courts doivent être identiques."""
+    if attendu == saisi:
+        return 1.0
+    longueur = max(len(attendu), len(saisi))
+    tolerance = 0 if longueur <= 3 else 1 if longueur <= 7 else 2
+    distance = _distance(attendu, saisi, tolerance)
+    if distance > tolerance:
+        return 0.0
+    return 1.0 - distance / longueur
+
+
+def _unitaire(vecteur) -> np.ndarray:
+    v = np.asarray(vecteur, dtype=np.float32)
+    norme = np.linalg.norm(v)
+    return v / norme if norme else v
+
+
+class Variante:
+    """Une formulation d'intention, précompilée."""
+
+    def __init__(self, texte: str):
+        self.brut = texte.strip()
+        self.texte = normaliser(texte)
+        self.mots = mots(self.texte) or self.texte.split()
+        self.trigrammes = trigrammes(self.mots)
+
+    def score(self, saisie: str, mots_saisis: list[str], tri_saisie: set[str]) -> float:
+        if not self.texte or not mots_saisis:
+            return 0.0
+        # Seule une intention entière présente dans la saisie est certaine : une
+        # saisie qui n'est qu'une partie de l'intention (« porte » pour « porte
+        # de droite ») passe par le score approché
+        if f" {self.texte} " in f" {saisie} ":
+            return 1.0
+        score_mots = sum(
+            max(similarite_mot(m, s) for s in mots_saisis) for m in self.mots
+        ) / len(self.mots)
+        score_tri = len(self.trigrammes & tri_saisie) / len(self.trigrammes)
+        return 0.8 * score_mots + 0.2 * score_tri
+
+
+def construire_prompt_intention(saisie: str, possibles: list[dict]) -> str:
+    """Prompt demandant à l'IA l'identifiant de l'intention la plus proche."""
+    liste_reponses = "\n".join(
+        f"{p['id_transition']} : {p['intention']}" for p in possibles
+    )
+
+    return (
+        "Tu es une IA spécialisée dans l'analyse de correspondance entre une phrase et une liste de réponses possibles.\n"
+        "Ton rôle est de choisir uniquement l’ID correspondant à la meilleure correspondance sémantique.\n"
+        "Si une réponse correspond clairement, tu dois répondre uniquement par l’ID (exemple : 3).\n"
+        "Si aucune correspondance ne convient, réponds uniquement : 0.\n"
+        "⚠️ Réponds **strictement** par un seul nombre, sans phrase, sans explication, sans ponctuation.\n\n"
+        "Exemple 1 :\n"
+        'Saisie utilisateur : "je veux allais sur la porte de gaiche"\n'
+        "Réponses possibles :\n"
+        "1 : droite\n2 : gauche\n3 : arrière\n"
+        "Réponse attendue : 2\n\n"
+        "Exemple 2 :\n"
+        'Saisie utilisateur : "prout"\n'
+        "Réponses possibles :\n"
+        "1 : rouge\n2 : bleu\n3 : jaune\n"
+        "Réponse attendue : 0\n\n"
+        f'Saisie utilisateur : "{saisie}"\n'
+        "Réponses possibles :\n"
+        f"{liste_reponses}\n\n"
+        "Réponds uniquement par un entier :"
+    )
+
+
+def lire_id_ia(reponse_id_str: str, possibles: list[dict]) -> int | None:
+    """Valide la réponse brute de l'IA ; ``None`` si elle est inexploitable."""
+    print(f"[DEBUG] Réponse IA brute : {reponse_id_str!r}")
+
+    try:
+        reponse_id = int(reponse_id_str.strip())
+    except Exception:
+        print("[DEBUG] Réponse IA invalide (non entier)")
+        return None
+
+    if reponse_id not in [p["id_transition"] for p in possibles]:
+        print("[DEBUG] ID IA non présent dans les transitions possibles")
+        return None
+    return reponse_id
+
+
+class MatcheurPage:
+    """Intentions compilées des transitions d'une page source.
+
+    ``transitions`` est la liste complète des lignes de la table, triées par
+    priorité : elle sert aussi à l'IA et à charger la transition retenue.
+    Une intention peut proposer plusieurs formulations séparées par ``|`` ou
+    ``;``.
+    """
+
+    def __init__(self, transitions: list[dict]):
+        self.transitions = transitions
+        self.charge_a = time.time()
+        self._par_id = {t["id_transition"]: t for t in transitions}
+        self._variantes = [
+            (t, [Variante(v) for v in re.split(r"[|;\n]", t.get("intention") or "") if v.strip()])
+            for t in transitions
+        ]
+        # Mot significatif -> indices des transitions qui l'emploient
+        self._mots: dict[str, set[int]] = {}
+        for indice, (_, variantes) in enumerate(self._variantes):
+            for variante in variantes:
+                for mot in variante.mots:
+                    self._mots.setdefault(mot, set()).add(indice)
+        # Embeddings unitaires des variantes et indice de leur transition
+        self._matrice: np.ndarray | None = None
+        self._proprietaires: np.ndarray | None = None
+
+    @property
+    def vectorise(self) -> bool:
+        return self._matrice is not None
+
+    def vectoriser(
+        self,
+        vectoriseur: Callable[[str], list[float]],
+        connus: dict[str, np.ndarray] | None = None,
+    ) -> None:
+        """Calcule la matrice des embeddings des intentions.
+
+        ``connus`` mémorise les vecteurs déjà calculés (par texte) : une page
+        recompilée ne revectorise que ses intentions nouvelles ou modifiées.
+        """
+        connus = {} if connus is None else connus
+        lignes: list[np.ndarray] = []
+        proprietaires: list[int] = []
+        for indice, (_, variantes) in enumerate(self._variantes):
+            for variante in variantes:
+                vecteur = connus.get(variante.brut)
+                if vecteur is None:
+                    vecteur = connus[variante.brut] = _unitaire(vectoriseur(variante.brut))
+                lignes.append(vecteur)
+                proprietaires.append(indice)
+        if lignes:
+            self._matrice = np.vstack(lignes)
+            self._proprietaires = np.array(proprietaires)
+
+    def classer_vecteur(self, vecteur: list[float]) -> list[tuple[float, dict]]:
+        """Similarité cosinus de chaque transition avec l'embedding d'une saisie."""
+        similarites = self._matrice @ _unitaire(vecteur)
+        scores = np.full(len(self.transitions), -1.0)
+        # Une transition vaut sa variante la plus proche
+        np.maximum.at(scores, self._proprietaires, similarites)
+        ordre = np.argsort(-scores, kind="stable")
+        return [(float(scores[i]), self.transitions[i]) for i in ordre]
+
+    def chercher_vecteur(self, vecteur: list[float]) -> dict | None:
+        """Transition la plus proche si elle se détache nettement, sinon ``None``."""
+        if not self.vectorise:
+            return None
+        classement = self.classer_vecteur(vecteur)
+        meilleur, transition = classement[0]
+        second = classement[1][0] if len(classement) > 1 else -1.0
+        if meilleur >= SEUIL_VECTEUR and meilleur - second >= MARGE_VECTEUR:
+            return transition
+        return None
+
+    def transition(self, transition_id: int) -> dict | None:
+        return self._par_id.get(transition_id)
+
+    def classer(self, saisie: str) -> list[tuple[float, dict]]:
+        """Scores de chaque transition pour ``saisie``, du meilleur au moins bon."""
+        texte = normaliser(saisie)
+        mots_saisis = mots(texte)
+        tri_saisie = trigrammes(mots_saisis)
+        scores = [
+            (max((v.score(texte, mots_saisis, tri_saisie) for v in variantes), default=0.0), t)
+            for t, variantes in self._variantes
+        ]
+        # Tri stable : à score égal, l'ordre de priorité est conservé
+        return sorted(scores, key=lambda st: -st[0])
+
+    def chercher(self, saisie: str) -> dict | None:
+        """Transition reconnue avec assurance, sinon ``None`` (à confier à l'IA)."""
+        if not self.transitions:
+            return None
+        if not normaliser(saisie):
+            # Comme l'ancienne recherche SQL : une saisie vide prend la première
+            return self.transitions[0]
+        classement = self.classer(saisie)
+        meilleur, transition = classement[0]
+        second = classement[1][0] if len(classement) > 1 else 0.0
+        # La marge s'applique aussi aux correspondances exactes : une égalité
+        # est confiée à l'IA
+        if meilleur >= SEUIL and meilleur - second >= MARGE:
+            return transition
+        return self._mot_distinctif(mots(normaliser(saisie)))
+
+    def _mot_distinctif(self, mots_saisis: list[str]) -> dict | None:
+        """Transition désignée par une saisie d'un seul mot, propre à elle seule.
+
+        Le score approché divise par le nombre de mots de l'intention : « gauche »
+        n'atteint pas ``SEUIL`` face à « porte de gauche ». Si tous les mots
+        d'intention proches du mot saisi appartiennent à la même transition, la
+        saisie la désigne sans ambiguïté ; « porte », commun à plusieurs, non.
+        """
+        if len(mots_saisis) != 1:
+            return None
+        proprietaires: set[int] = set()
+        for mot, indices in self._mots.items():
+            if similarite_mot(mot, mots_saisis[0]) >= SEUIL:
+                proprietaires |= indices
+        if len(proprietaires) == 1:
+            return self._variantes[proprietaires.pop()][0]
+        return None
+
+
+class RegistreMatcheurs:
+    """Matcheurs compilés par page, rechargés après ``ttl`` ou sur invalidation.
+
+    Si ``vectoriseur`` est défini (texte → embedding), chaque matcheur installé
+    est vectorisé ; un échec de vectorisation laisse le matcheur textuel seul.
+
+    Le registre mémorise aussi les décisions coûteuses (embeddings, IA) par
+    page et saisie normalisée : un joueur qui tape la même réponse qu'un autre
+    obtient la même transition sans nouvel appel.
+    """
+
+    def __init__(
+        self,
+        ttl: float = TTL,
+        decisions_ttl: float = DECISIONS_TTL,
+        decisions_max: int = DECISIONS_MAX,
+    ):
+        self.ttl = ttl
+        self.decisions_ttl = decisions_ttl
+        self.decisions_max = decisions_max
+        # page -> saisie normalisée -> (id de transition ou 0, horodatage)
+        self._decisions: dict[int, dict[str, tuple[int, float]]] = {}
+        self.vectoriseur: Callable[[str], list[float]] | None = None
+        self._matcheurs: dict[int, MatcheurPage] = {}
+        self._vecteurs: dict[str, np.ndarray] = {}
+        self._verrou = threading.Lock()
+
+    def en_cache(self, page_id: int) -> MatcheurPage | None:
+        matcheur = self._matcheurs.get(page_id)
+        if matcheur and time.time() - matcheur.charge_a < self.ttl:
+            return matcheur
+        return None
+
+    def installer(self, page_id: int, transitions: list[dict]) -> MatcheurPage:
+        matcheur = MatcheurPage(transitions)
+        if self.vectoriseur is not None:
+            try:
+                matcheur.vectoriser(self.vectoriseur, self._vecteurs)
+            except Exception as exc:
+                print(f"[DEBUG] Vectorisation des intentions de la page {page_id} impossible : {exc}")
+        with self._verrou:
+            self._matcheurs[page_id] = matcheur
+        return matcheur
+
+    def decision(self, page_id: int, saisie: str) -> int | None:
+        """Décision mémorisée : id de transition, 0 si aucune, ``None`` si inconnue."""
+        decisions = self._decisions.get(page_id)
+        if not decisions:
+            return None
+        entree = decisions.get(normaliser(saisie))
+        if entree is None or time.time() - entree[1] >= self.decisions_ttl:
+            return None
+        return entree[0]
+
+    def memoriser(self, page_id: int, saisie: str, transition_id: int) -> None:
+        """Mémorise la décision prise pour ``saisie`` (0 : aucune correspondance)."""
+        cle = normaliser(saisie)
+        with self._verrou:
+            decisions = self._decisions.setdefault(page_id, {})
+            decisions.pop(cle, None)
+            decisions[cle] = (transition_id, time.time())
+            # Les décisions les plus anciennes sont oubliées en premier
+            while len(decisions) > self.decisions_max:
+                del decisions[next(iter(decisions))]
+
+    def decider(
+        self, page_id: int, matcheur: MatcheurPage, saisie: str
+    ) -> Generator[tuple[str, str], object, tuple[dict | None, str]]:
+        """Étapes de la décision pour ``saisie`` sur la page ``page_id``.
+
+        Générateur : il produit ``(EMBEDDING, saisie)`` ou ``(IA, prompt)`` et
+        reçoit l'embedding ou la réponse brute de l'IA. Il renvoie
+        ``(transition ou None, origine)`` ; ``resoudre`` et ``resoudre_async``
+        le conduisent jusqu'au bout.
+        """
+        transition = matcheur.chercher(saisie)
+        if transition:
+            return transition, "locale"
+
+        # Décision déjà prise pour la même saisie sur cette page
+        decision = self.decision(page_id, saisie)
+        if decision is not None:
+            return matcheur.transition(decision), "mémorisée"
+
+        if matcheur.vectorise:
+            try:
+                vecteur = yield EMBEDDING, saisie
+            except RuntimeError as exc:
+                print(f"[DEBUG] {exc}")
+            else:
+                transition = matcheur.chercher_vecteur(vecteur)
+                if transition:
+                    self.memoriser(page_id, saisie, transition["id_transition"])
+                    return transition, "vecteurs"
+
+        possibles = matcheur.transitions
+        if not possibles:
+            print("[DEBUG] Aucune réponse possible définie pour cette page.")
+            return None, "aucune"
+
+        print("[DEBUG] Envoi prompt à l’IA Mistral…")
+        reponse_id_str = yield IA, construire_prompt_intention(saisie, possibles)
+        reponse_id = lire_id_ia(reponse_id_str, possibles)
+        # Une erreur réseau n'est pas mémorisée ; un « 0 » (aucune intention) l'est
+        if reponse_id is not None or reponse_id_str.strip().isdigit():
+            self.memoriser(page_id, saisie, reponse_id or 0)
+        if reponse_id is None:
+            return None, "IA"
+        return matcheur.transition(reponse_id), "IA"
+
+    def invalider(self, *pages: int) -> None:
+        """Oublie matcheurs et décisions des ``pages`` (tout si aucune n'est donnée)."""
+        with self._verrou:
+            if not pages:
+                self._matcheurs.clear()
+                self._decisions.clear()
+            for page_id in pages:
+                self._matcheurs.pop(page_id, None)
+                self._decisions.pop(page_id, None)
+
+
+matcheurs = RegistreMatcheurs()
+
+
+def resoudre(
+    etapes: Generator,
+    vectoriser: Callable[[str], list[float]],
+    repondre: Callable[[str], str],
+) -> tuple[dict | None, str]:
+    """Conduit ``RegistreMatcheurs.decider`` avec des appels réseau synchrones."""
+    try:
+        demande = next(etapes)
+        while True:
+            nature, argument = demande
+            try:
+                resultat = (vectoriser if nature == EMBEDDING else repondre)(argument)
+            except Exception as exc:
+                demande = etapes.throw(exc)
+            else:
+                demande = etapes.send(resultat)
+    except StopIteration as fin:
+        return fin.value
+
+
+async def resoudre_async(
+    etapes: Generator,
+    vectoriser: Callable[[str], Awaitable[list[float]]],
+    repondre: Callable[[str], Awaitable[str]],
+) -> tuple[dict | None, str]:
+    """Équivalent asynchrone de ``resoudre``."""
+    try:
+        demande = next(etapes)
+        while True:
+            nature, argument = demande
+            try:
+                resultat = await (vectoriser if nature == EMBEDDING else repondre)(argument)
+            except Exception as exc:
+                demande = etapes.throw(exc)
+            else:
+                demande = etapes.send(resultat)
+    except StopIteration as fin:
+        return fin.value
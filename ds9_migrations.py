@@ -0,0 +1,123 @@
+"""Migrations versionnées du schéma Postgres.
+
+Chaque fichier ``migrations/NNNN_nom.sql`` est appliqué une seule fois, dans
+l'ordre de son numéro, et consigné dans la table ``schema_migrations`` avec
+l'empreinte de son contenu. Les deux applications vérifient le schéma au
+démarrage (``verifier_schema``) ; un verrou consultatif Postgres empêche deux
+processus de migrer en même temps.
+
+Les migrations s'appliquent aussi à la main :
+
+    python ds9_migrations.py
+"""
+
+import hashlib
+import os
+import re
+
+DOSSIER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+# « 1 » : applique les migrations au démarrage ; « 0 » : refuse de démarrer
+# tant qu'il en reste à appliquer
+AUTO = os.getenv("MIGRATIONS_AUTO", "1") != "0"
+# Clé du verrou consultatif (pg_advisory_lock) partagé par tous les processus
+CLE_VERROU = 72_0001
+
+
+class MigrationsEnAttente(RuntimeError):
+    """Le schéma de la base est en retard sur le code."""
+
+
+def migrations_disponibles(dossier: str = DOSSIER) -> list[tuple[int, str, str]]:
+    """``(version, nom, chemin)`` des fichiers de migration, par version."""
+    resultat = []
+    for fichier in os.listdir(dossier):
+        correspondance = re.fullmatch(r"(\d+)_(.+)\.sql", fichier)
+        if correspondance:
+            resultat.append(
+                (int(correspondance[1]), correspondance[2], os.path.join(dossier, fichier))
+            )
+    return sorted(resultat)
+
+
+def _empreinte(sql: str) -> str:
+    return hashlib.sha256(sql.encode("utf-8")).hexdigest()
+
+
+def _appliquees(cur) -> dict[int, str]:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            nom TEXT NOT NULL,
+            empreinte TEXT NOT NULL,
+            appliquee_a TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    cur.execute("SELECT version, empreinte FROM schema_migrations")
+    return dict(cur.fetchall())
+
+
+def migrer(conn, dossier: str = DOSSIER, appliquer: bool = True) -> list[str]:
+    """Applique les migrations manquantes et renvoie leurs noms.
+
+    Avec ``appliquer=False``, renvoie seulement les migrations en attente.
+    Chaque migration s'exécute dans sa propre transaction.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s)", (CLE_VERROU,))
+        try:
+            appliquees = _appliquees(cur)
+            conn.commit()
+            faites = []
+            for version, nom, chemin in migrations_disponibles(dossier):
+                with open(chemin, encoding="utf-8") as f:
+                    sql = f.read()
+                if version in appliquees:
+                    if appliquees[version] != _empreinte(sql):
+                        print(f"[DEBUG] Migration {version:04d}_{nom} modifiée depuis son application")
+                    continue
+                if appliquer:
+                    cur.execute(sql)
+                    cur.execute(
+                        "INSERT INTO schema_migrations (version, nom, empreinte) VALUES (%s, %s, %s)",
+                        (version, nom, _empreinte(sql)),
+                    )
+                    conn.commit()
+                    print(f"[DEBUG] Migration {version:04d}_{nom} appliquée")
+                faites.append(f"{version:04d}_{nom}")
+            return faites
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (CLE_VERROU,))
+            conn.commit()
+
+
+def verifier_schema(conn, auto: bool = AUTO) -> None:
+    """Au démarrage : migre la base, ou lève ``MigrationsEnAttente`` si ``auto`` est faux."""
+    en_attente = migrer(conn, appliquer=auto)
+    if en_attente and not auto:
+        raise MigrationsEnAttente(
+            "Migrations à appliquer (python ds9_migrations.py) : " + ", ".join(en_attente)
+        )
+
+
+if __name__ == "__main__":
+    import psycopg2
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    connexion = psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+    )
+    try:
+        faites = migrer(connexion)
+        print("\n".join(faites) if faites else "Schéma à jour.")
+    finally:
+        connexion.close()
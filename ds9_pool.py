@@ -0,0 +1,219 @@
+"""Pool de connexions Postgres partagé par l'éditeur et les routes de jeu.
+
+``psycopg2.pool.SimpleConnectionPool`` n'est pas sûr entre fils d'exécution,
+or FastAPI exécute les routes synchrones en parallèle dans son threadpool. Ce
+pool s'appuie sur ``ThreadedConnectionPool`` et ajoute :
+
+- une attente bornée (``DB_POOL_TIMEOUT``) quand toutes les connexions sont
+  prises, au lieu d'une erreur immédiate ;
+- une vérification des connexions restées inactives (``SELECT 1``), les
+  connexions mortes étant remplacées ;
+- l'annulation de toute transaction laissée ouverte avant de rendre une
+  connexion, pour qu'une requête n'hérite jamais de l'état d'une autre ;
+- des mesures d'attente (``etat``).
+
+Une connexion appartient au bloc ``with`` qui l'a obtenue et ne doit pas en
+sortir.
+"""
+
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import ThreadedConnectionPool
+
+POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+# Attente maximale d'une connexion libre, en secondes
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Inactivité au-delà de laquelle une connexion est vérifiée avant usage
+POOL_VERIFICATION = float(os.getenv("DB_POOL_VERIFICATION", "30"))
+
+
+class PoolEpuise(RuntimeError):
+    """Aucune connexion ne s'est libérée dans le délai imparti."""
+
+
+class PoolConnexions:
+    """Pool de connexions sûr entre fils, ouvert à la première utilisation."""
+
+    def __init__(
+        self,
+        minimum: int = POOL_MIN,
+        maximum: int = POOL_MAX,
+        timeout: float = POOL_TIMEOUT,
+        verification: float = POOL_VERIFICATION,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.timeout = timeout
+        self.verification = verification
+        self._pool: ThreadedConnectionPool | None = None
+        self._places = threading.BoundedSemaphore(maximum)
+        self._verrou = threading.Lock()
+        # Dernière restitution de chaque connexion (par id)
+        self._rendues: dict[int, float] = {}
+        self._stats = {
+            "prises": 0,
+            "attentes": 0,
+            "attente_totale": 0.0,
+            "attente_max": 0.0,
+            "expirations": 0,
+            "remplacees": 0,
+        }
+        self._en_service = 0
+
+    def ouvrir(self) -> None:
+        with self._verrou:
+            if self._pool is None:
+                self._pool = ThreadedConnectionPool(
+                    self.minimum,
+                    self.maximum,
+                    host=os.getenv("DB_HOST"),
+                    port=os.getenv("DB_PORT"),
+                    dbname=os.getenv("DB_NAME"),
+                    user=os.getenv("DB_USER"),
+                    password=os.getenv("DB_PASSWORD"),
+                )
+
+    def fermer(self) -> None:
+        with self._verrou:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+                self._rendues.clear()
+
+    def _prendre(self):
+        debut = time.monotonic()
+        if not self._places.acquire(timeout=self.timeout):
+            with self._verrou:
+                self._stats["expirations"] += 1
+            raise PoolEpuise(
+                f"Aucune connexion libre après {self.timeout} s ({self.maximum} en service)"
+            )
+        attente = time.monotonic() - debut
+        try:
+            if self._pool is None:
+                self.ouvrir()
+            conn = self._verifier(self._pool.getconn())
+        except Exception:
+            self._places.release()
+            raise
+        with self._verrou:
+            self._en_service += 1
+            self._stats["prises"] += 1
+            if attente > 0.001:
+                self._stats["attentes"] += 1
+            self._stats["attente_totale"] += attente
+            self._stats["attente_max"] = max(self._stats["attente_max"], attente)
+        return conn
+
+    def _verifier(self, conn):
+        """Remplace la connexion si elle est fermée ou ne répond plus."""
+        rendue = self._rendues.get(id(conn))
+        if not conn.closed and (rendue is None or time.time() - rendue < self.verification):
+            return conn
+        try:
+            if conn.closed:
+                raise psycopg2.InterfaceError("connexion fermée")
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return conn
+        except psycopg2.Error as exc:
+            print(f"[DEBUG] Connexion Postgres remplacée : {exc}")
+            self._pool.putconn(conn, close=True)
+            with self._verrou:
+                self._stats["remplacees"] += 1
+            return self._pool.getconn()
+
+    def _rendre(self, conn) -> None:
+        casse = bool(conn.closed)
+        if not casse and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            # Transaction non validée ou en erreur : rien ne doit fuir
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                casse = True
+        self._rendues[id(conn)] = time.time()
+        try:
+            if self._pool is not None:
+                self._pool.putconn(conn, close=casse)
+        finally:
+            with self._verrou:
+                self._en_service -= 1
+            self._places.release()
+
+    @contextmanager
+    def connexion(self):
+        """Connexion réservée pour la durée du bloc ``with``."""
+        conn = self._prendre()
+        try:
+            yield conn
+        finally:
+            self._rendre(conn)
+
+    def etat(self) -> dict:
+        """Taille, connexions en service et mesures d'attente du pool."""
+        with self._verrou:
+            stats = dict(self._stats)
+            stats["attente_moyenne"] = (
+                stats["attente_totale"] / stats["prises"] if stats["prises"] else 0.0
+            )
+            return {
+                "ouvert": self._pool is not None,
+                "minimum": self.minimum,
+                "maximum": self.maximum,
+                "en_service": self._en_service,
+                **stats,
+            }
+
+
+# Instructions préparées côté serveur, par connexion
+_preparees: "weakref.WeakKeyDictionary[extensions.connection, set[str]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def executer_preparee(cur, nom: str, types: str, requete: str, params: tuple) -> None:
+    """Exécute ``requete`` comme instruction préparée ``nom`` sur la connexion de ``cur``.
+
+    Postgres ne planifie la requête qu'une fois par connexion. À la première
+    utilisation, ``PREPARE`` et ``EXECUTE`` partent dans le même aller-retour.
+    ``types`` liste les types des paramètres (``$1``, ``$2``…), par exemple
+    ``"integer"`` ; ``requete`` ne doit pas contenir de ``%``.
+
+    Si le suivi des instructions préparées ne correspond plus à la connexion
+    (instruction déjà préparée ou disparue), la transaction est annulée, les
+    instructions de la connexion sont toutes libérées et la requête est
+    relancée une fois.
+    """
+    try:
+        _executer_preparee(cur, nom, types, requete, params)
+    except (
+        psycopg2.errors.DuplicatePreparedStatement,
+        psycopg2.errors.InvalidSqlStatementName,
+    ) as exc:
+        print(f"[DEBUG] Instructions préparées réinitialisées ({nom}) : {exc}")
+        cur.connection.rollback()
+        cur.execute("DEALLOCATE ALL")
+        _preparees.pop(cur.connection, None)
+        _executer_preparee(cur, nom, types, requete, params)
+
+
+def _executer_preparee(cur, nom: str, types: str, requete: str, params: tuple) -> None:
+    deja = _preparees.setdefault(cur.connection, set())
+    marques = ", ".join(["%s"] * len(params))
+    execution = f"EXECUTE {nom}({marques})" if params else f"EXECUTE {nom}"
+    if nom in deja:
+        cur.execute(execution, params)
+        return
+    cur.execute(f"PREPARE {nom}({types}) AS {requete};\n{execution}", params)
+    deja.add(nom)
+
+
+pool_base = PoolConnexions()
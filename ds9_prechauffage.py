@@ -0,0 +1,108 @@
+"""Pré-génération des textes lus automatiquement (``<!--tts:...-->``).
+
+Après chaque modification d'un jeu, toutes ses pages sont parcourues et l'audio
+de leur marqueur TTS est synthétisé dans le cache partagé (``ds9_cache_tts``).
+Le joueur qui découvre une page trouve ainsi le fichier déjà prêt.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ds9_cache_tts import VOIX_DEFAUT, audio_en_cache, chercher_audio
+from ds9_contenu import contenu_page
+from ds9_tts import CAPACITE_XTTS
+
+# Avancement des travaux par identifiant de jeu
+ETATS: dict[int, dict] = {}
+_verrou = threading.Lock()
+
+
+def entrees_tts(jeu: dict, pages: list[dict]) -> list[dict]:
+    """Liste les textes à synthétiser pour les ``pages`` du ``jeu``.
+
+    La voix retenue est celle que choisiraient les routes de jeu : la balise
+    ``<voice>`` de la page, sinon la voix du jeu, sinon la voix par défaut.
+    """
+    if not jeu.get("voie_actif", True):
+        return []
+    entrees = []
+    for page in pages:
+        _, texte, voix = contenu_page(page)
+        if not texte:
+            continue
+        entrees.append(
+            {
+                "id_page": page["id_page"],
+                "titre": page.get("titre"),
+                "texte": texte,
+                "voix": voix or jeu.get("nom_de_la_voie") or VOIX_DEFAUT,
+            }
+        )
+    return entrees
+
+
+def etat_entrees(entrees: list[dict]) -> list[dict]:
+    """Ajoute à chaque entrée l'indicateur ``en_cache`` (faux = audio périmé ou absent)."""
+    return [
+        {**e, "en_cache": chercher_audio(e["voix"], e["texte"]) is not None}
+        for e in entrees
+    ]
+
+
+def _generer(entree: dict) -> bool:
+    try:
+        return audio_en_cache(entree["voix"], entree["texte"]) is not None
+    except Exception as exc:
+        print(f"[DEBUG] Pré-génération page {entree['id_page']} : {exc}")
+        return False
+
+
+def prechauffer(jeu: dict, pages: list[dict]) -> None:
+    """Synthétise l'audio manquant des ``pages``. Conçu pour une tâche de fond.
+
+    Si un travail est déjà en cours pour ce jeu, la demande est mémorisée et le
+    travail en cours repart une fois terminé avec les pages les plus récentes.
+    """
+    jeu_id = jeu["id_jeu"]
+    with _verrou:
+        etat = ETATS.get(jeu_id)
+        if etat and etat["en_cours"]:
+            etat["relance"] = (jeu, pages)
+            return
+        etat = {
+            "en_cours": True,
+            "relance": None,
+            "total": 0,
+            "faits": 0,
+            "erreurs": 0,
+            "debut": time.time(),
+            "fin": None,
+        }
+        ETATS[jeu_id] = etat
+
+    try:
+        while True:
+            entrees = entrees_tts(jeu, pages)
+            etat.update(total=len(entrees), faits=0, erreurs=0)
+            # Autant de synthèses en parallèle que les serveurs XTTS en acceptent
+            with ThreadPoolExecutor(max_workers=CAPACITE_XTTS) as executeur:
+                for ok in executeur.map(_generer, entrees):
+                    etat["faits"] += 1
+                    if not ok:
+                        etat["erreurs"] += 1
+
+            with _verrou:
+                if etat["relance"] is None:
+                    break
+                jeu, pages = etat["relance"]
+                etat["relance"] = None
+    finally:
+        with _verrou:
+            etat["en_cours"] = False
+            etat["fin"] = time.time()
+
+    print(
+        f"[DEBUG] Pré-génération jeu {jeu_id} terminée : "
+        f"{etat['faits'] - etat['erreurs']}/{etat['total']} audios prêts"
+    )
@@ -0,0 +1,324 @@
+"""Répartition de charge entre plusieurs serveurs d'un même service.
+
+Un fil de fond sonde régulièrement chaque serveur. À chaque requête, le
+répartiteur choisit parmi les serveurs sains celui qui a le moins de requêtes
+en cours, pondéré par sa latence observée. Un disjoncteur écarte un serveur
+après plusieurs échecs consécutifs puis le remet à l'essai après un délai.
+"""
+
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Awaitable, Callable
+
+
+class Serveur:
+    """État observé d'un serveur."""
+
+    def __init__(self, adresse: str):
+        self.adresse = adresse
+        self.sain = True
+        self.en_cours = 0
+        self.latence: float | None = None
+        self.echecs_consecutifs = 0
+        self.coupe_jusqua = 0.0
+
+    def etat(self) -> dict:
+        return {
+            "adresse": self.adresse,
+            "sain": self.sain,
+            "en_cours": self.en_cours,
+            "latence": round(self.latence, 3) if self.latence is not None else None,
+            "echecs_consecutifs": self.echecs_consecutifs,
+            "coupe": self.coupe_jusqua > time.time(),
+        }
+
+
+class Repartiteur:
+    """Choisit le serveur le moins chargé parmi les serveurs sains.
+
+    ``sonde`` reçoit une adresse et renvoie ``True`` si le serveur répond ;
+    elle est appelée toutes les ``intervalle`` secondes dans un fil de fond,
+    jamais sur le chemin d'une requête. Avec ``max_simultanes``, un serveur ne
+    reçoit jamais plus de requêtes en parallèle : les suivantes attendent
+    qu'une place se libère, au plus ``attente_max`` secondes.
+    """
+
+    def __init__(
+        self,
+        nom: str,
+        adresses: list[str] | tuple[str, ...],
+        sonde: Callable[[str], bool],
+        intervalle: float = 10.0,
+        seuil_echecs: int = 3,
+        duree_coupure: float = 30.0,
+        lissage: float = 0.3,
+        max_simultanes: int | None = None,
+        attente_max: float = 30.0,
+    ):
+        self.nom = nom
+        self.serveurs = [Serveur(a) for a in adresses]
+        self.sonde = sonde
+        self.intervalle = intervalle
+        self.seuil_echecs = seuil_echecs
+        self.duree_coupure = duree_coupure
+        self.lissage = lissage
+        self.max_simultanes = max_simultanes
+        self.attente_max = attente_max
+        self._verrou = threading.Lock()
+        self._libere = threading.Condition(self._verrou)
+        # Attentes asynchrones d'une place : (boucle, événement) à réveiller
+        self._attentes_async: set[tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self._fil: threading.Thread | None = None
+        self._arret = threading.Event()
+
+    # --- Sondes de santé ---------------------------------------------------
+
+    def demarrer(self) -> None:
+        """Lance le fil de sonde s'il ne tourne pas déjà."""
+        with self._verrou:
+            if self._fil and self._fil.is_alive():
+                return
+            self._arret.clear()
+            self._fil = threading.Thread(
+                target=self._boucle_sondes, name=f"sonde-{self.nom}", daemon=True
+            )
+            self._fil.start()
+
+    def arreter(self) -> None:
+        self._arret.set()
+
+    def sonder(self) -> None:
+        """Sonde une fois chaque serveur et met à jour leur état."""
+        for serveur in self.serveurs:
+            try:
+                ok = bool(self.sonde(serveur.adresse))
+            except Exception:
+                ok = False
+            with self._libere:
+                if ok == serveur.sain:
+                    continue
+                serveur.sain = ok
+                # Les requêtes en attente revoient leurs candidats : un serveur
+                # revenu leur offre des places, un serveur perdu peut n'en
+                # laisser aucun
+                self._reveiller(tous=True)
+            print(f"[DEBUG] {self.nom} {serveur.adresse} : {'disponible' if ok else 'injoignable'}")
+
+    def _boucle_sondes(self) -> None:
+        while not self._arret.is_set():
+            self.sonder()
+            self._arret.wait(self.intervalle)
+
+    # --- Choix du serveur --------------------------------------------------
+
+    def _utilisable(self, serveur: Serveur, maintenant: float) -> bool:
+        if not serveur.sain:
+            return False
+        if serveur.echecs_consecutifs < self.seuil_echecs:
+            return True
+        # Disjoncteur ouvert, puis semi-ouvert : une seule requête d'essai
+        return maintenant >= serveur.coupe_jusqua and serveur.en_cours == 0
+
+    def _sature(self, serveur: Serveur) -> bool:
+        return self.max_simultanes is not None and serveur.en_cours >= self.max_simultanes
+
+    def _score(self, serveur: Serveur, latence_defaut: float) -> float:
+        latence = serveur.latence if serveur.latence is not None else latence_defaut
+        return (serveur.en_cours + 1) * latence
+
+    def _choisir_libre(self, exclure: set[str], reserver: bool) -> Serveur | None:
+        """Choix sous verrou ; ``None`` si tous les serveurs utilisables sont saturés.
+
+        Sans réservation, la saturation est ignorée : on désigne simplement le
+        serveur le moins chargé.
+        """
+        maintenant = time.time()
+        candidats = [
+            s
+            for s in self.serveurs
+            if s.adresse not in exclure and self._utilisable(s, maintenant)
+        ]
+        if not candidats:
+            raise RuntimeError(f"Aucun serveur {self.nom} disponible.")
+        libres = [s for s in candidats if not (reserver and self._sature(s))]
+        if not libres:
+            return None
+        connues = [s.latence for s in libres if s.latence is not None]
+        latence_defaut = sum(connues) / len(connues) if connues else 1.0
+        serveur = min(libres, key=lambda s: self._score(s, latence_defaut))
+        if reserver:
+            serveur.en_cours += 1
+        return serveur
+
+    def choisir(
+        self,
+        reserver: bool = True,
+        exclure: set[str] | None = None,
+        limite: float | None = None,
+    ) -> Serveur:
+        """Réserve le serveur le moins chargé ; à libérer avec ``liberer``.
+
+        Avec ``reserver=False``, le serveur est seulement désigné. Les adresses
+        de ``exclure`` (serveurs déjà essayés) sont ignorées. ``limite`` (date
+        ``time.time()``) borne l'attente d'une place ; par défaut, dans
+        ``attente_max`` secondes.
+        """
+        self.demarrer()
+        exclure = exclure or set()
+        if limite is None:
+            limite = time.time() + self.attente_max
+        with self._libere:
+            while True:
+                serveur = self._choisir_libre(exclure, reserver)
+                if serveur is not None:
+                    return serveur
+                reste = limite - time.time()
+                if reste <= 0:
+                    raise RuntimeError(f"Tous les serveurs {self.nom} sont occupés.")
+                self._libere.wait(reste)
+
+    async def choisir_async(
+        self, exclure: set[str] | None = None, limite: float | None = None
+    ) -> Serveur:
+        """Version asynchrone de ``choisir`` : attend une place sans bloquer la boucle.
+
+        L'attente est réveillée par ``liberer``, ``abandonner`` ou le retour
+        d'un serveur (``sonder``), depuis n'importe quel fil.
+        """
+        self.demarrer()
+        exclure = exclure or set()
+        if limite is None:
+            limite = time.time() + self.attente_max
+        boucle = asyncio.get_running_loop()
+        while True:
+            attente = (boucle, asyncio.Event())
+            with self._verrou:
+                serveur = self._choisir_libre(exclure, True)
+                if serveur is not None:
+                    return serveur
+                self._attentes_async.add(attente)
+            try:
+                await asyncio.wait_for(attente[1].wait(), max(0.0, limite - time.time()))
+            except TimeoutError:
+                raise RuntimeError(f"Tous les serveurs {self.nom} sont occupés.") from None
+            finally:
+                with self._verrou:
+                    self._attentes_async.discard(attente)
+
+    def _reveiller(self, tous: bool = False) -> None:
+        """Sous verrou : signale une place libre aux attentes synchrones et asynchrones."""
+        if tous:
+            self._libere.notify_all()
+        else:
+            self._libere.notify()
+        # Chaque attente asynchrone revérifie sous verrou ; les perdantes se rendorment
+        for boucle, evenement in self._attentes_async:
+            try:
+                boucle.call_soon_threadsafe(evenement.set)
+            except RuntimeError:
+                # Boucle déjà fermée
+                pass
+
+    def abandonner(self, serveur: Serveur) -> None:
+        """Rend la place d'une requête abandonnée, sans la compter comme un échec."""
+        with self._libere:
+            serveur.en_cours -= 1
+            self._reveiller()
+
+    def liberer(self, serveur: Serveur, duree: float | None) -> None:
+        """Termine une requête : ``duree`` vaut ``None`` en cas d'échec."""
+        with self._libere:
+            serveur.en_cours -= 1
+            self._reveiller()
+            if duree is None:
+                serveur.echecs_consecutifs += 1
+                if serveur.echecs_consecutifs >= self.seuil_echecs:
+                    serveur.coupe_jusqua = time.time() + self.duree_coupure
+                    print(
+                        f"[DEBUG] {self.nom} {serveur.adresse} écarté "
+                        f"pour {self.duree_coupure:.0f} s après "
+                        f"{serveur.echecs_consecutifs} échecs"
+                    )
+                return
+            serveur.echecs_consecutifs = 0
+            serveur.coupe_jusqua = 0.0
+            if serveur.latence is None:
+                serveur.latence = duree
+            else:
+                serveur.latence += self.lissage * (duree - serveur.latence)
+
+    @contextmanager
+    def utiliser(self, exclure: set[str] | None = None, limite: float | None = None):
+        """Réserve un serveur pour la durée du bloc et renvoie son adresse."""
+        serveur = self.choisir(exclure=exclure, limite=limite)
+        debut = time.time()
+        try:
+            yield serveur.adresse
+        except GeneratorExit:
+            # Générateur refermé par l'appelant (flux abandonné) : pas un échec
+            self.abandonner(serveur)
+            raise
+        except BaseException:
+            self.liberer(serveur, None)
+            raise
+        self.liberer(serveur, time.time() - debut)
+
+    @asynccontextmanager
+    async def utiliser_async(self, exclure: set[str] | None = None, limite: float | None = None):
+        """Équivalent asynchrone de ``utiliser``."""
+        serveur = await self.choisir_async(exclure, limite)
+        debut = time.time()
+        try:
+            yield serveur.adresse
+        except (asyncio.CancelledError, GeneratorExit):
+            # Requête abandonnée par le client (tâche annulée, flux refermé) :
+            # ni échec ni mesure de latence
+            self.abandonner(serveur)
+            raise
+        except BaseException:
+            self.liberer(serveur, None)
+            raise
+        self.liberer(serveur, time.time() - debut)
+
+    def executer(self, fonction: Callable[[str], Any], tentatives: int = 2) -> Any:
+        """Appelle ``fonction(adresse)`` et bascule sur un autre serveur en cas d'erreur.
+
+        Toutes les tentatives partagent la même attente maximale d'une place
+        (``attente_max``).
+        """
+        essayes: set[str] = set()
+        derniere: Exception | None = None
+        limite = time.time() + self.attente_max
+        for _ in range(min(tentatives, len(self.serveurs))):
+            try:
+                with self.utiliser(exclure=essayes, limite=limite) as adresse:
+                    essayes.add(adresse)
+                    return fonction(adresse)
+            except Exception as exc:
+                derniere = exc
+                print(f"[DEBUG] {self.nom} : échec, bascule ({exc})")
+        raise RuntimeError(f"Échec sur les serveurs {self.nom} : {derniere}")
+
+    async def executer_async(
+        self, fonction: Callable[[str], Awaitable[Any]], tentatives: int = 2
+    ) -> Any:
+        """Équivalent asynchrone de ``executer``."""
+        essayes: set[str] = set()
+        derniere: Exception | None = None
+        limite = time.time() + self.attente_max
+        for _ in range(min(tentatives, len(self.serveurs))):
+            try:
+                async with self.utiliser_async(exclure=essayes, limite=limite) as adresse:
+                    essayes.add(adresse)
+                    return await fonction(adresse)
+            except Exception as exc:
+                derniere = exc
+                print(f"[DEBUG] {self.nom} : échec, bascule ({exc})")
+        raise RuntimeError(f"Échec sur les serveurs {self.nom} : {derniere}")
+
+    def etat(self) -> list[dict]:
+        """Photographie de l'état des serveurs (supervision, débogage)."""
+        with self._verrou:
+            return [s.etat() for s in self.serveurs]
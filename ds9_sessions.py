@@ -0,0 +1,121 @@
+"""Sessions de jeu conservées côté serveur.
+
+Le navigateur ne garde qu'un identifiant (cookie) ; la transcription du
+dialogue avec un PNJ et son prompt de base restent sur le serveur. Les
+requêtes du joueur gardent ainsi une taille constante, quelle que soit la
+longueur de la conversation.
+
+Le stockage est interchangeable : tout objet offrant ``lire``, ``ecrire`` et
+``supprimer`` convient (``StockageMemoire`` par défaut, dans le processus).
+"""
+
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+COOKIE = "station72_session"
+# Durée d'inactivité avant expiration d'une session, en secondes
+DUREE = float(os.getenv("SESSIONS_DUREE", "3600"))
+# Plafonds du stockage en mémoire
+MAX_SESSIONS = int(os.getenv("SESSIONS_MAX", "10000"))
+MAX_OCTETS = int(os.getenv("SESSIONS_MAX_MO", "64")) * 1024 * 1024
+
+
+def _taille(valeur) -> int:
+    """Estimation grossière de l'empreinte mémoire d'une session."""
+    if isinstance(valeur, str):
+        return len(valeur)
+    if isinstance(valeur, dict):
+        return sum(_taille(k) + _taille(v) for k, v in valeur.items())
+    if isinstance(valeur, (list, tuple)):
+        return sum(_taille(v) for v in valeur)
+    return 8
+
+
+class StockageMemoire:
+    """Sessions en mémoire, bornées en nombre et en taille.
+
+    Au-delà des plafonds, les sessions les moins récemment utilisées sont
+    oubliées en premier.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, max_octets: int = MAX_OCTETS):
+        self.max_sessions = max_sessions
+        self.max_octets = max_octets
+        self._sessions: OrderedDict[str, tuple[float, int, dict]] = OrderedDict()
+        self._octets = 0
+        self._derniere_purge = time.time()
+        self._verrou = threading.Lock()
+
+    def lire(self, sid: str) -> dict | None:
+        with self._verrou:
+            entree = self._sessions.get(sid)
+            if entree is None:
+                return None
+            if entree[0] < time.time():
+                self._retirer(sid)
+                return None
+            self._sessions.move_to_end(sid)
+            return entree[2]
+
+    def ecrire(self, sid: str, donnees: dict, expire_a: float) -> None:
+        taille = _taille(donnees)
+        if time.time() - self._derniere_purge > 60:
+            self.purger()
+        with self._verrou:
+            self._retirer(sid)
+            self._sessions[sid] = (expire_a, taille, donnees)
+            self._octets += taille
+            while self._sessions and (
+                len(self._sessions) > self.max_sessions or self._octets > self.max_octets
+            ):
+                self._retirer(next(iter(self._sessions)))
+
+    def supprimer(self, sid: str) -> None:
+        with self._verrou:
+            self._retirer(sid)
+
+    def _retirer(self, sid: str) -> None:
+        entree = self._sessions.pop(sid, None)
+        if entree is not None:
+            self._octets -= entree[1]
+
+    def purger(self) -> int:
+        """Supprime les sessions expirées ; renvoie leur nombre."""
+        maintenant = time.time()
+        with self._verrou:
+            self._derniere_purge = maintenant
+            expirees = [sid for sid, e in self._sessions.items() if e[0] < maintenant]
+            for sid in expirees:
+                self._retirer(sid)
+        return len(expirees)
+
+
+class Sessions:
+    """Associe un cookie de session à des données conservées par ``stockage``."""
+
+    def __init__(self, stockage=None, duree: float = DUREE, cookie: str = COOKIE):
+        self.stockage = stockage if stockage is not None else StockageMemoire()
+        self.duree = duree
+        self.cookie = cookie
+
+    def identifiant(self, request) -> str:
+        """Identifiant de session du navigateur, ou un nouvel identifiant."""
+        sid = request.cookies.get(self.cookie)
+        return sid if sid else secrets.token_urlsafe(24)
+
+    def lire(self, sid: str) -> dict:
+        return self.stockage.lire(sid) or {}
+
+    def ecrire(self, sid: str, donnees: dict) -> None:
+        self.stockage.ecrire(sid, donnees, time.time() + self.duree)
+
+    def supprimer(self, sid: str) -> None:
+        self.stockage.supprimer(sid)
+
+    def poser_cookie(self, response, sid: str) -> None:
+        response.set_cookie(
+            self.cookie, sid, max_age=int(self.duree), httponly=True, samesite="lax"
+        )
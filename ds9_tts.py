@@ -1,16 +1,22 @@
 import argparse
+import asyncio
 import requests
 import httpx
 import base64
+import io
 import os
 import platform
 import subprocess
 import re
+import struct
 import sys
+import uuid
+import wave
+from concurrent.futures import ThreadPoolExecutor
 
+from ds9_repartiteur import Repartiteur
+from ds9_voix import registre_voix
 
-xtts_speakers: dict[str, dict] = {}
-xtts_url: str = ""
 
 # Liste des serveurs XTTS disponibles
 SERVEURS = [
@@ -18,191 +24,369 @@ SERVEURS = [
     "http://192.168.12.250:12003",
 ]
 
+# Synthèses simultanées acceptées par chaque serveur XTTS
+XTTS_MAX_SIMULTANES = int(os.getenv("XTTS_MAX_SIMULTANES", "2"))
+# Nombre total de synthèses que l'ensemble des serveurs peut mener de front
+CAPACITE_XTTS = len(SERVEURS) * XTTS_MAX_SIMULTANES
+# Durée maximale d'une synthèse, en secondes : au-delà, le serveur est tenu
+# pour défaillant, sa place est rendue et la requête bascule sur un autre
+XTTS_TIMEOUT = float(os.getenv("XTTS_TIMEOUT", "60"))
+XTTS_TIMEOUT_CONNEXION = float(os.getenv("XTTS_TIMEOUT_CONNEXION", "5"))
+
 
 FICHIER_OUT = "output.wav"
 
-# URL du serveur XTTS à utiliser. Il sera défini dans `main()`.
+# Les corps ``/tts`` sont envoyés déjà encodés (voir ``RegistreVoix.charge_utile``)
+ENTETES_JSON = {"Content-Type": "application/json"}
+
+# URL du serveur XTTS utilisée par les fonctions de démonstration. Elle sera
+# définie dans `main()` ; la synthèse passe, elle, par `repartiteur_xtts`.
 SERVER_URL = ""
 
+
+def _sonde_xtts(url: str) -> bool:
+    """Vérifie qu'un serveur XTTS répond sur ``/languages``."""
+    return requests.get(f"{url}/languages", timeout=2).status_code == 200
+
+
+# Les serveurs XTTS servent en parallèle, chacun dans la limite de ses places
+repartiteur_xtts = Repartiteur(
+    "XTTS",
+    SERVEURS,
+    _sonde_xtts,
+    intervalle=float(os.getenv("XTTS_INTERVALLE_SONDE", "15")),
+    max_simultanes=XTTS_MAX_SIMULTANES,
+    attente_max=float(os.getenv("XTTS_ATTENTE_MAX", "60")),
+)
+
+
 def choisir_serveur_disponible():
-    for url in SERVEURS:
-        try:
-            print(f"🔍 Test de : {url}/languages ...", end="")
-            response = requests.get(f"{url}/languages", timeout=2)
-            if response.status_code == 200:
-                print("✅ Serveur OK")
-                return url
-            else:
-                print(f"❌ Erreur HTTP {response.status_code}")
-        except Exception as e:
-            print(f"❌ Injoignable ({e})")
-    raise RuntimeError("Aucun serveur XTTS disponible !")
+    """Sonde les serveurs XTTS et renvoie le moins chargé des serveurs sains."""
+    repartiteur_xtts.sonder()
+    for etat in repartiteur_xtts.etat():
+        print(f"🔍 {etat['adresse']} : {'✅ Serveur OK' if etat['sain'] else '❌ Injoignable'}")
+    try:
+        return repartiteur_xtts.choisir(reserver=False).adresse
+    except RuntimeError:
+        raise RuntimeError("Aucun serveur XTTS disponible !")
 
 def slugify(nom):
     # Nettoyage du nom de fichier
     return re.sub(r'[^a-zA-Z0-9_]', '_', nom)
 
 
-def genere_audio(texte: str, voix: str = None):
-    global xtts_speakers, xtts_url
+def _choisir_voix(speakers: dict, voix: str | None) -> str:
+    """Retourne ``voix`` si elle existe, sinon une voix française par défaut."""
+    if voix and voix in speakers:
+        return voix
 
-    # Récupération et mise en cache des voix disponibles
-    if not xtts_speakers or xtts_url != SERVER_URL:
-        try:
-            response = requests.get(f"{SERVER_URL}/studio_speakers")
-            response.raise_for_status()
-            xtts_speakers = response.json()
-            xtts_url = SERVER_URL
-        except Exception as e:
-            print(f"Erreur lors de la récupération des voix : {e}")
-            exit(1)
+    # Sélection par défaut si voix invalide ou non fournie
+    for name in speakers.keys():
+        lower_name = name.lower()
+        if "female" in lower_name and "fr" in lower_name:
+            return name
 
-    speakers = xtts_speakers
-    if not speakers:
-        print("Aucune voix n’est disponible sur le serveur.")
-        exit(1)
+    for name in speakers.keys():
+        if "fr" in name.lower():
+            return name
 
-    # Choix de la voix
-    selected_speaker_name = None
+    return list(speakers.keys())[0]
 
-    if voix and voix in speakers:
-        selected_speaker_name = voix
-    else:
-        # Sélection par défaut si voix invalide ou non fournie
-        for name in speakers.keys():
-            lower_name = name.lower()
-            if "female" in lower_name and "fr" in lower_name:
-                selected_speaker_name = name
-                break
-
-        if selected_speaker_name is None:
-            for name in speakers.keys():
-                if "fr" in name.lower():
-                    selected_speaker_name = name
-                    break
-
-        if selected_speaker_name is None:
-            selected_speaker_name = list(speakers.keys())[0]
 
+def _lire_audio(tts_response) -> bytes:
+    """Extrait le WAV d'une réponse ``/tts`` (binaire ou base64 dans du JSON)."""
+    content_type = tts_response.headers.get("Content-Type", "")
+    if "application/json" not in content_type:
+        return tts_response.content
+    try:
+        base64_str = tts_response.json()
+    except ValueError:
+        base64_str = tts_response.text
+    base64_str = base64_str.strip().strip('"')
+    try:
+        return base64.b64decode(base64_str)
+    except Exception as decode_err:
+        raise RuntimeError(f"Échec du décodage base64 de l'audio : {decode_err}")
+
+
+def _synthetise_sur(url: str, texte: str, voix: str = None, langue: str = "fr") -> bytes:
+    """Synthétise ``texte`` sur le serveur XTTS ``url``."""
+    speakers = registre_voix.voix(url)
+    selected_speaker_name = _choisir_voix(speakers, voix)
     print(f"Voix sélectionnée : {selected_speaker_name}")
 
-    voice_params = speakers[selected_speaker_name]
-    speaker_embedding = voice_params["speaker_embedding"]
-    gpt_cond_latent = voice_params["gpt_cond_latent"]
+    payload = registre_voix.charge_utile(url, selected_speaker_name, texte, langue)
+
+    try:
+        tts_response = requests.post(
+            f"{url}/tts",
+            data=payload,
+            headers=ENTETES_JSON,
+            timeout=(XTTS_TIMEOUT_CONNEXION, XTTS_TIMEOUT),
+        )
+        tts_response.raise_for_status()
+    except Exception as e:
+        raise RuntimeError(f"Erreur lors de la requête TTS : {e}")
+
+    return _lire_audio(tts_response)
+
+
+def synthetise_octets(texte: str, voix: str = None, langue: str = "fr") -> bytes:
+    """Synthétise ``texte`` et renvoie le WAV produit par XTTS.
+
+    La requête part vers le serveur le moins occupé et bascule sur un autre
+    serveur en cas d'échec. Lève ``RuntimeError`` si aucun n'y parvient.
+    """
+    return repartiteur_xtts.executer(
+        lambda url: _synthetise_sur(url, texte, voix, langue)
+    )
+
+
+# Client asynchrone partagé par les synthèses, un par boucle d'événements :
+# les connexions vers les serveurs XTTS restent ouvertes
+_clients_async: dict[int, httpx.AsyncClient] = {}
 
-    payload = {
-        "text": texte,
-        "language": "fr",
-        "speaker_embedding": speaker_embedding,
-        "gpt_cond_latent": gpt_cond_latent
-    }
 
- #   print(payload["text"] or "a")
- #   print(payload["gpt_cond_latent"] or "b")
+def _client_async() -> httpx.AsyncClient:
+    boucle = id(asyncio.get_running_loop())
+    client = _clients_async.get(boucle)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(XTTS_TIMEOUT, connect=XTTS_TIMEOUT_CONNEXION)
+        )
+        _clients_async[boucle] = client
+    return client
+
+
+async def fermer_client_async() -> None:
+    """Ferme le client XTTS asynchrone de la boucle courante."""
+    client = _clients_async.pop(id(asyncio.get_running_loop()), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def _synthetise_sur_async(
+    url: str, texte: str, voix: str | None = None, langue: str = "fr"
+) -> bytes:
+    """Version asynchrone de ``_synthetise_sur``."""
+    speakers = await registre_voix.voix_async(url)
+    selected_speaker_name = _choisir_voix(speakers, voix)
+    print(f"Voix sélectionnée : {selected_speaker_name}")
+
+    payload = registre_voix.charge_utile(url, selected_speaker_name, texte, langue)
 
     try:
-        tts_response = requests.post(f"{SERVER_URL}/tts", json=payload)
+        tts_response = await _client_async().post(
+            f"{url}/tts", content=payload, headers=ENTETES_JSON
+        )
         tts_response.raise_for_status()
     except Exception as e:
-        print(f"Erreur lors de la requête TTS : {e}")
-        exit(1)
+        raise RuntimeError(f"Erreur lors de la requête TTS : {e}")
+
+    return _lire_audio(tts_response)
 
-    audio_bytes = b""
-    content_type = tts_response.headers.get("Content-Type", "")
-    if "application/json" in content_type:
-        try:
-            base64_str = tts_response.json()
-        except ValueError:
-            base64_str = tts_response.text
-        base64_str = base64_str.strip().strip('"')
-        try:
-            audio_bytes = base64.b64decode(base64_str)
-        except Exception as decode_err:
-            print(f"Échec du décodage base64 de l'audio : {decode_err}")
-            exit(1)
-    else:
-        audio_bytes = tts_response.content
 
+async def synthetise_octets_async(
+    texte: str, voix: str | None = None, langue: str = "fr"
+) -> bytes:
+    """Version asynchrone de ``synthetise_octets``."""
+    return await repartiteur_xtts.executer_async(
+        lambda url: _synthetise_sur_async(url, texte, voix, langue)
+    )
+
+
+def _ecrire_atomique(chemin: str, octets: bytes) -> None:
+    """Écrit ``octets`` dans ``chemin`` via un fichier temporaire propre à l'appel."""
+    dossier = os.path.dirname(chemin)
+    if dossier:
+        os.makedirs(dossier, exist_ok=True)
+    tmp = f"{chemin}.{uuid.uuid4().hex}.tmp"
     try:
-        with open(FICHIER_OUT, "wb") as f:
-            f.write(audio_bytes)
-        print(f"Fichier audio sauvegardé : {FICHIER_OUT}")
-    except Exception as file_err:
-        print(f"Erreur lors de l'enregistrement du fichier audio : {file_err}")
+        with open(tmp, "wb") as f:
+            f.write(octets)
+        os.replace(tmp, chemin)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
 
 
-async def genere_audio_async(texte: str, voix: str | None = None) -> None:
-    """Version asynchrone de ``genere_audio`` utilisant ``httpx.AsyncClient``."""
+def synthetise_vers(chemin: str, texte: str, voix: str = None, langue: str = "fr") -> bool:
+    """Synthétise ``texte`` dans le fichier ``chemin``.
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(f"{SERVER_URL}/studio_speakers")
-            response.raise_for_status()
-        except Exception as e:
-            print(f"Erreur lors de la récupération des voix : {e}")
-            return
+    Ne dépend d'aucune variable globale : plusieurs threads peuvent l'appeler
+    en même temps sur des chemins différents. Renvoie ``False`` en cas d'échec.
+    """
+    try:
+        _ecrire_atomique(chemin, synthetise_octets(texte, voix, langue))
+        return True
+    except Exception as e:
+        print(f"❌ Synthèse impossible vers {chemin} : {e}")
+        return False
 
-        speakers = response.json()
-        if not speakers:
-            print("Aucune voix n’est disponible sur le serveur.")
-            return
 
-        selected_speaker_name = None
-        if voix and voix in speakers:
-            selected_speaker_name = voix
-        else:
-            for name in speakers.keys():
-                lower_name = name.lower()
-                if "female" in lower_name and "fr" in lower_name:
-                    selected_speaker_name = name
-                    break
-            if selected_speaker_name is None:
-                for name in speakers.keys():
-                    if "fr" in name.lower():
-                        selected_speaker_name = name
-                        break
-            if selected_speaker_name is None:
-                selected_speaker_name = list(speakers.keys())[0]
-
-        print(f"Voix sélectionnée : {selected_speaker_name}")
-
-        voice_params = speakers[selected_speaker_name]
-        payload = {
-            "text": texte,
-            "language": "fr",
-            "speaker_embedding": voice_params["speaker_embedding"],
-            "gpt_cond_latent": voice_params["gpt_cond_latent"],
-        }
+async def synthetise_vers_async(
+    chemin: str, texte: str, voix: str | None = None, langue: str = "fr"
+) -> bool:
+    """Version asynchrone de ``synthetise_vers``."""
+    try:
+        octets = await synthetise_octets_async(texte, voix, langue)
+        _ecrire_atomique(chemin, octets)
+        return True
+    except Exception as e:
+        print(f"❌ Synthèse impossible vers {chemin} : {e}")
+        return False
+
+
+def synthetise_lot(
+    demandes: list[tuple[str, str | None]],
+    langue: str = "fr",
+    max_simultanes: int = CAPACITE_XTTS,
+) -> list[bytes | None]:
+    """Synthétise une liste de couples (texte, voix) en parallèle.
 
+    Au plus ``max_simultanes`` synthèses tournent en même temps. Le résultat
+    suit l'ordre des demandes ; ``None`` marque une synthèse échouée.
+    """
+
+    def _une(demande: tuple[str, str | None]) -> bytes | None:
+        texte, voix = demande
         try:
-            tts_response = await client.post(f"{SERVER_URL}/tts", json=payload)
-            tts_response.raise_for_status()
+            return synthetise_octets(texte, voix, langue)
         except Exception as e:
-            print(f"Erreur lors de la requête TTS : {e}")
-            return
+            print(f"❌ Synthèse impossible : {e}")
+            return None
 
-        audio_bytes = b""
-        content_type = tts_response.headers.get("Content-Type", "")
-        if "application/json" in content_type:
-            try:
-                base64_str = tts_response.json()
-            except ValueError:
-                base64_str = tts_response.text
-            base64_str = base64_str.strip().strip('"')
+    with ThreadPoolExecutor(max_workers=max(1, max_simultanes)) as executeur:
+        return list(executeur.map(_une, demandes))
+
+
+async def synthetise_lot_async(
+    demandes: list[tuple[str, str | None]],
+    langue: str = "fr",
+    max_simultanes: int = CAPACITE_XTTS,
+) -> list[bytes | None]:
+    """Version asynchrone de ``synthetise_lot``."""
+    semaphore = asyncio.Semaphore(max(1, max_simultanes))
+
+    async def _une(texte: str, voix: str | None) -> bytes | None:
+        async with semaphore:
             try:
-                audio_bytes = base64.b64decode(base64_str)
-            except Exception as decode_err:
-                print(f"Échec du décodage base64 de l'audio : {decode_err}")
-                return
+                return await synthetise_octets_async(texte, voix, langue)
+            except Exception as e:
+                print(f"❌ Synthèse impossible : {e}")
+                return None
+
+    return await asyncio.gather(*(_une(texte, voix) for texte, voix in demandes))
+
+
+def genere_audio(
+    texte: str, voix: str = None, langue: str = "fr", fichier_out: str | None = None
+):
+    """Synthétise ``texte`` dans ``fichier_out`` (``FICHIER_OUT`` par défaut).
+
+    Réservée aux démonstrations en ligne de commande : quitte le programme en
+    cas d'échec. Les applications utilisent ``synthetise_vers``.
+    """
+    fichier_out = fichier_out or FICHIER_OUT
+    try:
+        audio_bytes = synthetise_octets(texte, voix, langue)
+    except RuntimeError as e:
+        print(e)
+        exit(1)
+
+    try:
+        with open(fichier_out, "wb") as f:
+            f.write(audio_bytes)
+        print(f"Fichier audio sauvegardé : {fichier_out}")
+    except Exception as file_err:
+        print(f"Erreur lors de l'enregistrement du fichier audio : {file_err}")
+
+
+def decouper_phrases(texte: str, longueur_min: int = 40) -> list[str]:
+    """Découpe ``texte`` en morceaux d'une ou plusieurs phrases.
+
+    Les phrases trop courtes sont regroupées avec la suivante pour éviter une
+    requête XTTS par interjection ; la première reste courte afin que le son
+    démarre au plus vite.
+    """
+    phrases = [p.strip() for p in re.split(r"(?<=[.!?…])\s+", texte) if p.strip()]
+    morceaux: list[str] = []
+    courant = ""
+    for phrase in phrases:
+        courant = f"{courant} {phrase}".strip()
+        if len(courant) >= longueur_min or not morceaux:
+            morceaux.append(courant)
+            courant = ""
+    if courant:
+        if morceaux:
+            morceaux[-1] = f"{morceaux[-1]} {courant}"
         else:
-            audio_bytes = tts_response.content
+            morceaux.append(courant)
+    return morceaux
+
+
+def entete_wav(nb_canaux: int, largeur: int, frequence: int, taille_donnees: int) -> bytes:
+    """Construit l'en-tête RIFF d'un WAV PCM.
+
+    Pour un flux dont la longueur est inconnue, ``taille_donnees`` vaut
+    ``0xFFFFFFFF - 36`` : les navigateurs lisent alors jusqu'à la fin du flux.
+    """
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        36 + taille_donnees,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,
+        nb_canaux,
+        frequence,
+        frequence * nb_canaux * largeur,
+        nb_canaux * largeur,
+        largeur * 8,
+        b"data",
+        taille_donnees,
+    )
 
+
+def flux_audio(texte: str, voix: str = None, langue: str = "fr", echecs: list | None = None):
+    """Générateur produisant un WAV unique phrase par phrase.
+
+    L'en-tête et le premier morceau sont émis dès que XTTS a rendu la première
+    phrase ; les suivantes sont synthétisées pendant la lecture. Une phrase
+    dont la synthèse échoue est sautée (et ajoutée à ``echecs``) : la réponse
+    HTTP déjà commencée n'est jamais coupée au milieu.
+    """
+    en_tete_envoye = False
+    for morceau in decouper_phrases(texte):
         try:
-            with open(FICHIER_OUT, "wb") as f:
-                f.write(audio_bytes)
-            print(f"Fichier audio sauvegardé : {FICHIER_OUT}")
-        except Exception as file_err:
-            print(f"Erreur lors de l'enregistrement du fichier audio : {file_err}")
+            octets = synthetise_octets(morceau, voix, langue)
+            w = wave.open(io.BytesIO(octets))
+        except (RuntimeError, wave.Error, EOFError) as exc:
+            print(f"[DEBUG] Flux audio : phrase sautée ({exc})")
+            if echecs is not None:
+                echecs.append(morceau)
+            continue
+        with w:
+            if not en_tete_envoye:
+                yield entete_wav(
+                    w.getnchannels(), w.getsampwidth(), w.getframerate(), 0xFFFFFFFF - 36
+                )
+                en_tete_envoye = True
+            yield w.readframes(w.getnframes())
+
+
+async def genere_audio_async(
+    texte: str,
+    voix: str | None = None,
+    langue: str = "fr",
+    fichier_out: str | None = None,
+) -> None:
+    """Version asynchrone de ``genere_audio``, sans sortie du programme en cas d'échec."""
+
+    if await synthetise_vers_async(fichier_out or FICHIER_OUT, texte, voix, langue):
+        print(f"Fichier audio sauvegardé : {fichier_out or FICHIER_OUT}")
 
 def lire_audio(fichier_audio: str):
     os.startfile(fichier_audio)
@@ -221,25 +405,17 @@ def liste_voix():
 
 def generer_messages_voix(langue="fr"):
     try:
-        response = requests.get(f"{SERVER_URL}/studio_speakers")
-        response.raise_for_status()
-        speakers = response.json()
-    except Exception as e:
+        speakers = registre_voix.voix(SERVER_URL)
+    except RuntimeError as e:
         print(f"Erreur récupération voix : {e}")
         return
 
-    for nom_voix, params in speakers.items():
+    for nom_voix in speakers:
         texte = f"Je suis {nom_voix}, et ceci est un petit message."
-
-        payload = {
-            "text": texte,
-            "language": langue,
-            "speaker_embedding": params["speaker_embedding"],
-            "gpt_cond_latent": params["gpt_cond_latent"]
-        }
+        payload = registre_voix.charge_utile(SERVER_URL, nom_voix, texte, langue)
 
         try:
-            rep = requests.post(f"{SERVER_URL}/tts", json=payload)
+            rep = requests.post(f"{SERVER_URL}/tts", data=payload, headers=ENTETES_JSON)
             rep.raise_for_status()
         except Exception as e:
             print(f"❌ Erreur pour la voix {nom_voix} : {e}")
@@ -275,10 +451,8 @@ def generer_messages_voix(langue="fr"):
 def lister_voix_et_generer_exemples(langue: str = "fr"):
     """Affiche la liste des voix disponibles et génère un exemple .wav pour chacune."""
     try:
-        response = requests.get(f"{SERVER_URL}/studio_speakers")
-        response.raise_for_status()
-        speakers = response.json()
-    except Exception as e:
+        speakers = registre_voix.voix(SERVER_URL)
+    except RuntimeError as e:
         print(f"Erreur récupération voix : {e}")
         return
 
@@ -287,18 +461,12 @@ def lister_voix_et_generer_exemples(langue: str = "fr"):
     #    print(f" - {nom}")
 
     print("\nGénération des exemples :")
-    for nom_voix, params in speakers.items():
+    for nom_voix in speakers:
         texte = f"Je suis {nom_voix}, ceci est une démonstration."
-
-        payload = {
-            "text": texte,
-            "language": langue,
-            "speaker_embedding": params["speaker_embedding"],
-            "gpt_cond_latent": params["gpt_cond_latent"],
-        }
+        payload = registre_voix.charge_utile(SERVER_URL, nom_voix, texte, langue)
 
         try:
-            rep = requests.post(f"{SERVER_URL}/tts", json=payload)
+            rep = requests.post(f"{SERVER_URL}/tts", data=payload, headers=ENTETES_JSON)
             rep.raise_for_status()
         except Exception as e:
             print(f"❌ Erreur pour la voix {nom_voix} : {e}")
@@ -356,64 +524,20 @@ def main():
     # Génération d'un exemple audio pour chaque voix
     lister_voix_et_generer_exemples()
 
-def ds9_parle(voix: str, texte: str, dossier: str, nom_out: str) -> bool:
-    global SERVER_URL, FICHIER_OUT
-
-    try:
-        # Prépare le chemin complet
-        chemin_out = os.path.join(dossier, nom_out)
-
-        # Supprime le fichier s’il existe déjà
-        if os.path.exists(chemin_out):
-            os.remove(chemin_out)
-
-        # Crée le dossier s’il n’existe pas
-        os.makedirs(dossier, exist_ok=True)
-
-        # Sélection du serveur (si pas déjà fait)
-        if not SERVER_URL:
-            SERVER_URL = choisir_serveur_disponible()
-        print(f"🔈 Serveur XTTS sélectionné dans ds9_parle : {SERVER_URL}")
+def ds9_parle(
+    voix: str, texte: str, dossier: str, nom_out: str, langue: str = "fr"
+) -> bool:
+    """Synthétise ``texte`` dans ``dossier/nom_out`` ; sûr en appels concurrents."""
+    return synthetise_vers(os.path.join(dossier, nom_out), texte, voix, langue)
 
-        # Spécifie le fichier de sortie global
-        FICHIER_OUT = chemin_out
 
-        # Génération audio
-        genere_audio(texte, voix)
-
-        # Vérifie la création du fichier
-        return os.path.exists(chemin_out)
-
-    except Exception as e:
-        print(f"❌ Erreur dans ds9_parle : {e}")
-        return False
-
-
-async def ds9_parle_async(voix: str, texte: str, dossier: str, nom_out: str) -> bool:
+async def ds9_parle_async(
+    voix: str, texte: str, dossier: str, nom_out: str, langue: str = "fr"
+) -> bool:
     """Version asynchrone de ``ds9_parle``."""
-
-    global SERVER_URL, FICHIER_OUT
-
-    try:
-        chemin_out = os.path.join(dossier, nom_out)
-        if os.path.exists(chemin_out):
-            os.remove(chemin_out)
-
-        os.makedirs(dossier, exist_ok=True)
-
-        if not SERVER_URL:
-            SERVER_URL = choisir_serveur_disponible()
-        print(f"🔈 Serveur XTTS sélectionné dans ds9_parle_async : {SERVER_URL}")
-
-        FICHIER_OUT = chemin_out
-
-        await genere_audio_async(texte, voix)
-
-        return os.path.exists(chemin_out)
-
-    except Exception as e:
-        print(f"❌ Erreur dans ds9_parle_async : {e}")
-        return False
+    return await synthetise_vers_async(
+        os.path.join(dossier, nom_out), texte, voix, langue
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,218 @@
+"""Registre des voix (``/studio_speakers``) des serveurs XTTS.
+
+Le dictionnaire des voix contient, pour chacune, son ``speaker_embedding`` et
+son ``gpt_cond_latent`` : il pèse plusieurs mégaoctets. Il est téléchargé une
+fois par serveur, conservé en mémoire et photographié sur disque pour survivre
+aux redémarrages. Un fil de fond le rafraîchit périodiquement ; le choix d'une
+voix pendant une synthèse n'est donc qu'une lecture de dictionnaire.
+
+Pour chaque voix, la partie latente de la requête ``/tts`` est sérialisée une
+seule fois ; seul le texte est encodé à chaque synthèse.
+"""
+
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+import requests
+
+try:
+    import orjson
+
+    def _json(valeur) -> bytes:
+        return orjson.dumps(valeur)
+
+except ImportError:
+
+    def _json(valeur) -> bytes:
+        return json.dumps(valeur, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+DOSSIER_VOIX = os.getenv("XTTS_VOIX_DOSSIER", os.path.join("cache", "xtts_voix"))
+INTERVALLE_RAFRAICHISSEMENT = float(os.getenv("XTTS_VOIX_RAFRAICHISSEMENT", "3600"))
+
+
+class RegistreVoix:
+    """Voix disponibles par URL de serveur XTTS, partagées par tous les appels."""
+
+    def __init__(
+        self,
+        dossier: str = DOSSIER_VOIX,
+        intervalle: float = INTERVALLE_RAFRAICHISSEMENT,
+        timeout: float = 30.0,
+    ):
+        self.dossier = dossier
+        self.intervalle = intervalle
+        self.timeout = timeout
+        self._voix: dict[str, dict[str, dict]] = {}
+        # Date du dernier téléchargement réussi ; 0 pour un instantané disque
+        self._maj: dict[str, float] = {}
+        # Partie latente pré-encodée des requêtes, par serveur puis par voix,
+        # accompagnée du dictionnaire de voix dont elle a été tirée
+        self._gabarits: dict[str, tuple[dict[str, dict], dict[str, bytes]]] = {}
+        self._verrous: dict[str, threading.Lock] = {}
+        self._verrou = threading.Lock()
+        self._fil: threading.Thread | None = None
+        self._arret = threading.Event()
+        self._reveil = threading.Event()
+
+    # --- Instantanés disque ------------------------------------------------
+
+    def _chemin(self, url: str) -> str:
+        nom = re.sub(r"[^a-zA-Z0-9]+", "_", url).strip("_")
+        return os.path.join(self.dossier, f"{nom}.json")
+
+    def _lire_instantane(self, url: str) -> dict[str, dict] | None:
+        try:
+            with open(self._chemin(url), encoding="utf-8") as f:
+                return json.load(f) or None
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"[DEBUG] Instantané des voix {url} illisible : {e}")
+            return None
+
+    def _ecrire_instantane(self, url: str, speakers: dict[str, dict]) -> None:
+        chemin = self._chemin(url)
+        os.makedirs(self.dossier, exist_ok=True)
+        tmp = f"{chemin}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(speakers, f)
+            os.replace(tmp, chemin)
+        except OSError as e:
+            print(f"[DEBUG] Instantané des voix {url} non enregistré : {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    # --- Téléchargement et rafraîchissement --------------------------------
+
+    def _telecharger(self, url: str) -> dict[str, dict]:
+        response = requests.get(f"{url}/studio_speakers", timeout=self.timeout)
+        response.raise_for_status()
+        speakers = response.json()
+        if not speakers:
+            raise RuntimeError("Aucune voix n’est disponible sur le serveur.")
+        self._voix[url] = speakers
+        self._maj[url] = time.time()
+        self._ecrire_instantane(url, speakers)
+        return speakers
+
+    def rafraichir(self, url: str) -> bool:
+        """Recharge les voix de ``url`` ; garde les anciennes en cas d'échec."""
+        try:
+            self._telecharger(url)
+            return True
+        except Exception as e:
+            print(f"[DEBUG] Rafraîchissement des voix {url} impossible : {e}")
+            return False
+
+    def demarrer(self) -> None:
+        """Lance le fil de rafraîchissement s'il ne tourne pas déjà."""
+        with self._verrou:
+            if self._fil and self._fil.is_alive():
+                return
+            self._arret.clear()
+            self._fil = threading.Thread(
+                target=self._boucle, name="rafraichissement-voix", daemon=True
+            )
+            self._fil.start()
+
+    def arreter(self) -> None:
+        self._arret.set()
+        self._reveil.set()
+
+    def _boucle(self) -> None:
+        while not self._arret.is_set():
+            for url in list(self._voix):
+                if time.time() - self._maj.get(url, 0) >= self.intervalle:
+                    self.rafraichir(url)
+            self._reveil.wait(self.intervalle)
+            self._reveil.clear()
+
+    # --- Consultation ------------------------------------------------------
+
+    def _verrou_pour(self, url: str) -> threading.Lock:
+        with self._verrou:
+            return self._verrous.setdefault(url, threading.Lock())
+
+    def voix(self, url: str) -> dict[str, dict]:
+        """Retourne les voix du serveur ``url``.
+
+        Sans voix en mémoire, l'instantané disque est utilisé (et rafraîchi en
+        arrière-plan) ; à défaut, les voix sont téléchargées. Lève
+        ``RuntimeError`` si elles restent introuvables.
+        """
+        speakers = self._voix.get(url)
+        if speakers:
+            return speakers
+        with self._verrou_pour(url):
+            speakers = self._voix.get(url)
+            if speakers:
+                return speakers
+            self.demarrer()
+            speakers = self._lire_instantane(url)
+            if speakers:
+                self._voix[url] = speakers
+                self._maj[url] = 0.0
+                self._reveil.set()
+                return speakers
+            try:
+                return self._telecharger(url)
+            except Exception as e:
+                raise RuntimeError(f"Erreur lors de la récupération des voix : {e}")
+
+    async def voix_async(self, url: str) -> dict[str, dict]:
+        """Version asynchrone de ``voix`` : un éventuel chargement se fait hors de la boucle."""
+        speakers = self._voix.get(url)
+        if speakers:
+            return speakers
+        return await asyncio.to_thread(self.voix, url)
+
+    def _gabarit(self, url: str, nom_voix: str) -> bytes:
+        # Les gabarits sont rattachés au dictionnaire de voix qui les a produits :
+        # après un rafraîchissement, ceux des anciens latents ne sont plus servis
+        speakers = self.voix(url)
+        source, gabarits = self._gabarits.get(url, (None, {}))
+        if source is not speakers:
+            gabarits = {}
+            self._gabarits[url] = (speakers, gabarits)
+        gabarit = gabarits.get(nom_voix)
+        if gabarit is None:
+            params = speakers[nom_voix]
+            latents = {
+                "speaker_embedding": params["speaker_embedding"],
+                "gpt_cond_latent": params["gpt_cond_latent"],
+            }
+            # « {"speaker_embedding":...} » devient « ,"speaker_embedding":...} »
+            gabarit = gabarits[nom_voix] = b"," + _json(latents)[1:]
+        return gabarit
+
+    def charge_utile(self, url: str, nom_voix: str, texte: str, langue: str = "fr") -> bytes:
+        """Corps JSON de la requête ``/tts`` pour la voix ``nom_voix`` de ``url``.
+
+        Les latents de la voix sont encodés au premier appel puis réutilisés :
+        seuls ``texte`` et ``langue`` sont sérialisés à chaque synthèse.
+        """
+        return (
+            b'{"text":' + _json(texte) + b',"language":' + _json(langue)
+            + self._gabarit(url, nom_voix)
+        )
+
+    def etat(self) -> list[dict]:
+        """Serveurs connus, nombre de voix et âge de la dernière mise à jour."""
+        maintenant = time.time()
+        return [
+            {
+                "adresse": url,
+                "voix": len(speakers),
+                "age": round(maintenant - self._maj[url]) if self._maj.get(url) else None,
+            }
+            for url, speakers in list(self._voix.items())
+        ]
+
+
+registre_voix = RegistreVoix()
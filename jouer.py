@@ -1,14 +1,57 @@
 from fastapi import FastAPI, Request, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, HTMLResponse, Response, StreamingResponse
 from psycopg2.extras import RealDictCursor
-from psycopg2.pool import SimpleConnectionPool
-from contextlib import contextmanager
 from dotenv import load_dotenv
-from ds9_ia import DS9_IA
-from ds9_tts import ds9_parle
-import threading
-from datetime import datetime
+from ds9_ia import DS9_IA, embed, embed_async, registre_clients
+from ds9_cache_tts import (
+    VOIX_DEFAUT,
+    audio_en_cache,
+    audio_en_cache_async,
+    chercher_audio,
+    est_dans_cache,
+    fermer_transcodage,
+    flux_en_cache,
+    sources_audio,
+    toucher_audio,
+    transcodage_termine,
+    url_audio,
+)
+from ds9_tts import decouper_phrases, fermer_client_async as fermer_client_xtts
+from ds9_contenu import compiler_page, contenu_page
+from ds9_intentions import (
+    MODE as MODE_INTENTIONS,
+    MatcheurPage,
+    matcheurs,
+    resoudre,
+    resoudre_async,
+)
+from ds9_assets import (
+    StaticEmpreintes,
+    activer_assets,
+    construire_si_absent,
+    manifeste,
+)
+from ds9_cache_pages import CachePages, PageRendue, activer_cache_jinja, etag_correspond
+from ds9_instantane import Ecouteur, Instantane, RegistreInstantanes
+from ds9_migrations import verifier_schema
+from ds9_pool import pool_base
+from ds9_sessions import Sessions
+from ds9_dialogue import (
+    a_compacter,
+    ajouter_tour,
+    appliquer_resume,
+    budget_jeu,
+    compacter,
+    construire_prompt,
+    nouveau_dialogue,
+)
+import asyncio
+import json
+import psycopg2
+import secrets
+import time
 import re
 import unicodedata
 import os
@@ -19,8 +62,15 @@ from pydantic import BaseModel
 load_dotenv()
 
 app = FastAPI()
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", StaticEmpreintes(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
+activer_cache_jinja(templates)
+activer_assets(templates)
+templates.env.globals["sources_audio"] = sources_audio
+
+if MODE_INTENTIONS == "vecteurs":
+    # Les intentions sont vectorisées à la compilation du matcheur de page
+    matcheurs.vectoriseur = embed
 
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
@@ -59,26 +109,26 @@ def slugify(text: str) -> str:
     return text.strip("-")
 
 
-pool: SimpleConnectionPool | None = None
-
 # IA Mistral utilisee en secours
 ia_mistral = DS9_IA("MISTRAL", "mistral-large-latest")
 
 # --- Paramètres synthèse vocale -------------------------------------------------
 
 
-def _supprimer_apres_delai(fichier: str, delai: int = 60) -> None:
-    """Planifie la suppression du ``fichier`` après ``delai`` secondes."""
+# Flux audio en attente de lecture, rangés dans le stockage des sessions sous
+# « flux:<jeton> » : un stockage partagé les rend lisibles par tous les
+# processus de jeu
+PREFIXE_FLUX = "flux:"
+DUREE_FLUX = 300
 
-    def _remove() -> None:
-        try:
-            os.remove(fichier)
-        except FileNotFoundError:
-            pass
 
-    timer = threading.Timer(delai, _remove)
-    timer.daemon = True
-    timer.start()
+def url_flux(voix: str, texte: str) -> str:
+    """Enregistre un texte à diffuser et renvoie l'URL de son flux audio."""
+    jeton = secrets.token_urlsafe(16)
+    sessions.stockage.ecrire(
+        PREFIXE_FLUX + jeton, {"voix": voix, "texte": texte}, time.time() + DUREE_FLUX
+    )
+    return f"/tts/flux/{jeton}"
 
 
 def audio_for_message(
@@ -87,52 +137,55 @@ def audio_for_message(
     page_ordre: int,
     voix: str | None = None,
     voix_active: bool = True,
+    flux: bool = False,
 ) -> str | None:
-    """Génère un fichier audio en utilisant ds9_parle si ``voix_active``."""
+    """Retourne l'URL de l'audio du ``message`` si ``voix_active``.
+
+    Le fichier provient du cache TTS partagé : il n'est synthétisé qu'à la
+    première demande d'un couple (voix, texte). Avec ``flux``, un message de
+    plusieurs phrases absent du cache n'est pas synthétisé ici : l'URL renvoyée
+    pointe vers ``/tts/flux`` qui diffuse l'audio phrase par phrase.
+    ``slug`` et ``page_ordre`` sont conservés pour compatibilité avec les
+    appelants existants.
+    """
 
     if not message or not voix_active:
         return None
 
-    dossier = os.path.join("static", "jeux", slug, "wav")
-    horo = datetime.now().strftime("%Y%m%d_%H%M%S")
-    nom = f"{slug}_page{page_ordre}_{horo}.wav"
-    ok = ds9_parle(
-        voix=voix or "Henriette Usha", texte=message, dossier=dossier, nom_out=nom
-    )
-    if ok:
-        chemin = os.path.join(dossier, nom)
-        _supprimer_apres_delai(chemin)
-        return "/" + chemin.replace(os.sep, "/")
-    return None
-
-
-def extraire_tts(contenu: str) -> tuple[str, str | None, str | None]:
-    """Extrait un marqueur ``<!--tts:...-->`` et renvoie texte et voix.
+    voix = voix or VOIX_DEFAUT
+    if flux and len(decouper_phrases(message)) > 1:
+        chemin = chercher_audio(voix, message)
+        return url_audio(chemin) if chemin else url_flux(voix, message)
 
-    Exemple : ``<!--tts:<voice>Damien</voice><texte>Bonjour</texte>-->``
-    """
-
-    motif = re.compile(r"<!--\s*tts:(.*?)-->", re.DOTALL)
-    match = motif.search(contenu)
-    if not match:
-        return contenu, None, None
+    chemin = audio_en_cache(voix, message)
+    if chemin:
+        return url_audio(chemin)
+    return None
 
-    bloc = match.group(1).strip()
-    voix = None
-    texte = None
 
-    voix_match = re.search(r"<voice>(.*?)</voice>", bloc, re.DOTALL)
-    if voix_match:
-        voix = voix_match.group(1).strip()
+def slug_jeu(jeu: dict) -> str:
+    return jeu.get("slug") or slugify(jeu["titre"])
 
-    texte_match = re.search(r"<texte>(.*?)</texte>", bloc, re.DOTALL)
-    if texte_match:
-        texte = texte_match.group(1).strip()
-    else:
-        texte = bloc
 
-    contenu = motif.sub("", contenu, count=1)
-    return contenu, texte, voix
+def compiler_contenus(conn) -> None:
+    """Complète les pages et jeux enregistrés avant la précompilation."""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("SELECT id_page, contenu FROM pages WHERE contenu_compile IS NULL")
+        pages = cur.fetchall()
+        for page in pages:
+            cur.execute(
+                "UPDATE pages SET contenu_compile=%s, tts_texte=%s, tts_voix=%s WHERE id_page=%s",
+                (*compiler_page(page["contenu"]), page["id_page"]),
+            )
+        cur.execute("SELECT id_jeu, titre FROM jeux WHERE slug IS NULL")
+        jeux = cur.fetchall()
+        for jeu in jeux:
+            cur.execute(
+                "UPDATE jeux SET slug=%s WHERE id_jeu=%s", (slugify(jeu["titre"]), jeu["id_jeu"])
+            )
+    conn.commit()
+    if pages or jeux:
+        print(f"[DEBUG] Contenus compilés : {len(pages)} pages, {len(jeux)} jeux")
 
 
 def enregistrer_prompt(prompt: str, chemin: str = "debug_prompt.txt") -> None:
@@ -146,65 +199,71 @@ def enregistrer_prompt(prompt: str, chemin: str = "debug_prompt.txt") -> None:
 
 @app.on_event("startup")
 def startup() -> None:
-    """Initialise la connexion à la base de données."""
-    global pool
-    pool = SimpleConnectionPool(
-        minconn=1,
-        maxconn=10,
-        host=DB_HOST,
-        port=DB_PORT,
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-    )
+    """Initialise la connexion à la base, vérifie le schéma et écoute les modifications.
+
+    Les ressources statiques sont construites par l'éditeur ; le jeu ne les
+    construit que si aucun manifeste n'existe encore.
+    """
+    construire_si_absent()
+    pool_base.ouvrir()
+    with get_conn() as conn:
+        verifier_schema(conn)
+        compiler_contenus(conn)
+    ecouteur.demarrer()
 
 
 @app.on_event("shutdown")
 def shutdown() -> None:
-    """Ferme le pool de connexions."""
-    if pool:
-        pool.closeall()
+    """Ferme le pool de connexions et le pool de transcodage audio."""
+    ecouteur.arreter()
+    pool_base.fermer()
+    fermer_transcodage()
+
+
+@app.on_event("shutdown")
+async def fermer_clients_ia() -> None:
+    """Ferme les connexions HTTP persistantes vers les fournisseurs d'IA et XTTS."""
+    registre_clients.fermer()
+    await registre_clients.fermer_async()
+    await fermer_client_xtts()
 
 
-@contextmanager
 def get_conn():
-    assert pool is not None, "Le pool de connexions n'est pas initialisé"
-    conn = pool.getconn()
-    try:
-        yield conn
-    finally:
-        pool.putconn(conn)
+    """Connexion du pool partagé, rendue à la sortie du bloc ``with``."""
+    return pool_base.connexion()
 
 
-def charger_page(conn, page_id: int):
-    """Récupère une page par son identifiant."""
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("SELECT * FROM pages WHERE id_page=%s", (page_id,))
-        return cur.fetchone()
+@app.get("/api/pool")
+def etat_pool():
+    """Mesures du pool de connexions Postgres."""
+    return pool_base.etat()
 
 
-def charger_jeu(conn, jeu_id: int):
-    """Récupère un jeu par son identifiant."""
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("SELECT * FROM jeux WHERE id_jeu=%s", (jeu_id,))
-        return cur.fetchone()
+def connecter():
+    """Connexion dédiée, hors pool (écoute des notifications)."""
+    return psycopg2.connect(
+        host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD
+    )
 
 
-def charger_pnj(conn, pnj_id: int) -> dict | None:
-    """Charge un PNJ par son identifiant."""
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("SELECT * FROM pnj WHERE id=%s", (pnj_id,))
-        return cur.fetchone()
+def oublier_intentions(jeu_id: int, ancien: Instantane | None) -> None:
+    """Un jeu a changé : ses intentions compilées et décisions sont périmées."""
+    if ancien:
+        matcheurs.invalider(*ancien.pages)
 
 
-def charger_enigmes(conn, pnj_id: int) -> list[dict]:
-    """Retourne la liste des énigmes d'un PNJ."""
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(
-            "SELECT texte_enigme, texte_reponse, textes_indices FROM enigmes WHERE id_pnj=%s ORDER BY id",
-            (pnj_id,),
-        )
-        return cur.fetchall()
+# Pages sans PNJ déjà rendues, par version du jeu
+cache_pages = CachePages()
+
+
+# Dialogues PNJ des joueurs, conservés côté serveur
+sessions = Sessions()
+
+# Contenu des jeux en mémoire, invalidé par les notifications de l'éditeur
+instantanes = RegistreInstantanes(get_conn)
+instantanes.abonner(oublier_intentions)
+instantanes.abonner(lambda jeu_id, ancien: cache_pages.oublier_jeu(jeu_id))
+ecouteur = Ecouteur(instantanes, connecter)
 
 
 def construire_prompt_pnj(pnj: dict, enigmes: list[dict]) -> str:
@@ -231,164 +290,255 @@ def construire_prompt_pnj(pnj: dict, enigmes: list[dict]) -> str:
 
 
 # ---------------------------------------------
-def analyse_reponse_utilisateur(
-    conn, page_id: int, saisie: str
-) -> tuple[dict | None, str]:
-    """Traite la saisie de l'utilisateur en combinant SQL et IA."""
+MESSAGE_INCOMPRIS = "Je n’ai pas compris votre réponse."
 
-    print(f"[DEBUG] Analyse saisie utilisateur : « {saisie} »")
 
-    # Étape 1 – recherche directe dans la base
+def transitions_page(conn, page_id: int) -> list[dict]:
+    """Transitions partant de la page, par ordre de priorité."""
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
         cur.execute(
             """
             SELECT * FROM transitions
             WHERE id_page_source = %s
-              AND intention ILIKE '%%' || %s || '%%'
             ORDER BY priorite, id_transition
-            LIMIT 1
             """,
-            (page_id, saisie),
+            (page_id,),
         )
-        transition = cur.fetchone()
+        return cur.fetchall()
+
+
+def matcheur_page(conn, page_id: int) -> MatcheurPage:
+    """Matcheur d'intentions de la page, compilé au besoin."""
+    return matcheurs.en_cache(page_id) or matcheurs.installer(
+        page_id, transitions_page(conn, page_id)
+    )
+
+
+def compiler_matcheur(page_id: int) -> MatcheurPage:
+    """Compile le matcheur de la page ; la connexion est rendue avant la vectorisation."""
+    transitions = _avec_connexion(transitions_page, page_id)
+    return matcheurs.installer(page_id, transitions)
+
 
+def resultat_transition(transition: dict | None, origine: str) -> tuple[dict | None, str]:
+    """Met en forme le couple (transition, message système) renvoyé aux routes."""
     if transition:
         print(
-            f"[DEBUG] Correspondance SQL trouvée : id_transition = {transition['id_transition']}"
+            f"[DEBUG] Transition {origine} : id_transition = {transition['id_transition']}"
         )
-        message = transition.get("reponse_systeme") or ""
-        return transition, message
+        return transition, transition.get("reponse_systeme") or ""
+    print("[DEBUG] Aucun résultat trouvé après réponse IA")
+    return None, MESSAGE_INCOMPRIS
 
-    # Étape 2 – analyse IA Mistral
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(
-            """
-            SELECT id_transition, intention
-            FROM transitions
-            WHERE id_page_source = %s
-            ORDER BY priorite, id_transition
-            """,
-            (page_id,),
+
+def analyse_reponse_utilisateur(
+    conn, page_id: int, saisie: str
+) -> tuple[dict | None, str]:
+    """Traite la saisie de l'utilisateur : intentions locales, puis embeddings et IA."""
+
+    print(f"[DEBUG] Analyse saisie utilisateur : « {saisie} »")
+    matcheur = matcheur_page(conn, page_id)
+    return resultat_transition(
+        *resoudre(
+            matcheurs.decider(page_id, matcheur, saisie),
+            embed,
+            lambda prompt: ia_mistral.repond("", prompt),
         )
-        possibles = cur.fetchall()
+    )
 
-    if not possibles:
-        print("[DEBUG] Aucune réponse possible définie pour cette page.")
-        return None, "Je n’ai pas compris votre réponse."
 
-    liste_reponses = "\n".join(
-        f"{p['id_transition']} : {p['intention']}" for p in possibles
+async def analyse_reponse_utilisateur_async(
+    page_id: int, saisie: str, transitions: list[dict] | None = None
+) -> tuple[dict | None, str]:
+    """Version asynchrone : SQL dans le threadpool, appels réseau non bloquants.
+
+    ``transitions`` (celles de l'instantané du jeu) évite toute lecture en
+    base ; sinon la base n'est consultée que si le matcheur de la page doit
+    être compilé, et jamais pendant les appels à l'IA.
+    """
+
+    print(f"[DEBUG] Analyse saisie utilisateur : « {saisie} »")
+    matcheur = matcheurs.en_cache(page_id)
+    if matcheur is None:
+        if transitions is None:
+            matcheur = await run_in_threadpool(compiler_matcheur, page_id)
+        else:
+            matcheur = await run_in_threadpool(matcheurs.installer, page_id, transitions)
+    return resultat_transition(
+        *await resoudre_async(
+            matcheurs.decider(page_id, matcheur, saisie),
+            embed_async,
+            lambda prompt: ia_mistral.repond_async("", prompt),
+        )
     )
 
-    prompt = (
-        "Tu es une IA spécialisée dans l'analyse de correspondance entre une phrase et une liste de réponses possibles.\n"
-        "Ton rôle est de choisir uniquement l’ID correspondant à la meilleure correspondance sémantique.\n"
-        "Si une réponse correspond clairement, tu dois répondre uniquement par l’ID (exemple : 3).\n"
-        "Si aucune correspondance ne convient, réponds uniquement : 0.\n"
-        "⚠️ Réponds **strictement** par un seul nombre, sans phrase, sans explication, sans ponctuation.\n\n"
-        "Exemple 1 :\n"
-        'Saisie utilisateur : "je veux allais sur la porte de gaiche"\n'
-        "Réponses possibles :\n"
-        "1 : droite\n2 : gauche\n3 : arrière\n"
-        "Réponse attendue : 2\n\n"
-        "Exemple 2 :\n"
-        'Saisie utilisateur : "prout"\n'
-        "Réponses possibles :\n"
-        "1 : rouge\n2 : bleu\n3 : jaune\n"
-        "Réponse attendue : 0\n\n"
-        f'Saisie utilisateur : "{saisie}"\n'
-        "Réponses possibles :\n"
-        f"{liste_reponses}\n\n"
-        "Réponds uniquement par un entier :"
+
+# ---------------------------------------------
+def _avec_connexion(fonction, *args):
+    """Exécute ``fonction(conn, *args)`` avec une connexion du pool."""
+    with get_conn() as conn:
+        return fonction(conn, *args)
+
+
+async def instantane_jeu(jeu_id: int) -> Instantane | None:
+    """Instantané du jeu ; la base n'est lue que s'il manque ou a changé."""
+    return instantanes.en_cache(jeu_id) or await run_in_threadpool(
+        instantanes.obtenir, jeu_id
     )
 
-    print("[DEBUG] Envoi prompt à l’IA Mistral…")
-    reponse_id_str = ia_mistral.repond("", prompt)
-    print(prompt)
-    print(f"[DEBUG] Réponse IA brute : {reponse_id_str!r}")
 
-    try:
-        reponse_id = int(reponse_id_str.strip())
-    except Exception:
-        print("[DEBUG] Réponse IA invalide (non entier)")
-        return None, "Je n’ai pas compris votre réponse."
+def jeu_et_page(
+    instantane: Instantane | None, page_id: int | None
+) -> tuple[dict | None, dict | None, str]:
+    """Le jeu, la page (la première si ``page_id`` vaut ``None``) et le prompt PNJ."""
+    if not instantane:
+        return None, None, ""
+    if page_id is None:
+        page = instantane.premiere_page()
+    else:
+        page = instantane.page(page_id)
+    base_prompt = ""
+    if page and page.get("id_pnj"):
+        base_prompt = instantane.prompt_pnj(page["id_pnj"], construire_prompt_pnj)
+    return instantane.jeu, page, base_prompt
 
-    if reponse_id not in [p["id_transition"] for p in possibles]:
-        print("[DEBUG] ID IA non présent dans les transitions possibles")
-        return None, "Je n’ai pas compris votre réponse."
 
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(
-            "SELECT * FROM transitions WHERE id_transition = %s",
-            (reponse_id,),
-        )
-        transition = cur.fetchone()
+async def audio_for_message_async(
+    message: str | None,
+    slug: str,
+    page_ordre: int,
+    voix: str | None = None,
+    voix_active: bool = True,
+    flux: bool = False,
+) -> str | None:
+    """Version asynchrone de ``audio_for_message`` appuyée sur ``ds9_parle_async``."""
 
-    if transition:
-        print(
-            f"[DEBUG] Transition IA sélectionnée : id_transition = {transition['id_transition']}"
-        )
-        message = transition.get("reponse_systeme") or ""
-        return transition, message
+    if not message or not voix_active:
+        return None
 
-    print("[DEBUG] Aucun résultat trouvé après réponse IA")
-    return None, "Je n’ai pas compris votre réponse."
+    voix = voix or VOIX_DEFAUT
+    if flux and len(decouper_phrases(message)) > 1:
+        chemin = chercher_audio(voix, message)
+        return url_audio(chemin) if chemin else url_flux(voix, message)
 
+    chemin = await audio_en_cache_async(voix, message)
+    if chemin:
+        return url_audio(chemin)
+    return None
+
+
+async def reponse_erreur(request: Request, msg: str):
+    """Page d'erreur 404 accompagnée de son message lu."""
+    audio = await audio_for_message_async(msg, "erreur", 0)
+    return templates.TemplateResponse(
+        "erreur.html",
+        {"request": request, "message": msg, "audio": audio},
+        status_code=404,
+    )
 
-# ---------------------------------------------
-@app.get("/play/{jeu_id}")
-def demarrer_jeu(request: Request, jeu_id: int):
-    """Affiche la première page du jeu."""
-    with get_conn() as conn:
-        jeu = charger_jeu(conn, jeu_id)
-        if not jeu:
-            msg = "Jeu introuvable"
-            audio = audio_for_message(msg, "erreur", 0)
-            return templates.TemplateResponse(
-                "erreur.html",
-                {"request": request, "message": msg, "audio": audio},
-                status_code=404,
-            )
-        slug = slugify(jeu["titre"])
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(
-                "SELECT * FROM pages WHERE id_jeu=%s ORDER BY ordre LIMIT 1",
-                (jeu_id,),
-            )
-            page = cur.fetchone()
 
-    page["contenu"], tts_text, tts_voix = extraire_tts(page.get("contenu", ""))
-    tts_audio = (
-        audio_for_message(
+def audio_tts_page(jeu: dict, page: dict, slug: str) -> asyncio.Task:
+    """Met le contenu précompilé dans la page et lance la synthèse TTS en tâche de fond."""
+    page["contenu"], tts_text, tts_voix = contenu_page(page)
+    return asyncio.create_task(
+        audio_for_message_async(
             tts_text,
             slug,
             page["ordre"],
             voix=tts_voix or jeu.get("nom_de_la_voie"),
             voix_active=jeu.get("voie_actif", True),
         )
-        if tts_text
-        else None
     )
 
-    message = ""
-    audio = None
-    context = ""
-    base_prompt = ""
-    if page.get("id_pnj"):
-        pnj = charger_pnj(conn, page["id_pnj"])
-        enigmes = charger_enigmes(conn, page["id_pnj"])
-        base_prompt = construire_prompt_pnj(pnj, enigmes)
-        enregistrer_prompt(base_prompt)
-        message = ia_mistral.repond("", base_prompt)
-        context = f"PNJ: {message}\n"
-        audio = audio_for_message(
-            message,
-            slug,
-            page["ordre"],
-            voix=jeu.get("nom_de_la_voie"),
-            voix_active=jeu.get("voie_actif", True),
-        )
 
+def lire_dialogue(sid: str, jeu_id: int, page_id: int) -> dict | None:
+    """Dialogue PNJ en cours du joueur sur cette page, s'il existe."""
+    dialogue = sessions.lire(sid).get("dialogue")
+    if dialogue and dialogue["jeu"] == jeu_id and dialogue["page"] == page_id:
+        return dialogue
+    return None
+
+
+def enregistrer_dialogue(sid: str, dialogue: dict) -> None:
+    """Conserve côté serveur le dialogue PNJ (prompt de base, résumé, tours)."""
+    donnees = dict(sessions.lire(sid))
+    donnees["dialogue"] = dialogue
+    sessions.ecrire(sid, donnees)
+
+
+# Sessions dont le dialogue est en cours de résumé, et tâches associées
+_compactions: set[str] = set()
+_taches_compaction: set[asyncio.Task] = set()
+
+
+async def compacter_dialogue(sid: str, dialogue: dict) -> None:
+    """Résume les tours anciens du dialogue, sans retenir la réponse au joueur."""
+    if sid in _compactions:
+        return
+    _compactions.add(sid)
+    try:
+        resultat = await compacter(dialogue, ia_mistral.repond_async)
+        if not resultat:
+            return
+        courant = lire_dialogue(sid, dialogue["jeu"], dialogue["page"])
+        if courant:
+            compacte = appliquer_resume(courant, dialogue, *resultat)
+            if compacte:
+                enregistrer_dialogue(sid, compacte)
+                print(f"[DEBUG] Dialogue compacté : {resultat[0]} tours résumés")
+    except Exception as exc:
+        print(f"[DEBUG] Compaction du dialogue impossible : {exc}")
+    finally:
+        _compactions.discard(sid)
+
+
+def planifier_compaction(sid: str, dialogue: dict) -> None:
+    if not a_compacter(dialogue):
+        return
+    tache = asyncio.create_task(compacter_dialogue(sid, dialogue))
+    _taches_compaction.add(tache)
+    tache.add_done_callback(_taches_compaction.discard)
+
+
+def oublier_dialogue(sid: str) -> None:
+    donnees = sessions.lire(sid)
+    if "dialogue" in donnees:
+        donnees = {k: v for k, v in donnees.items() if k != "dialogue"}
+        sessions.ecrire(sid, donnees)
+
+
+def attendre_replique(sid: str, dialogue: dict, saisie: str | None) -> str:
+    """Enregistre le tour à générer et renvoie l'URL de son flux SSE.
+
+    ``saisie`` vaut ``None`` pour la réplique d'ouverture du PNJ.
+    """
+    jeton = secrets.token_urlsafe(16)
+    dialogue = {k: v for k, v in dialogue.items() if k != "repondu"}
+    enregistrer_dialogue(sid, {**dialogue, "en_attente": {"jeton": jeton, "saisie": saisie}})
+    return f"/play/{dialogue['jeu']}/{dialogue['page']}/flux/{jeton}"
+
+
+def evenement_sse(evenement: str, donnees) -> str:
+    return f"event: {evenement}\ndata: {json.dumps(donnees, ensure_ascii=False)}\n\n"
+
+
+def rendre_page(
+    request: Request,
+    sid: str,
+    jeu: dict,
+    page: dict,
+    slug: str,
+    message: str,
+    audio: str | None,
+    tts_audio: str | None,
+    pnj_message: bool,
+    flux_pnj: str | None = None,
+):
+    """Rendu de ``play_page.html`` avec l'éventuelle transition automatique.
+
+    ``flux_pnj`` est l'URL du flux SSE de la réplique du PNJ, que la page
+    affiche au fur et à mesure de sa génération.
+    """
     response = templates.TemplateResponse(
         "play_page.html",
         {
@@ -399,18 +549,110 @@ def demarrer_jeu(request: Request, jeu_id: int):
             "slug": slug,
             "audio": audio,
             "tts_audio": tts_audio,
-            "pnj_message": bool(page.get("id_pnj")),
-            "context": context,
-            "base_prompt": base_prompt,
+            "pnj_message": pnj_message,
+            "flux_pnj": flux_pnj,
         },
     )
+    sessions.poser_cookie(response, sid)
     if page.get("delai_fermeture") and page.get("page_suivante"):
         response.headers["Refresh"] = (
-            f"{page['delai_fermeture']}; url=/play/{jeu_id}/{page['page_suivante']}"
+            f"{page['delai_fermeture']}; url=/play/{jeu['id_jeu']}/{page['page_suivante']}"
+        )
+    return response
+
+
+def reponse_en_cache(request: Request, rendue: PageRendue) -> Response:
+    """Page rendue depuis le cache, ou 304 si le navigateur l'a déjà."""
+    entetes = {"ETag": rendue.etag, "Cache-Control": "no-cache"}
+    if etag_correspond(request.headers.get("if-none-match"), rendue.etag):
+        return Response(status_code=304, headers=entetes)
+    return HTMLResponse(rendue.corps, headers={**entetes, **rendue.entetes})
+
+
+async def afficher(request: Request, instantane: Instantane, page_id: int | None):
+    """Affiche une page ; pour un PNJ, prépare le flux de sa réplique d'ouverture.
+
+    La page est rendue sans attendre l'IA : la réplique arrive ensuite par
+    ``/play/{jeu_id}/{page_id}/flux/{jeton}``. Une page sans PNJ est servie
+    depuis ``cache_pages`` tant que ni la version du jeu ni le manifeste des
+    ressources ne changent.
+    """
+    jeu, page, base_prompt = jeu_et_page(instantane, page_id)
+    if not jeu or not page:
+        return None
+    # Relevée avant le rendu : une reconstruction pendant celui-ci ne doit pas
+    # mettre en cache, sous la nouvelle révision, des URL déjà périmées
+    revision = manifeste.revision()
+    if not page.get("id_pnj"):
+        rendue = cache_pages.lire(jeu["id_jeu"], page["id_page"], instantane.version, revision)
+        # Un audio purgé du cache TTS impose un nouveau rendu (et sa synthèse)
+        if rendue and all(toucher_audio(url) for url in rendue.audios):
+            return reponse_en_cache(request, rendue)
+
+    sid = sessions.identifiant(request)
+    slug = slug_jeu(jeu)
+    tts_attendu = bool(contenu_page(page)[1]) and jeu.get("voie_actif", True)
+    tache_tts = audio_tts_page(jeu, page, slug)
+
+    flux_pnj = None
+    if page.get("id_pnj"):
+        dialogue = nouveau_dialogue(jeu["id_jeu"], page["id_page"], base_prompt, "")
+        flux_pnj = attendre_replique(sid, dialogue, None)
+    tts_audio = await tache_tts
+
+    response = rendre_page(
+        request,
+        sid,
+        jeu,
+        page,
+        slug,
+        "",
+        None,
+        tts_audio,
+        bool(page.get("id_pnj")),
+        flux_pnj,
+    )
+    # Une synthèse en échec sera retentée à l'affichage suivant, et une page
+    # dont l'audio compressé n'est pas prêt sera rendue à nouveau
+    en_cache = transcodage_termine(tts_audio) if tts_audio else not tts_attendu
+    if not page.get("id_pnj") and en_cache:
+        entetes = {"Refresh": response.headers["Refresh"]} if "Refresh" in response.headers else {}
+        rendue = cache_pages.mettre(
+            jeu["id_jeu"],
+            page["id_page"],
+            instantane.version,
+            response.body,
+            entetes,
+            revision,
+            (tts_audio,) if tts_audio else (),
         )
+        return reponse_en_cache(request, rendue)
     return response
 
 
+@app.get("/play/{jeu_id}")
+async def demarrer_jeu(request: Request, jeu_id: int):
+    """Affiche la première page du jeu."""
+    instantane = await instantane_jeu(jeu_id)
+    return await afficher(request, instantane, None) or await reponse_erreur(
+        request, "Jeu introuvable"
+    )
+
+
+@app.get("/tts/flux/{jeton}")
+def flux_tts(jeton: str):
+    """Diffuse l'audio d'un message au fur et à mesure de sa synthèse."""
+    entree = sessions.stockage.lire(PREFIXE_FLUX + jeton)
+    if not entree:
+        raise HTTPException(status_code=404, detail="Flux audio expiré")
+    voix, texte = entree["voix"], entree["texte"]
+    # Une seconde lecture (ou requête du navigateur) profite du cache
+    chemin = chercher_audio(voix, texte)
+    if chemin:
+        return FileResponse(chemin, media_type="audio/wav")
+    return StreamingResponse(flux_en_cache(voix, texte), media_type="audio/wav")
+
+
 @app.post("/delete-audio")
 async def delete_audio(request: Request):
     """Supprime un fichier audio généré."""
@@ -425,6 +667,9 @@ async def delete_audio(request: Request):
     static_dir = os.path.abspath("static")
     if not local_path.startswith(static_dir):
         raise HTTPException(status_code=400, detail="Chemin invalide")
+    if est_dans_cache(local_path):
+        # Les fichiers du cache TTS sont partagés entre joueurs
+        return {"status": "ignore"}
     try:
         os.remove(local_path)
     except FileNotFoundError:
@@ -433,155 +678,161 @@ async def delete_audio(request: Request):
 
 
 @app.get("/play/{jeu_id}/{page_id}")
-def afficher_page(request: Request, jeu_id: int, page_id: int):
+async def afficher_page(request: Request, jeu_id: int, page_id: int):
     """Affiche simplement une page sans traitement de saisie."""
-    with get_conn() as conn:
-        jeu = charger_jeu(conn, jeu_id)
-        page = charger_page(conn, page_id)
-        if not page or not jeu:
-            msg = "Page introuvable"
-            audio = audio_for_message(msg, "erreur", 0)
-            return templates.TemplateResponse(
-                "erreur.html",
-                {"request": request, "message": msg, "audio": audio},
-                status_code=404,
-            )
-        slug = slugify(jeu["titre"])
-        page["contenu"], tts_text, tts_voix = extraire_tts(page.get("contenu", ""))
-        tts_audio = (
-            audio_for_message(
-                tts_text,
-                slug,
-                page["ordre"],
-                voix=tts_voix or jeu.get("nom_de_la_voie"),
-                voix_active=jeu.get("voie_actif", True),
-            )
-            if tts_text
-            else None
-        )
-
-    message = ""
-    audio = None
-    context = ""
-    base_prompt = ""
-    if page.get("id_pnj"):
-        pnj = charger_pnj(conn, page["id_pnj"])
-        enigmes = charger_enigmes(conn, page["id_pnj"])
-        base_prompt = construire_prompt_pnj(pnj, enigmes)
-        print("[DEBUG] Prompt PNJ envoyé à l’IA :\n", base_prompt)
-        enregistrer_prompt(base_prompt)
-        message = ia_mistral.repond("", base_prompt)
-        context = f"PNJ: {message}\n"
-        audio = audio_for_message(
-            message,
-            slug,
-            page["ordre"],
-            voix=jeu.get("nom_de_la_voie"),
-            voix_active=jeu.get("voie_actif", True),
-        )
-    else:
-        audio = None
-
-    response = templates.TemplateResponse(
-        "play_page.html",
-        {
-            "request": request,
-            "jeu": jeu,
-            "page": page,
-            "message": message,
-            "slug": slug,
-            "audio": audio,
-            "tts_audio": tts_audio,
-            "pnj_message": bool(page.get("id_pnj")),
-            "context": context,
-            "base_prompt": base_prompt,
-        },
+    instantane = await instantane_jeu(jeu_id)
+    return await afficher(request, instantane, page_id) or await reponse_erreur(
+        request, "Page introuvable"
     )
-    if page.get("delai_fermeture") and page.get("page_suivante"):
-        response.headers["Refresh"] = (
-            f"{page['delai_fermeture']}; url=/play/{jeu_id}/{page['page_suivante']}"
-        )
-    return response
 
 
 @app.post("/play/{jeu_id}/{page_id}")
-def jouer_page(
+async def jouer_page(
     request: Request,
     jeu_id: int,
     page_id: int,
     saisie: str = Form(""),
-    context: str = Form(""),
-    base_prompt: str = Form(""),
 ):
-    """Traite la saisie du joueur et applique la transition."""
-    with get_conn() as conn:
-        jeu = charger_jeu(conn, jeu_id)
-        page = charger_page(conn, page_id)
-        if not page:
-            msg = "Page introuvable"
-            audio = audio_for_message(msg, "erreur", 0)
-            return templates.TemplateResponse(
-                "erreur.html",
-                {"request": request, "message": msg, "audio": audio},
-                status_code=404,
-            )
-        transition, message = analyse_reponse_utilisateur(conn, page_id, saisie)
-        if transition:
-            # On affiche la réponse système éventuelle puis on charge la page cible
-            page = charger_page(conn, transition["id_page_cible"])
-            context = ""
-        slug = slugify(jeu["titre"])
-    page["contenu"], tts_text, tts_voix = extraire_tts(page.get("contenu", ""))
-    tts_audio = (
-        audio_for_message(
-            tts_text,
-            slug,
-            page["ordre"],
-            voix=tts_voix or jeu.get("nom_de_la_voie"),
-            voix_active=jeu.get("voie_actif", True),
-        )
-        if tts_text
-        else None
+    """Traite la saisie du joueur et applique la transition.
+
+    Le dialogue avec un PNJ (prompt de base, résumé et derniers tours) est
+    conservé dans la session du joueur, pas dans le formulaire ; son prompt
+    reste dans le budget de tokens du jeu.
+    """
+    sid = sessions.identifiant(request)
+    instantane = await instantane_jeu(jeu_id)
+    jeu, page, _ = jeu_et_page(instantane, page_id)
+    if not page or not jeu:
+        return await reponse_erreur(request, "Page introuvable")
+
+    transition, message = await analyse_reponse_utilisateur_async(
+        page_id, saisie, instantane.transitions(page_id)
     )
+    if transition:
+        # On affiche la réponse système éventuelle puis on charge la page cible
+        page = instantane.page(transition["id_page_cible"])
+        if not page:
+            return await reponse_erreur(request, "Page introuvable")
+        oublier_dialogue(sid)
+    slug = slug_jeu(jeu)
+    tache_tts = audio_tts_page(jeu, page, slug)
+
     pnj_message = False
+    flux_pnj = None
     if page.get("id_pnj"):
         if not transition:
-            if not base_prompt:
-                pnj = charger_pnj(conn, page["id_pnj"])
-                enigmes = charger_enigmes(conn, page["id_pnj"])
-                base_prompt = construire_prompt_pnj(pnj, enigmes)
-            prompt = f"{base_prompt}\n{context}Joueur: {saisie}\nPNJ:"
-            enregistrer_prompt(prompt)
-            message = ia_mistral.repond("", prompt)
-            context = f"{context}Joueur: {saisie}\nPNJ: {message}\n"
+            dialogue = lire_dialogue(sid, jeu_id, page_id) or nouveau_dialogue(
+                jeu_id,
+                page_id,
+                instantane.prompt_pnj(page["id_pnj"], construire_prompt_pnj),
+                "",
+            )
+            flux_pnj = attendre_replique(sid, dialogue, saisie)
+            message = ""
             pnj_message = True
-    audio = audio_for_message(
+    audio = await audio_for_message_async(
         message,
         slug,
         page["ordre"],
         voix=jeu.get("nom_de_la_voie"),
         voix_active=jeu.get("voie_actif", True),
+        flux=pnj_message,
     )
-    response = templates.TemplateResponse(
-        "play_page.html",
-        {
-            "request": request,
-            "jeu": jeu,
-            "page": page,
-            "message": message,
-            "slug": slug,
-            "audio": audio,
-            "tts_audio": tts_audio,
-            "pnj_message": pnj_message,
-            "context": context,
-            "base_prompt": base_prompt,
-        },
+    tts_audio = await tache_tts
+
+    return rendre_page(
+        request,
+        sid,
+        jeu,
+        page,
+        slug,
+        message,
+        audio,
+        tts_audio,
+        pnj_message,
+        flux_pnj,
     )
-    if page.get("delai_fermeture") and page.get("page_suivante"):
-        response.headers["Refresh"] = (
-            f"{page['delai_fermeture']}; url=/play/{jeu_id}/{page['page_suivante']}"
+
+
+@app.get("/play/{jeu_id}/{page_id}/flux/{jeton}")
+async def flux_replique(request: Request, jeu_id: int, page_id: int, jeton: str):
+    """Diffuse en Server-Sent Events la réplique du PNJ en cours de génération.
+
+    Événements : ``morceau`` (texte à ajouter), puis ``fin`` avec l'URL de
+    l'audio de la réplique complète.
+
+    Le jeton reste valable jusqu'à ce que la réplique soit enregistrée dans le
+    dialogue : un navigateur qui se reconnecte (``EventSource``) avant relance
+    la génération, et après reçoit la réplique enregistrée (``repondu``).
+    """
+    sid = sessions.identifiant(request)
+    dialogue = lire_dialogue(sid, jeu_id, page_id) or {}
+    attente = dialogue.get("en_attente") or {}
+    repondu = dialogue.get("repondu") or {}
+    if jeton not in (attente.get("jeton"), repondu.get("jeton")):
+        raise HTTPException(status_code=404, detail="Réplique introuvable")
+    jeu, page, _ = jeu_et_page(await instantane_jeu(jeu_id), page_id)
+    if not page or not jeu:
+        raise HTTPException(status_code=404, detail="Page introuvable")
+
+    async def evenement_fin(message: str) -> str:
+        audio = await audio_for_message_async(
+            message,
+            slug_jeu(jeu),
+            page["ordre"],
+            voix=jeu.get("nom_de_la_voie"),
+            voix_active=jeu.get("voie_actif", True),
+            flux=True,
         )
-    return response
+        return evenement_sse("fin", {"audio": audio, "sources": sources_audio(audio)})
+
+    if repondu.get("jeton") == jeton:
+
+        async def rejouer():
+            yield evenement_sse("morceau", repondu["message"])
+            yield await evenement_fin(repondu["message"])
+
+        return StreamingResponse(
+            rejouer(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    dialogue = {k: v for k, v in dialogue.items() if k != "en_attente"}
+    saisie = attente["saisie"]
+    if saisie is None:
+        prompt = dialogue["base_prompt"]
+        print("[DEBUG] Prompt PNJ envoyé à l’IA :\n", prompt)
+    else:
+        prompt = construire_prompt(dialogue, saisie, budget_jeu(jeu))
+    enregistrer_prompt(prompt)
+
+    async def evenements():
+        morceaux = []
+        async for morceau in ia_mistral.repond_flux("", prompt):
+            morceaux.append(morceau)
+            yield evenement_sse("morceau", morceau)
+        message = "".join(morceaux)
+        # Relu : une compaction a pu aboutir pendant la génération, et une
+        # autre connexion avec le même jeton a pu enregistrer la réplique
+        courant = lire_dialogue(sid, jeu_id, page_id)
+        if courant is None or (courant.get("en_attente") or {}).get("jeton") == jeton:
+            courant = courant or dialogue
+            if saisie is None:
+                courant = nouveau_dialogue(jeu_id, page_id, dialogue["base_prompt"], message)
+            else:
+                courant = ajouter_tour(courant, saisie, message)
+            courant = {k: v for k, v in courant.items() if k != "en_attente"}
+            courant["repondu"] = {"jeton": jeton, "message": message}
+            enregistrer_dialogue(sid, courant)
+            planifier_compaction(sid, courant)
+        yield await evenement_fin(message)
+
+    return StreamingResponse(
+        evenements(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 if __name__ == "__main__":
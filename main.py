@@ -1,10 +1,7 @@
-from fastapi import FastAPI, Request, Form
+from fastapi import FastAPI, Request, Form, BackgroundTasks
 from fastapi.responses import RedirectResponse
 from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
 from psycopg2.extras import RealDictCursor
-from psycopg2.pool import SimpleConnectionPool
-from contextlib import contextmanager
 from dotenv import load_dotenv
 import os
 import re
@@ -12,7 +9,16 @@ import unicodedata
 import uvicorn
 import subprocess
 
-from jouer import audio_for_message, analyse_reponse_utilisateur
+from jouer import audio_for_message, analyse_reponse_utilisateur, compiler_contenus
+from ds9_contenu import compiler_page
+from ds9_cache_tts import fermer_transcodage, sources_audio
+from ds9_assets import StaticEmpreintes, activer_assets, construire as construire_assets
+from ds9_cache_pages import activer_cache_jinja
+from ds9_instantane import signaler_modification
+from ds9_migrations import verifier_schema
+from ds9_pool import pool_base
+from ds9_intentions import matcheurs
+from ds9_prechauffage import ETATS as ETATS_PRECHAUFFAGE, entrees_tts, etat_entrees, prechauffer
 
 load_dotenv()
 
@@ -23,40 +29,38 @@ DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 
 app = FastAPI()
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", StaticEmpreintes(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
-
-pool: SimpleConnectionPool | None = None
+activer_cache_jinja(templates)
+activer_assets(templates)
+templates.env.globals["sources_audio"] = sources_audio
 
 
 @app.on_event("startup")
 def startup() -> None:
-    global pool
-    pool = SimpleConnectionPool(
-        minconn=1,
-        maxconn=10,
-        host=DB_HOST,
-        port=DB_PORT,
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-    )
+    """Construit les ressources statiques, ouvre le pool et met le schéma à jour."""
+    construire_assets()
+    pool_base.ouvrir()
+    with get_conn() as conn:
+        verifier_schema(conn)
+        compiler_contenus(conn)
 
 
 @app.on_event("shutdown")
 def shutdown() -> None:
-    if pool:
-        pool.closeall()
+    pool_base.fermer()
+    fermer_transcodage()
 
 
-@contextmanager
 def get_conn():
-    assert pool is not None, "Connection pool not initialized"
-    conn = pool.getconn()
-    try:
-        yield conn
-    finally:
-        pool.putconn(conn)
+    """Connexion du pool partagé, rendue à la sortie du bloc ``with``."""
+    return pool_base.connexion()
+
+
+@app.get("/api/pool")
+def etat_pool():
+    """Mesures du pool de connexions Postgres."""
+    return pool_base.etat()
 
 
 def slugify(text: str) -> str:
@@ -91,6 +95,25 @@ def charger_jeu(conn, jeu_id: int):
         return cur.fetchone()
 
 
+def charger_pages_jeu(conn, jeu_id: int) -> list[dict]:
+    """Retourne les pages d'un jeu dans l'ordre de lecture."""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            "SELECT id_page, titre, ordre, contenu, contenu_compile, tts_texte, tts_voix FROM pages WHERE id_jeu=%s ORDER BY ordre",
+            (jeu_id,),
+        )
+        return cur.fetchall()
+
+
+def prechauffer_jeu(jeu_id: int) -> None:
+    """Tâche de fond : pré-génère l'audio TTS de toutes les pages du jeu."""
+    with get_conn() as conn:
+        jeu = charger_jeu(conn, jeu_id)
+        pages = charger_pages_jeu(conn, jeu_id)
+    if jeu:
+        prechauffer(jeu, pages)
+
+
 @app.get("/", include_in_schema=False)
 def redirect_root() -> RedirectResponse:
     """Redirige la racine vers la liste des jeux."""
@@ -106,14 +129,65 @@ def list_jeux(request: Request):
     return templates.TemplateResponse("index.html", {"request": request, "jeux": jeux})
 
 
+def lire_budget_dialogue(valeur: str) -> int | None:
+    """Budget saisi dans le formulaire de jeu : ``None`` si vide.
+
+    Lève ``ValueError`` si la valeur n'est pas un entier strictement positif.
+    """
+    valeur = valeur.strip()
+    if not valeur:
+        return None
+    if not (valeur.isascii() and valeur.isdigit()) or int(valeur) <= 0:
+        raise ValueError("Le budget des dialogues doit être un nombre entier positif de tokens.")
+    return int(valeur)
+
+
+def charger_formulaire_jeu(conn, jeu_id: int):
+    """Jeu et pages (avec le titre de leur page suivante) du formulaire d'édition."""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("SELECT * FROM jeux WHERE id_jeu = %s", (jeu_id,))
+        jeu = cur.fetchone()
+        cur.execute(
+            """
+            SELECT p.*, p2.titre AS titre_suivante
+            FROM pages AS p
+            LEFT JOIN pages AS p2 ON p.page_suivante = p2.id_page
+            WHERE p.id_jeu = %s
+            ORDER BY p.ordre
+            """,
+            (jeu_id,),
+        )
+        return jeu, cur.fetchall()
+
+
+def formulaire_jeu_invalide(request: Request, jeu_id: int | None, saisie: dict, erreur: str):
+    """Réaffiche le formulaire de jeu avec les valeurs saisies et l'erreur."""
+    jeu, pages = None, []
+    if jeu_id is not None:
+        with get_conn() as conn:
+            jeu, pages = charger_formulaire_jeu(conn, jeu_id)
+    return templates.TemplateResponse(
+        "add_jeu.html",
+        {
+            "request": request,
+            "jeu": jeu,
+            "pages": pages,
+            "valeurs": {**(jeu or {}), **saisie},
+            "erreur": erreur,
+        },
+        status_code=400,
+    )
+
+
 @app.get("/jeux/add")
 def add_jeu_form(request: Request):
     """Affiche le formulaire d'ajout d'un jeu."""
-    return templates.TemplateResponse("add_jeu.html", {"request": request})
+    return templates.TemplateResponse("add_jeu.html", {"request": request, "valeurs": {}})
 
 
 @app.post("/jeux/add")
 def add_jeu(
+    request: Request,
     titre: str = Form(...),
     auteur: str = Form(...),
     ia_nom: str = Form(""),
@@ -121,12 +195,26 @@ def add_jeu(
     voie_actif: bool = Form(False),
     synopsis: str = Form(""),
     motdepasse: str = Form(""),
+    budget_dialogue: str = Form(""),
 ):
     """Insère un nouveau jeu dans la base puis redirige vers la liste."""
+    try:
+        budget = lire_budget_dialogue(budget_dialogue)
+    except ValueError as exc:
+        saisie = {
+            "titre": titre,
+            "auteur": auteur,
+            "ia_nom": ia_nom,
+            "nom_de_la_voie": nom_de_la_voie,
+            "voie_actif": voie_actif,
+            "synopsis": synopsis,
+            "budget_dialogue": budget_dialogue,
+        }
+        return formulaire_jeu_invalide(request, None, saisie, str(exc))
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute(
-                "INSERT INTO jeux (titre, auteur, ia_nom, synopsis, mot_de_passe, nom_de_la_voie, voie_actif) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                "INSERT INTO jeux (titre, auteur, ia_nom, synopsis, mot_de_passe, nom_de_la_voie, voie_actif, budget_dialogue, slug) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
                 (
                     titre,
                     auteur,
@@ -135,6 +223,8 @@ def add_jeu(
                     motdepasse,
                     nom_de_la_voie or None,
                     voie_actif,
+                    budget,
+                    slugify(titre),
                 ),
             )
             conn.commit()
@@ -146,29 +236,18 @@ def add_jeu(
 def edit_jeu_form(request: Request, jeu_id: int):
     """Affiche le formulaire d'édition pré-rempli et la liste des pages."""
     with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM jeux WHERE id_jeu = %s", (jeu_id,))
-            jeu = cur.fetchone()
-            cur.execute(
-                """
-                SELECT p.*, p2.titre AS titre_suivante
-                FROM pages AS p
-                LEFT JOIN pages AS p2 ON p.page_suivante = p2.id_page
-                WHERE p.id_jeu = %s
-                ORDER BY p.ordre
-                """,
-                (jeu_id,),
-            )
-            pages = cur.fetchall()
+        jeu, pages = charger_formulaire_jeu(conn, jeu_id)
     return templates.TemplateResponse(
         "add_jeu.html",
-        {"request": request, "jeu": jeu, "pages": pages},
+        {"request": request, "jeu": jeu, "pages": pages, "valeurs": jeu or {}},
     )
 
 
 @app.post("/jeux/edit/{jeu_id}")
 def edit_jeu(
+    request: Request,
     jeu_id: int,
+    background_tasks: BackgroundTasks,
     titre: str = Form(...),
     auteur: str = Form(...),
     ia_nom: str = Form(""),
@@ -176,12 +255,26 @@ def edit_jeu(
     voie_actif: bool = Form(False),
     synopsis: str = Form(""),
     motdepasse: str = Form(""),
+    budget_dialogue: str = Form(""),
 ):
     """Met à jour un jeu existant puis redirige vers la liste."""
+    try:
+        budget = lire_budget_dialogue(budget_dialogue)
+    except ValueError as exc:
+        saisie = {
+            "titre": titre,
+            "auteur": auteur,
+            "ia_nom": ia_nom,
+            "nom_de_la_voie": nom_de_la_voie,
+            "voie_actif": voie_actif,
+            "synopsis": synopsis,
+            "budget_dialogue": budget_dialogue,
+        }
+        return formulaire_jeu_invalide(request, jeu_id, saisie, str(exc))
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute(
-                "UPDATE jeux SET titre=%s, auteur=%s, ia_nom=%s, nom_de_la_voie=%s, voie_actif=%s, synopsis=%s, mot_de_passe=%s WHERE id_jeu=%s",
+                "UPDATE jeux SET titre=%s, auteur=%s, ia_nom=%s, nom_de_la_voie=%s, voie_actif=%s, synopsis=%s, mot_de_passe=%s, budget_dialogue=%s, slug=%s WHERE id_jeu=%s",
                 (
                     titre,
                     auteur,
@@ -190,19 +283,51 @@ def edit_jeu(
                     voie_actif,
                     synopsis,
                     motdepasse,
+                    budget,
+                    slugify(titre),
                     jeu_id,
                 ),
             )
+            signaler_modification(cur, jeu_id)
             conn.commit()
     ensure_game_dirs(titre)
+    background_tasks.add_task(construire_assets)
+    background_tasks.add_task(prechauffer_jeu, jeu_id)
     return RedirectResponse(url="/jeux", status_code=303)
 
 
+@app.get("/jeux/{jeu_id}/prechauffage")
+def prechauffage_jeu(request: Request, jeu_id: int):
+    """Affiche l'avancement de la pré-génération audio et les pages à régénérer."""
+    with get_conn() as conn:
+        jeu = charger_jeu(conn, jeu_id)
+        pages = charger_pages_jeu(conn, jeu_id)
+    entrees = etat_entrees(entrees_tts(jeu, pages)) if jeu else []
+    return templates.TemplateResponse(
+        "prechauffage.html",
+        {
+            "request": request,
+            "jeu": jeu,
+            "etat": ETATS_PRECHAUFFAGE.get(jeu_id),
+            "entrees": entrees,
+            "perimees": sum(1 for e in entrees if not e["en_cache"]),
+        },
+    )
+
+
+@app.get("/jeux/{jeu_id}/prechauffage/lancer")
+def lancer_prechauffage(jeu_id: int, background_tasks: BackgroundTasks):
+    """Relance manuellement la pré-génération audio d'un jeu."""
+    background_tasks.add_task(prechauffer_jeu, jeu_id)
+    return RedirectResponse(url=f"/jeux/{jeu_id}/prechauffage", status_code=303)
+
+
 @app.get("/jeux/delete/{jeu_id}")
 def delete_jeu(jeu_id: int):
     """Supprime un jeu par son identifiant."""
     with get_conn() as conn:
         with conn.cursor() as cur:
+            signaler_modification(cur, jeu_id)
             cur.execute("DELETE FROM jeux WHERE id_jeu=%s", (jeu_id,))
             conn.commit()
     return RedirectResponse(url="/jeux", status_code=303)
@@ -247,6 +372,7 @@ def add_pnj(
                 "INSERT INTO pnj (id_jeu, nom, personae, prompt) VALUES (%s, %s, %s, %s)",
                 (jeu_id, nom, personae, prompt),
             )
+            signaler_modification(cur, jeu_id)
             conn.commit()
     return RedirectResponse(url=f"/pnj?jeu_id={jeu_id}", status_code=303)
 
@@ -275,10 +401,13 @@ def edit_pnj(
 ):
     with get_conn() as conn:
         with conn.cursor() as cur:
+            # Le PNJ peut changer de jeu : l'ancien et le nouveau sont concernés
+            signaler_modification(cur, pnj_id=pnj_id)
             cur.execute(
                 "UPDATE pnj SET id_jeu=%s, nom=%s, personae=%s, prompt=%s WHERE id=%s",
                 (jeu_id, nom, personae, prompt, pnj_id),
             )
+            signaler_modification(cur, jeu_id)
             conn.commit()
     return RedirectResponse(url=f"/pnj?jeu_id={jeu_id}", status_code=303)
 
@@ -289,6 +418,7 @@ def delete_pnj(pnj_id: int):
         with conn.cursor() as cur:
             cur.execute("SELECT id_jeu FROM pnj WHERE id=%s", (pnj_id,))
             jeu_id = cur.fetchone()[0]
+            signaler_modification(cur, jeu_id)
             cur.execute("DELETE FROM pnj WHERE id=%s", (pnj_id,))
             conn.commit()
     return RedirectResponse(url=f"/pnj?jeu_id={jeu_id}", status_code=303)
@@ -318,6 +448,7 @@ def add_enigme(
                 """,
                 (id_pnj, texte_enigme, texte_reponse, textes_indices),
             )
+            signaler_modification(cur, pnj_id=id_pnj)
             conn.commit()
     return RedirectResponse(url=f"/pnj/edit/{id_pnj}", status_code=303)
 
@@ -350,6 +481,7 @@ def edit_enigme(
                 """,
                 (id_pnj, texte_enigme, texte_reponse, textes_indices, enigme_id),
             )
+            signaler_modification(cur, pnj_id=id_pnj)
             conn.commit()
     return RedirectResponse(url=f"/pnj/edit/{id_pnj}", status_code=303)
 
@@ -361,6 +493,7 @@ def delete_enigme(enigme_id: int):
             cur.execute("SELECT id_pnj FROM enigmes WHERE id=%s", (enigme_id,))
             pnj_id = cur.fetchone()[0]
             cur.execute("DELETE FROM enigmes WHERE id=%s", (enigme_id,))
+            signaler_modification(cur, pnj_id=pnj_id)
             conn.commit()
     return RedirectResponse(url=f"/pnj/edit/{pnj_id}", status_code=303)
 
@@ -388,6 +521,7 @@ def add_page_form(request: Request, jeu_id: int):
 
 @app.post("/pages/add")
 def add_page(
+    background_tasks: BackgroundTasks,
     jeu_id: int = Form(...),
     titre: str = Form(...),
     ordre: int = Form(...),
@@ -407,7 +541,7 @@ def add_page(
             next_page = int(page_suivante) if page_suivante else None
             pnj = int(id_pnj) if id_pnj else None
             cur.execute(
-                "INSERT INTO pages (id_jeu, titre, ordre, delai_fermeture, page_suivante, musique, image_fond, est_aide, enigme_texte, bouton_texte, erreur_texte, contenu, id_pnj) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                "INSERT INTO pages (id_jeu, titre, ordre, delai_fermeture, page_suivante, musique, image_fond, est_aide, enigme_texte, bouton_texte, erreur_texte, contenu, id_pnj, contenu_compile, tts_texte, tts_voix) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
                 (
                     jeu_id,
                     titre,
@@ -422,9 +556,13 @@ def add_page(
                     erreur_texte,
                     contenu,
                     pnj,
+                    *compiler_page(contenu),
                 ),
             )
+            signaler_modification(cur, jeu_id)
             conn.commit()
+    background_tasks.add_task(construire_assets)
+    background_tasks.add_task(prechauffer_jeu, jeu_id)
     return RedirectResponse(url=f"/jeux/edit/{jeu_id}", status_code=303)
 
 
@@ -470,6 +608,7 @@ def edit_page_form(request: Request, page_id: int):
 @app.post("/pages/edit/{page_id}")
 def edit_page(
     page_id: int,
+    background_tasks: BackgroundTasks,
     titre: str = Form(...),
     ordre: int = Form(...),
     delai_fermeture: int = Form(0),
@@ -488,7 +627,7 @@ def edit_page(
             next_page = int(page_suivante) if page_suivante else None
             pnj = int(id_pnj) if id_pnj else None
             cur.execute(
-                "UPDATE pages SET titre=%s, ordre=%s, delai_fermeture=%s, page_suivante=%s, musique=%s, image_fond=%s, est_aide=%s, enigme_texte=%s, bouton_texte=%s, erreur_texte=%s, contenu=%s, id_pnj=%s WHERE id_page=%s",
+                "UPDATE pages SET titre=%s, ordre=%s, delai_fermeture=%s, page_suivante=%s, musique=%s, image_fond=%s, est_aide=%s, enigme_texte=%s, bouton_texte=%s, erreur_texte=%s, contenu=%s, id_pnj=%s, contenu_compile=%s, tts_texte=%s, tts_voix=%s WHERE id_page=%s RETURNING id_jeu",
                 (
                     titre,
                     ordre,
@@ -502,10 +641,15 @@ def edit_page(
                     erreur_texte,
                     contenu,
                     pnj,
+                    *compiler_page(contenu),
                     page_id,
                 ),
             )
+            jeu_id = cur.fetchone()[0]
+            signaler_modification(cur, jeu_id)
             conn.commit()
+    background_tasks.add_task(construire_assets)
+    background_tasks.add_task(prechauffer_jeu, jeu_id)
     return RedirectResponse(url=f"/pages/edit/{page_id}", status_code=303)
 
 
@@ -515,6 +659,7 @@ def delete_page(page_id: int):
         with conn.cursor() as cur:
             cur.execute("SELECT id_jeu FROM pages WHERE id_page=%s", (page_id,))
             jeu_id = cur.fetchone()[0]
+            signaler_modification(cur, jeu_id)
             cur.execute("DELETE FROM pages WHERE id_page=%s", (page_id,))
             conn.commit()
     return RedirectResponse(url=f"/jeux/edit/{jeu_id}", status_code=303)
@@ -530,7 +675,7 @@ def duplicate_page(page_id: int):
             )
             page = cur.fetchone()
             cur.execute(
-                "INSERT INTO pages (id_jeu, titre, ordre, delai_fermeture, page_suivante, musique, image_fond, est_aide, enigme_texte, bouton_texte, erreur_texte, contenu, id_pnj) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                "INSERT INTO pages (id_jeu, titre, ordre, delai_fermeture, page_suivante, musique, image_fond, est_aide, enigme_texte, bouton_texte, erreur_texte, contenu, id_pnj, contenu_compile, tts_texte, tts_voix) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
                 (
                     page["id_jeu"],
                     page["titre"],
@@ -545,8 +690,10 @@ def duplicate_page(page_id: int):
                     page["erreur_texte"],
                     page["contenu"],
                     page["id_pnj"],
+                    *compiler_page(page["contenu"]),
                 ),
             )
+            signaler_modification(cur, page["id_jeu"])
             conn.commit()
     return RedirectResponse(url=f"/jeux/edit/{page['id_jeu']}", status_code=303)
 
@@ -597,7 +744,9 @@ def add_transition(
                     reponse_systeme,
                 ),
             )
+            signaler_modification(cur, page_id=id_page_source)
             conn.commit()
+    matcheurs.invalider(id_page_source)
     return RedirectResponse(url=f"/pages/edit/{id_page_source}", status_code=303)
 
 
@@ -639,6 +788,11 @@ def edit_transition(
 ):
     with get_conn() as conn:
         with conn.cursor() as cur:
+            cur.execute(
+                "SELECT id_page_source FROM transitions WHERE id_transition=%s",
+                (transition_id,),
+            )
+            ancienne_source = cur.fetchone()[0]
             cur.execute(
                 """
                 UPDATE transitions SET
@@ -662,7 +816,10 @@ def edit_transition(
                     transition_id,
                 ),
             )
+            signaler_modification(cur, page_id=id_page_source)
             conn.commit()
+    # La transition a pu changer de page source : les deux pages sont concernées
+    matcheurs.invalider(ancienne_source, id_page_source)
     return RedirectResponse(url=f"/pages/edit/{id_page_source}", status_code=303)
 
 
@@ -679,7 +836,9 @@ def delete_transition(transition_id: int):
                 "DELETE FROM transitions WHERE id_transition=%s",
                 (transition_id,),
             )
+            signaler_modification(cur, page_id=page_id)
             conn.commit()
+    matcheurs.invalider(page_id)
     return RedirectResponse(url=f"/pages/edit/{page_id}", status_code=303)
 
 
@@ -713,7 +872,9 @@ def duplicate_transition(transition_id: int):
                     t["reponse_systeme"],
                 ),
             )
+            signaler_modification(cur, page_id=t["id_page_source"])
             conn.commit()
+    matcheurs.invalider(t["id_page_source"])
     return RedirectResponse(url=f"/pages/edit/{t['id_page_source']}", status_code=303)
 
 
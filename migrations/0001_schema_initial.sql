@@ -0,0 +1,95 @@
+-- Schéma de base, repris de l'ancien Station72.session.sql en syntaxe Postgres.
+-- Idempotent : une base créée à la main avec ce fichier est laissée telle quelle.
+
+CREATE TABLE IF NOT EXISTS jeux (
+    id_jeu SERIAL PRIMARY KEY,
+    titre VARCHAR(255) NOT NULL,
+    auteur VARCHAR(255) DEFAULT NULL,
+    synopsis TEXT DEFAULT NULL,
+    mot_de_passe TEXT DEFAULT NULL,
+    date_creation TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS pages (
+    id_page SERIAL PRIMARY KEY,
+    id_jeu INTEGER NOT NULL REFERENCES jeux(id_jeu) ON DELETE CASCADE,
+    titre VARCHAR(255) NOT NULL,
+    ordre INTEGER NOT NULL DEFAULT 1,
+    contenu TEXT DEFAULT NULL,
+    date_creation TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS pnj (
+    id SERIAL PRIMARY KEY,
+    id_jeu INTEGER NOT NULL,
+    nom VARCHAR(100) NOT NULL,
+    personae TEXT DEFAULT NULL,
+    prompt TEXT DEFAULT NULL,
+    date_creation TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT fk_pnj_jeu FOREIGN KEY (id_jeu) REFERENCES jeux(id_jeu) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS enigmes (
+    id SERIAL PRIMARY KEY,
+    id_pnj INTEGER NOT NULL,
+    texte_enigme TEXT NOT NULL,
+    texte_reponse TEXT NOT NULL,
+    textes_indices TEXT DEFAULT NULL,
+    date_creation TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT fk_pnj FOREIGN KEY (id_pnj) REFERENCES pnj(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS transitions (
+    id_transition SERIAL PRIMARY KEY,
+    id_page_source INTEGER NOT NULL,
+    intention VARCHAR(255) NOT NULL,
+    id_page_cible INTEGER NOT NULL,
+    condition_flag VARCHAR(100) DEFAULT NULL,
+    valeur_condition VARCHAR(100) DEFAULT NULL,
+    priorite INTEGER DEFAULT 1,
+    reponse_systeme TEXT DEFAULT NULL,
+    date_creation TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT fk_page_source FOREIGN KEY (id_page_source) REFERENCES pages(id_page),
+    CONSTRAINT fk_page_cible FOREIGN KEY (id_page_cible) REFERENCES pages(id_page)
+);
+
+ALTER TABLE pages
+    ADD COLUMN IF NOT EXISTS delai_fermeture INTEGER DEFAULT NULL,
+    ADD COLUMN IF NOT EXISTS page_suivante INTEGER DEFAULT NULL,
+    ADD COLUMN IF NOT EXISTS musique TEXT DEFAULT NULL,
+    ADD COLUMN IF NOT EXISTS image_fond TEXT DEFAULT NULL,
+    ADD COLUMN IF NOT EXISTS enigme_texte TEXT DEFAULT NULL,
+    ADD COLUMN IF NOT EXISTS bouton_texte TEXT DEFAULT NULL,
+    ADD COLUMN IF NOT EXISTS erreur_texte TEXT DEFAULT NULL,
+    ADD COLUMN IF NOT EXISTS est_aide BOOLEAN DEFAULT FALSE,
+    ADD COLUMN IF NOT EXISTS id_pnj INTEGER DEFAULT NULL;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'fk_page_pnj') THEN
+        ALTER TABLE pages
+            ADD CONSTRAINT fk_page_pnj FOREIGN KEY (id_pnj) REFERENCES pnj(id);
+    END IF;
+END $$;
+
+COMMENT ON COLUMN pages.delai_fermeture IS 'Délai en secondes avant fermeture automatique';
+COMMENT ON COLUMN pages.page_suivante IS 'id_page cible en cas de transition automatique';
+COMMENT ON COLUMN pages.musique IS 'Chemin du fichier musique';
+COMMENT ON COLUMN pages.image_fond IS 'Chemin de l''image de fond';
+COMMENT ON COLUMN pages.enigme_texte IS 'Texte de l''énigme';
+COMMENT ON COLUMN pages.bouton_texte IS 'Libellé du bouton';
+COMMENT ON COLUMN pages.erreur_texte IS 'Message en cas d''erreur';
+COMMENT ON COLUMN pages.est_aide IS 'Page d''aide';
+
+ALTER TABLE jeux
+    ADD COLUMN IF NOT EXISTS ia_nom TEXT DEFAULT NULL,
+    ADD COLUMN IF NOT EXISTS nom_de_la_voie TEXT DEFAULT NULL,
+    ADD COLUMN IF NOT EXISTS voie_actif BOOLEAN DEFAULT FALSE,
+    ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS budget_dialogue INTEGER DEFAULT NULL;
+
+COMMENT ON COLUMN jeux.ia_nom IS 'Nom de l''IA';
+COMMENT ON COLUMN jeux.nom_de_la_voie IS 'Nom de la voie';
+COMMENT ON COLUMN jeux.voie_actif IS 'Voie active';
+COMMENT ON COLUMN jeux.version IS 'Incrémentée à chaque modification (instantanés des routes de jeu)';
+COMMENT ON COLUMN jeux.budget_dialogue IS 'Budget en tokens des prompts de dialogue PNJ (NULL : DIALOGUE_BUDGET)';
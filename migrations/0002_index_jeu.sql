@@ -0,0 +1,16 @@
+-- Index des lectures des routes de jeu et de l'éditeur.
+
+-- Pages d'un jeu dans l'ordre (première page, instantanés, listes de l'éditeur)
+CREATE INDEX IF NOT EXISTS pages_jeu_ordre_idx ON pages (id_jeu, ordre) INCLUDE (id_page);
+
+-- Transitions d'une page par priorité ; la cible est incluse pour un parcours
+-- d'index seul
+CREATE INDEX IF NOT EXISTS transitions_source_priorite_idx
+    ON transitions (id_page_source, priorite, id_transition) INCLUDE (id_page_cible);
+
+-- Suppression d'une page : recherche des transitions qui la visent
+CREATE INDEX IF NOT EXISTS transitions_cible_idx ON transitions (id_page_cible);
+
+CREATE INDEX IF NOT EXISTS pnj_jeu_idx ON pnj (id_jeu);
+
+CREATE INDEX IF NOT EXISTS enigmes_pnj_idx ON enigmes (id_pnj);
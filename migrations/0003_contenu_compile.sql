@@ -0,0 +1,17 @@
+-- Artefacts calculés à l'enregistrement d'une page ou d'un jeu, lus tels quels
+-- par les routes de jeu. Les lignes existantes sont complétées au démarrage
+-- (jouer.compiler_contenus).
+
+ALTER TABLE pages
+    ADD COLUMN IF NOT EXISTS contenu_compile TEXT DEFAULT NULL,
+    ADD COLUMN IF NOT EXISTS tts_texte TEXT DEFAULT NULL,
+    ADD COLUMN IF NOT EXISTS tts_voix TEXT DEFAULT NULL;
+
+COMMENT ON COLUMN pages.contenu_compile IS 'Contenu sans le marqueur <!--tts:...-->';
+COMMENT ON COLUMN pages.tts_texte IS 'Texte du marqueur TTS';
+COMMENT ON COLUMN pages.tts_voix IS 'Voix du marqueur TTS';
+
+ALTER TABLE jeux
+    ADD COLUMN IF NOT EXISTS slug TEXT DEFAULT NULL;
+
+COMMENT ON COLUMN jeux.slug IS 'Titre en slug : dossier static/jeux/<slug>';
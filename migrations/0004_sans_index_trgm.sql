@@ -0,0 +1,4 @@
+-- Les intentions sont comparées en mémoire (ds9_intentions) : aucune requête
+-- n'utilisait l'index trigramme que créaient les premières versions de 0002.
+-- L'extension pg_trgm, si elle a été créée, est laissée en place.
+DROP INDEX IF EXISTS transitions_intention_trgm_idx;